@@ -1,3 +1,4 @@
+from typing import Any, Dict, List
 from pydantic import BaseModel
 
 class InputData(BaseModel):
@@ -45,4 +46,10 @@ class InputData(BaseModel):
     PC42: float
     PC43: float
     PC44: float
-    PC45: float
\ No newline at end of file
+    PC45: float
+
+class RawInputData(BaseModel):
+    """
+    Cleaned xDR records, keyed by column name, to be transformed by the fitted preprocessing pipeline.
+    """
+    records: List[Dict[str, Any]]
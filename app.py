@@ -1,23 +1,225 @@
-from fastapi import FastAPI, HTTPException
-from InputData import InputData
-import pickle
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
+import os
+import sys
+import json
+import asyncio
+import logging
+import threading
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from InputData import InputData, RawInputData
+import numpy as np
 
-# Load the model and scaler
-with open("/media/moraa/New Volume/Ontita/10Academy/Cohort B/Projects/Week1/User_Analytics_in_the_telecommunication_Industry/artifacts/models/kmeans_model.pkl", "rb") as f:
-    model = pickle.load(f)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from config import ARTIFACTS_DIR, PREDICT_BATCH_MAX_ROWS, PREDICT_BATCH_MAX_BYTES_PER_VALUE, PREDICT_STREAM_BLOCK_ROWS
+from config import PREDICT_RAW_MAX_RECORDS
+from config import MODEL_REGISTRY_DIR, MODEL_RELOAD_INTERVAL
+from components.centroid_model import CentroidModel
+from components.segment_index import SEGMENT_MSISDN_FILE, SegmentIndex
+from components.model_registry import current_version, verify_version, version_dir
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Directory holding the exported model centroids and the fitted preprocessing pipeline, used
+# when the model registry has no active version
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(ARTIFACTS_DIR, "models"))
+REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", MODEL_REGISTRY_DIR)
+RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", MODEL_RELOAD_INTERVAL))
+# Token required by the admin endpoints when set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+class ServedModel:
+    """
+    One loaded model version: the memory-mapped centroids and, once a request needs it, the
+    preprocessing pipeline saved with them.
+    """
+
+    def __init__(self, model_dir, version=None, load_preprocessor=False):
+        self.model_dir = model_dir
+        self.version = version
+        self.model = CentroidModel(model_dir)
+        # Score one row so the centroid pages are faulted in before the model takes traffic
+        self.model.predict(np.zeros((1, self.model.n_features_in_)))
+        self._preprocessor = None
+        self._segment_index = None
+        self._lock = threading.Lock()
+        if load_preprocessor:
+            self.get_preprocessor()
+
+    @property
+    def preprocessor_loaded(self):
+        return self._preprocessor is not None
+
+    def get_preprocessor(self):
+        """
+        Load the fitted preprocessing pipeline on first use, or return None if there is none.
+
+        The pipeline needs pandas and scikit-learn, so it is only loaded by the first request
+        that needs it.
+        """
+        path = os.path.join(self.model_dir, "preprocessor.pkl")
+        with self._lock:
+            if self._preprocessor is None and os.path.exists(path):
+                import pickle
+                with open(path, "rb") as f:
+                    self._preprocessor = pickle.load(f)
+        return self._preprocessor
+
+    def get_segment_index(self):
+        """
+        Memory-map the segment index of this version on first use, or return None if it has none.
+        A registry version gets its index as a new version, so only an unversioned MODEL_DIR
+        can gain one while it is served.
+        """
+        with self._lock:
+            if self._segment_index is None and os.path.exists(os.path.join(self.model_dir, SEGMENT_MSISDN_FILE)):
+                self._segment_index = SegmentIndex(self.model_dir)
+        return self._segment_index
+
+
+def load_served_model(load_preprocessor=False):
+    """
+    Load the active registry version after checking its checksums, or MODEL_DIR if there is none.
+    """
+    # CURRENT is read once, so the directory loaded is the version verified even if an
+    # activation or a rollback happens meanwhile
+    version = current_version(REGISTRY_DIR)
+    if version is not None:
+        verify_version(version, REGISTRY_DIR)
+    model_dir = version_dir(version, REGISTRY_DIR) if version else MODEL_DIR
+    return ServedModel(model_dir, version, load_preprocessor)
+
+
+# Memory-map the model centroids once at startup; workers share the mapped pages
+served = load_served_model()
+_reload_lock = threading.Lock()
+
+
+def reload_model(force=False):
+    """
+    Load the active version next to the one being served and swap it in.
+
+    Requests in flight keep the version they started with; rebinding `served` is atomic, so
+    every request sees either the old or the new version as a whole. If loading fails the
+    current version keeps serving.
+    """
+    global served
+    with _reload_lock:
+        if not force and current_version(REGISTRY_DIR) == served.version:
+            return served
+        # Warm up the pipeline too if the current version already had to load it
+        new = load_served_model(load_preprocessor=served.preprocessor_loaded)
+        previous, served = served, new
+        logger.info("Model version %s replaced by %s", previous.version, new.version)
+        return new
+
+
+async def watch_registry():
+    """
+    Reload the model whenever the active registry version changes, e.g. after a publish or a rollback.
+    """
+    while True:
+        await asyncio.sleep(RELOAD_INTERVAL)
+        try:
+            await run_in_threadpool(reload_model)
+        except Exception as e:
+            logger.error("Model reload failed, still serving version %s: %s", served.version, e)
 
 app = FastAPI()
 
-# Function to standardize numerical values
-def standardize_numerical_values(df):
+
+@app.on_event("startup")
+async def start_registry_watch():
+    if RELOAD_INTERVAL > 0:
+        asyncio.get_event_loop().create_task(watch_registry())
+
+# Content types accepted by the batch endpoint
+JSON_TYPE = "application/json"
+NDJSON_TYPE = "application/x-ndjson"
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+BINARY_TYPE = "application/octet-stream"
+
+
+def parse_batch(body, content_type, model):
+    """
+    Decode a batch request body into a float64 matrix with one row per feature vector.
+
+    - application/json: an array of arrays
+    - application/x-ndjson: one array per line
+    - application/vnd.apache.arrow.stream: an Arrow IPC stream with one column per feature
+    - application/octet-stream: little-endian float64 values, row after row
+    """
+    if content_type == JSON_TYPE:
+        return np.asarray(json.loads(body), dtype=np.float64)
+    if content_type == NDJSON_TYPE:
+        return np.asarray([json.loads(line) for line in body.splitlines() if line.strip()], dtype=np.float64)
+    if content_type == ARROW_TYPE:
+        import pyarrow as pa
+        table = pa.ipc.open_stream(body).read_all()
+        return np.column_stack([column.to_numpy(zero_copy_only=False) for column in table.columns]).astype(np.float64)
+    if content_type == BINARY_TYPE:
+        if len(body) % (8 * model.n_features_in_):
+            raise ValueError(f"Body is not a whole number of {model.n_features_in_}-value float64 rows")
+        return np.frombuffer(body, dtype="<f8").reshape(-1, model.n_features_in_)
+    raise ValueError(f"Unsupported content type '{content_type}'")
+
+
+def max_batch_bytes(model):
+    """
+    The largest batch body accepted: PREDICT_BATCH_MAX_ROWS rows at PREDICT_BATCH_MAX_BYTES_PER_VALUE
+    bytes per value, plus room for the Arrow schema.
+    """
+    return PREDICT_BATCH_MAX_ROWS * model.n_features_in_ * PREDICT_BATCH_MAX_BYTES_PER_VALUE + 2 ** 16
+
+
+async def read_batch_body(request, max_bytes):
     """
-    Standardize numerical values using StandardScaler.
+    Read a request body, rejecting it with 413 as soon as it is known to exceed `max_bytes`:
+    from its Content-Length before reading anything, or while it is streamed in otherwise.
     """
-    numerical_cols = df.select_dtypes(include=['float64', 'int64']).columns
-    scaler = StandardScaler()
-    df[numerical_cols] = scaler.fit_transform(df[numerical_cols])
+    too_large = HTTPException(status_code=413, detail=f"Batch bodies are limited to {max_bytes} bytes")
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        raise too_large
+    body = bytearray()
+    async for block in request.stream():
+        body += block
+        if len(body) > max_bytes:
+            raise too_large
+    return bytes(body)
+
+
+def score_batch(body, content_type, model):
+    """
+    Parse, validate and score a batch body. Runs in the thread pool, off the event loop.
+    """
+    features = parse_batch(body, content_type, model)
+    validate_batch(features, model)
+    return model.predict(features)
+
+
+def validate_batch(features, model):
+    """
+    Check the shape and values of a whole batch at once.
+    """
+    if features.ndim != 2 or features.shape[1] != model.n_features_in_:
+        raise ValueError(f"Expected rows of {model.n_features_in_} values, got an array of shape {features.shape}")
+    if len(features) > PREDICT_BATCH_MAX_ROWS:
+        raise ValueError(f"At most {PREDICT_BATCH_MAX_ROWS} rows are accepted per request")
+    if not np.isfinite(features).all():
+        raise ValueError(f"Non-finite values in rows {np.flatnonzero(~np.isfinite(features).all(axis=1))[:10].tolist()}")
+
+
+def stream_predictions(predictions):
+    """
+    Yield predictions as newline-delimited JSON, one cluster label per line, in blocks.
+    """
+    for start in range(0, len(predictions), PREDICT_STREAM_BLOCK_ROWS):
+        block = predictions[start:start + PREDICT_STREAM_BLOCK_ROWS]
+        yield "\n".join(map(str, block.tolist())) + "\n"
 
 @app.get("/")
 async def root():
@@ -30,24 +232,105 @@ async def get_predict():
 @app.post("/predict/")
 async def predict(data: InputData):
     try:
-        # Convert input data to DataFrame
-        input_data = pd.DataFrame([data.dict()])
-
-        # Standardize input data
-        input_data = standardize_numerical_values(input_data)
-
-        # Extract features from the standardized data
-        features = input_data.values
+        # The principal components are already in the space the model was trained in
+        features = np.array([list(data.dict().values())], dtype=np.float64)
 
         # Make predictions
-        prediction = model.predict(features)
+        prediction = served.model.predict(features)
 
         return {"prediction": prediction.tolist()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def transform_raw(records, preprocessor):
+    """
+    Apply the preprocessing fitted at training time to raw records, without refitting. Runs in
+    the thread pool, off the event loop.
+    """
+    import pandas as pd
+    return preprocessor.transform(pd.DataFrame(records)).values
+
+
+@app.post("/predict/raw/")
+async def predict_raw(data: RawInputData):
+    if len(data.records) > PREDICT_RAW_MAX_RECORDS:
+        raise HTTPException(status_code=413, detail=f"At most {PREDICT_RAW_MAX_RECORDS} records are accepted per request")
+    # Keep the same version for the whole request, even if a reload swaps it meanwhile
+    current = served
+    # Unpickling the pipeline on first use and transforming take a while, so other requests
+    # keep being served meanwhile
+    preprocessor = await run_in_threadpool(current.get_preprocessor)
+    if preprocessor is None:
+        raise HTTPException(status_code=503, detail="No preprocessing pipeline is available")
+    try:
+        features = await run_in_threadpool(transform_raw, data.records, preprocessor)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        prediction = current.model.predict(features)
+
+        return {"prediction": prediction.tolist(), "preprocessor_version": preprocessor.version,
+                "model_version": current.version}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/predict/batch/")
+async def predict_batch(request: Request):
+    current = served
+    content_type = request.headers.get("content-type", JSON_TYPE).split(";")[0].strip()
+    body = await read_batch_body(request, max_batch_bytes(current.model))
+    try:
+        # Parsing and scoring a large batch takes a while, so other requests keep being served meanwhile
+        predictions = await run_in_threadpool(score_batch, body, content_type, current.model)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return StreamingResponse(stream_predictions(predictions), media_type=NDJSON_TYPE,
+                             headers={"X-Rows": str(len(predictions)), "X-Model-Version": str(current.version)})
+
+
+@app.get("/segment/{msisdn}")
+async def get_segment(msisdn: int):
+    current = served
+    index = current.get_segment_index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="No segment index is available for the served model")
+
+    # Binary search over the sorted MSISDNs; the model is not run
+    segment = index.lookup(msisdn)
+    if segment is None:
+        raise HTTPException(status_code=404, detail=f"MSISDN {msisdn} is not in the segment index")
+    return {"msisdn": msisdn, "segment": segment, "model_version": current.version}
+
+
+def check_admin_token(token):
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.get("/admin/model/")
+async def model_info(x_admin_token: str = Header(None)):
+    check_admin_token(x_admin_token)
+    current = served
+    return {"version": current.version, "model_dir": current.model_dir,
+            "n_clusters": current.model.n_clusters, "n_features": current.model.n_features_in_,
+            "active_version": current_version(REGISTRY_DIR)}
+
+
+@app.post("/admin/reload/")
+async def reload(x_admin_token: str = Header(None)):
+    check_admin_token(x_admin_token)
+    try:
+        # Load off the event loop so requests keep being served by the current version meanwhile
+        current = await run_in_threadpool(reload_model, True)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving version {served.version}: {e}")
+    return {"version": current.version}
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,64 @@
+"""
+Compare the throughput of the single-row and batch prediction endpoints.
+
+The app is exercised in-process with FastAPI's TestClient, so the numbers include request
+parsing, validation, scoring and response serialization but not the network. The model is
+loaded from MODEL_DIR (artifacts/models by default):
+
+    python benchmarks/api_throughput.py [<single_requests>] [<batch_rows>]
+"""
+import os
+import sys
+import json
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from fastapi.testclient import TestClient
+
+import app
+
+
+def time_single(client, rows):
+    """
+    Score rows one POST /predict/ request at a time and return rows per second.
+    """
+    start = time.perf_counter()
+    for row in rows:
+        response = client.post("/predict/", json={f"PC{i + 1}": value for i, value in enumerate(row)})
+        response.raise_for_status()
+    return len(rows) / (time.perf_counter() - start)
+
+
+def time_batch(client, rows, content_type):
+    """
+    Score all rows with one POST /predict/batch/ request and return rows per second.
+    """
+    if content_type == app.JSON_TYPE:
+        body = json.dumps(rows.tolist())
+    elif content_type == app.NDJSON_TYPE:
+        body = "\n".join(json.dumps(row) for row in rows.tolist())
+    else:
+        body = rows.astype("<f8").tobytes()
+    start = time.perf_counter()
+    response = client.post("/predict/batch/", content=body, headers={"Content-Type": content_type})
+    response.raise_for_status()
+    assert len(response.text.splitlines()) == len(rows)
+    return len(rows) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    single_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    batch_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    rng = np.random.default_rng(42)
+    rows = rng.normal(size=(batch_rows, app.served.model.n_features_in_))
+    client = TestClient(app.app)
+
+    print(f"{'single /predict/':<32} {time_single(client, rows[:single_requests]):12,.0f} rows/s")
+    for content_type in (app.JSON_TYPE, app.NDJSON_TYPE, app.BINARY_TYPE):
+        label = f"batch {content_type}"
+        print(f"{label:<32} {time_batch(client, rows, content_type):12,.0f} rows/s")
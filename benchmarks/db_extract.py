@@ -0,0 +1,67 @@
+"""
+Benchmark full-table reads from PostgreSQL: one connection against the partitioned parallel
+extract of every mode, checking that each extract holds exactly the rows of the table.
+
+Connection settings are read from the same .env variables as DBConnection, so point
+them at a local PostgreSQL instance before running. The synthetic sessions are loaded into
+bench_db_extract, which is dropped at the end:
+
+    python benchmarks/db_extract.py <num_rows> [<partitions> [<workers>]]
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLE_NAME = 'bench_db_extract'
+
+
+def row_hashes(df):
+    """
+    The sorted hashes of the rows of a frame, equal for frames holding the same rows in any order.
+    """
+    return np.sort(pd.util.hash_pandas_object(df, index=False).to_numpy())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3, 4):
+        print("Usage: python benchmarks/db_extract.py <num_rows> [<partitions> [<workers>]]")
+        sys.exit(1)
+
+    num_rows = int(sys.argv[1])
+    # Must be set before the project modules read their configuration
+    os.environ.setdefault('ARTIFACTS_DIR', tempfile.mkdtemp(prefix='xdr_extract_'))
+    sys.path[:0] = [os.path.join(ROOT_DIR, 'src'), os.path.join(ROOT_DIR, 'benchmarks')]
+
+    from config import EXTRACT_PARTITIONS, EXTRACT_WORKERS
+    from synthetic_xdr import write_xdr_table
+    from components.db_connections import DBConnection
+    from components.extraction import extract_table, load_partitions
+
+    partitions = int(sys.argv[2]) if len(sys.argv) >= 3 else EXTRACT_PARTITIONS
+    workers = int(sys.argv[3]) if len(sys.argv) == 4 else EXTRACT_WORKERS
+    write_xdr_table(num_rows, TABLE_NAME)
+
+    with DBConnection() as db_connection:
+        start = time.perf_counter()
+        expected = db_connection.read_table_to_dataframe(TABLE_NAME)
+        elapsed = time.perf_counter() - start
+        print(f"{'one connection':<20} {elapsed:8.2f}s  {num_rows / elapsed:12,.0f} rows/s")
+        expected = row_hashes(expected)
+
+        try:
+            for mode in ('range', 'time', 'hash'):
+                start = time.perf_counter()
+                output_dir = extract_table(TABLE_NAME, mode=mode, partitions=partitions, workers=workers)
+                elapsed = time.perf_counter() - start
+                same = np.array_equal(row_hashes(load_partitions(output_dir)), expected)
+                print(f"{mode + ' x' + str(workers):<20} {elapsed:8.2f}s  {num_rows / elapsed:12,.0f} rows/s"
+                      f"  {'same rows' if same else 'ROWS DIFFER'}")
+        finally:
+            with db_connection.engine.begin() as conn:
+                conn.exec_driver_sql(f'DROP TABLE IF EXISTS {TABLE_NAME}')
+    print(f"Artifacts written to {os.environ['ARTIFACTS_DIR']}")
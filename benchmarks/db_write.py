@@ -0,0 +1,61 @@
+"""
+Benchmark DataFrame writes to PostgreSQL: row INSERTs against COPY FROM STDIN.
+
+Connection settings are read from the same .env variables as DBConnection, so point
+them at a local PostgreSQL instance before running:
+
+    python benchmarks/db_write.py <num_rows> [<num_columns>]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from components.db_connections import DBConnection
+
+
+def make_frame(num_rows, num_columns):
+    """
+    Build a frame shaped like a per-user aggregate table: one ID column and float metrics.
+    """
+    rng = np.random.default_rng(42)
+    df = pd.DataFrame(rng.random((num_rows, num_columns)) * 1e6,
+                      columns=[f'metric_{i}' for i in range(num_columns)])
+    df.insert(0, 'MSISDN/Number', rng.integers(33600000000, 33799999999, size=num_rows))
+    return df
+
+
+def time_write(db_connection, df, table_name, **kwargs):
+    """
+    Time one write_dataframe_to_table call and return the elapsed seconds.
+    """
+    start = time.perf_counter()
+    db_connection.write_dataframe_to_table(df, table_name, **kwargs)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python benchmarks/db_write.py <num_rows> [<num_columns>]")
+        sys.exit(1)
+
+    num_rows = int(sys.argv[1])
+    num_columns = int(sys.argv[2]) if len(sys.argv) == 3 else 20
+    df = make_frame(num_rows, num_columns)
+
+    with DBConnection() as db_connection:
+        cases = [
+            ('insert', dict(method='insert', atomic=False)),
+            ('copy', dict(method='copy', atomic=False)),
+            ('copy + staging swap', dict(method='copy', atomic=True)),
+        ]
+        for label, kwargs in cases:
+            elapsed = time_write(db_connection, df, 'bench_db_write', **kwargs)
+            print(f"{label:<20} {elapsed:8.2f}s  {num_rows / elapsed:12,.0f} rows/s")
+
+        with db_connection.engine.begin() as conn:
+            conn.exec_driver_sql('DROP TABLE IF EXISTS bench_db_write')
@@ -0,0 +1,174 @@
+"""
+End-to-end benchmark: generate synthetic xDR sessions, time every pipeline stage and the
+segment index build, then measure the latency percentiles of the API endpoints.
+
+Results are compared with the baselines stored in benchmarks/baselines.json for the same
+number of rows. The script exits with status 1 if a metric is more than TOLERANCE slower than
+its baseline, so it can gate CI; set BENCHMARK_TOLERANCE to loosen it on noisy runners. Baselines depend on the machine: record them on the machine
+that runs the comparison with --update-baseline.
+
+Everything is written to a temporary artifacts directory, so the real model registry and
+cache are left alone:
+
+    python benchmarks/suite.py [<num_rows>] [--update-baseline]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_FILE = os.path.join(ROOT_DIR, 'benchmarks', 'baselines.json')
+
+# A metric regresses when it is slower than its baseline by more than TOLERANCE, relative, and
+# by more than a few milliseconds, absolute, so that timer noise on fast steps does not fail the run.
+# p99 latencies are reported but not compared: a few slow requests out of a few hundred decide them
+TOLERANCE = float(os.getenv('BENCHMARK_TOLERANCE', 0.5))
+MIN_REGRESSION_S = 0.02
+MIN_LATENCY_REGRESSION_S = 0.0005
+UNGATED_SUFFIXES = ('.p99_s',)
+
+NUM_CLUSTERS = 4
+# Stage and segmentation timings are the fastest of this many runs
+PIPELINE_REPEATS = 3
+SINGLE_REQUESTS = 500
+BATCH_REQUESTS = 50
+BATCH_ROWS = 10000
+SEGMENT_REQUESTS = 500
+# Untimed requests sent first to every endpoint
+WARMUP_REQUESTS = 5
+
+
+def percentiles(latencies, prefix):
+    latencies = np.asarray(latencies)
+    return {f'{prefix}.p50_s': float(np.percentile(latencies, 50)),
+            f'{prefix}.p95_s': float(np.percentile(latencies, 95)),
+            f'{prefix}.p99_s': float(np.percentile(latencies, 99))}
+
+
+def time_requests(send, count):
+    """
+    Call `send(i)` `count` times and return the latency of every call in seconds, after
+    WARMUP_REQUESTS untimed calls.
+    """
+    for i in range(WARMUP_REQUESTS):
+        send(i).raise_for_status()
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        response = send(i)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return latencies
+
+
+def run_benchmarks(num_rows):
+    """
+    Run every benchmark on `num_rows` synthetic sessions and return {metric: seconds}.
+    """
+    from synthetic_xdr import write_xdr_artifact
+    from components.pipeline import run_pipeline
+    from components.segmentation import build_segment_index
+    import config
+
+    metrics = {}
+    start = time.perf_counter()
+    raw_path = write_xdr_artifact(num_rows)
+    metrics['generate.wall_time_s'] = time.perf_counter() - start
+
+    for _ in range(PIPELINE_REPEATS):
+        report = run_pipeline(raw_path, NUM_CLUSTERS, force=True)
+        for name, stage in report['stages'].items():
+            key = f'pipeline.{name}.wall_time_s'
+            metrics[key] = min(metrics.get(key, np.inf), stage['wall_time_s'])
+
+    def stage_output(stage, name):
+        return os.path.join(config.PIPELINE_CACHE_DIR, stage, report['stages'][stage]['key'], name + '.feather')
+
+    cleaned_path = stage_output('clean', 'cleaned_data')
+    for _ in range(PIPELINE_REPEATS):
+        start = time.perf_counter()
+        build_segment_index(cleaned_path, stage_output('transform', 'transformed_data'))
+        metrics['segmentation.wall_time_s'] = min(metrics.get('segmentation.wall_time_s', np.inf),
+                                                  time.perf_counter() - start)
+
+    # The app loads the model version published with the last segment index
+    from fastapi.testclient import TestClient
+    from utils import load_artifact
+    import app
+
+    client = TestClient(app.app)
+    rng = np.random.default_rng(0)
+    num_features = app.served.model.n_features_in_
+    rows = rng.normal(size=(SINGLE_REQUESTS, num_features))
+    payloads = [{f"PC{i + 1}": value for i, value in enumerate(row)} for row in rows.tolist()]
+    metrics.update(percentiles(time_requests(lambda i: client.post("/predict/", json=payloads[i]), SINGLE_REQUESTS),
+                               'api.predict'))
+
+    batch = rng.normal(size=(BATCH_ROWS, num_features)).astype('<f8').tobytes()
+    metrics.update(percentiles(time_requests(
+        lambda i: client.post("/predict/batch/", content=batch, headers={"Content-Type": app.BINARY_TYPE}),
+        BATCH_REQUESTS), 'api.predict_batch'))
+
+    msisdn = load_artifact(cleaned_path, columns=[config.MSISDN_COLUMN])[config.MSISDN_COLUMN].dropna()
+    msisdn = msisdn[msisdn % 1 == 0].astype('int64').to_numpy()
+    lookups = rng.choice(msisdn, SEGMENT_REQUESTS)
+    metrics.update(percentiles(time_requests(lambda i: client.get(f"/segment/{lookups[i]}"), SEGMENT_REQUESTS),
+                               'api.segment'))
+    return metrics
+
+
+def compare(metrics, baseline):
+    """
+    Return the metrics slower than their baseline beyond the tolerance, as {metric: (value, baseline)}.
+    """
+    regressions = {}
+    for name, value in metrics.items():
+        if name not in baseline or name.endswith(UNGATED_SUFFIXES):
+            continue
+        min_regression = MIN_REGRESSION_S if name.endswith('.wall_time_s') else MIN_LATENCY_REGRESSION_S
+        if value > baseline[name] * (1 + TOLERANCE) and value - baseline[name] > min_regression:
+            regressions[name] = (value, baseline[name])
+    return regressions
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != '--update-baseline']
+    if len(args) > 1:
+        print("Usage: python benchmarks/suite.py [<num_rows>] [--update-baseline]")
+        sys.exit(1)
+    num_rows = int(args[0]) if args else 100000
+    update_baseline = '--update-baseline' in sys.argv
+
+    # Must be set before the project modules read their configuration
+    os.environ.setdefault('ARTIFACTS_DIR', tempfile.mkdtemp(prefix='xdr_benchmark_'))
+    os.environ['MODEL_RELOAD_INTERVAL'] = '0'
+    sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, 'src'), os.path.join(ROOT_DIR, 'benchmarks')]
+
+    metrics = run_benchmarks(num_rows)
+
+    baselines = {}
+    if os.path.exists(BASELINES_FILE):
+        with open(BASELINES_FILE) as f:
+            baselines = json.load(f)
+    baseline = baselines.get(str(num_rows), {})
+    regressions = compare(metrics, baseline)
+
+    print(f"{'metric':<36} {'seconds':>10} {'baseline':>10}")
+    for name, value in metrics.items():
+        flag = '  REGRESSION' if name in regressions else ''
+        reference = f"{baseline[name]:10.4f}" if name in baseline else f"{'-':>10}"
+        print(f"{name:<36} {value:10.4f} {reference}{flag}")
+    print(f"Artifacts written to {os.environ['ARTIFACTS_DIR']}")
+
+    if update_baseline:
+        baselines[str(num_rows)] = metrics
+        with open(BASELINES_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baseline for {num_rows} rows saved to {BASELINES_FILE}")
+    elif regressions:
+        print(f"{len(regressions)} metrics regressed by more than {TOLERANCE:.0%}")
+        sys.exit(1)
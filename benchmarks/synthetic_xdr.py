@@ -0,0 +1,263 @@
+"""
+Deterministic synthetic xDR sessions with the schema, value ranges and null rates of the
+real xdr_data table, for benchmarks and for running the pipeline without the database.
+
+Rows are generated in fixed blocks, each from its own seeded random generator, so the same
+seed and row count always give the same data. Memory use is one block, so tens of millions of
+rows can be written:
+
+    python benchmarks/synthetic_xdr.py <num_rows> [<artifact_name>] [--table <table_name>]
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+# Rows generated from one random generator
+BLOCK_ROWS = 100000
+
+# Sessions drawn per MSISDN of the subscriber pool. With uniform draws, the MSISDNs that
+# appear then average 1.4 sessions, as in the real table (150,001 sessions, 106,856 MSISDNs)
+SESSIONS_PER_SUBSCRIBER = 0.75
+
+# Share of missing values of every nullable column in the real table
+NULL_RATES = {
+    'Bearer Id': 0.0066,
+    'IMSI': 0.0038,
+    'MSISDN/Number': 0.0071,
+    'IMEI': 0.0038,
+    'Last Location Name': 0.0077,
+    'Avg RTT DL (ms)': 0.1855,
+    'Avg RTT UL (ms)': 0.1854,
+    'TCP DL Retrans. Vol (Bytes)': 0.5876,
+    'TCP UL Retrans. Vol (Bytes)': 0.6443,
+    'HTTP DL (Bytes)': 0.5432,
+    'HTTP UL (Bytes)': 0.5454,
+    'Nb of sec with 125000B < Vol DL': 0.6502,
+    'Nb of sec with 1250B < Vol UL < 6250B': 0.6193,
+    'Nb of sec with 31250B < Vol DL < 125000B': 0.6239,
+    'Nb of sec with 37500B < Vol UL': 0.8684,
+    'Nb of sec with 6250B < Vol DL < 31250B': 0.5888,
+    'Nb of sec with 6250B < Vol UL < 37500B': 0.7456,
+    'Nb of sec with Vol DL < 6250B': 0.0050,
+    'Nb of sec with Vol UL < 1250B': 0.0053,
+}
+# Columns missing together in the real table: the whole device record or a whole histogram
+DEVICE_COLUMNS = ['IMSI', 'IMEI', 'Handset Manufacturer', 'Handset Type']
+DL_TP_COLUMNS = ['DL TP < 50 Kbps (%)', '50 Kbps < DL TP < 250 Kbps (%)',
+                 '250 Kbps < DL TP < 1 Mbps (%)', 'DL TP > 1 Mbps (%)']
+UL_TP_COLUMNS = ['UL TP < 10 Kbps (%)', '10 Kbps < UL TP < 50 Kbps (%)',
+                 '50 Kbps < UL TP < 300 Kbps (%)', 'UL TP > 300 Kbps (%)']
+DL_TP_NULL_RATE = 0.0050
+UL_TP_NULL_RATE = 0.0053
+
+# Upper bounds of the per-application volumes, which are close to uniform in the real table
+APP_BYTES = {
+    'Social Media': (3.6e6, 6.6e4),
+    'Google': (1.2e7, 4.4e6),
+    'Email': (3.6e6, 1.1e6),
+    'Youtube': (2.3e7, 2.2e7),
+    'Netflix': (2.3e7, 2.2e7),
+    'Gaming': (8.4e8, 1.7e7),
+    'Other': (8.4e8, 1.7e7),
+}
+
+# Handsets and their share of sessions, most frequent first
+HANDSETS = [
+    ('Huawei', 'Huawei B528S-23A', 0.133), ('Apple', 'Apple iPhone 6S (A1688)', 0.064),
+    ('Apple', 'Apple iPhone 6 (A1586)', 0.060), ('undefined', 'undefined', 0.060),
+    ('Apple', 'Apple iPhone 7 (A1778)', 0.041), ('Apple', 'Apple iPhone Se (A1723)', 0.036),
+    ('Apple', 'Apple iPhone 8 (A1905)', 0.034), ('Apple', 'Apple iPhone Xr (A2105)', 0.034),
+    ('Samsung', 'Samsung Galaxy S8 (Sm-G950F)', 0.030), ('Apple', 'Apple iPhone X (A1901)', 0.026),
+    ('Samsung', 'Samsung Galaxy A5 Sm-A520F', 0.021), ('Huawei', 'Huawei P20 Lite Huawei Nova 3E', 0.020),
+    ('Samsung', 'Samsung Galaxy J5 (Sm-J530)', 0.019), ('Samsung', 'Samsung Galaxy J3 (Sm-J330)', 0.018),
+    ('Huawei', 'Huawei Mate 20 Lite', 0.016), ('Samsung', 'Samsung Galaxy A8 (2018)', 0.015),
+    ('Huawei', 'Huawei P20', 0.014), ('Samsung', 'Samsung Galaxy S9 (Sm-G960F)', 0.013),
+    ('Apple', 'Apple iPhone Xs (A2097)', 0.012), ('Huawei', 'Huawei Y6 2018', 0.011),
+    ('Xiaomi', 'Xiaomi Redmi Note 7', 0.010), ('Oppo', 'Oppo A5', 0.009),
+    ('Samsung', 'Samsung Sm-G390F', 0.009), ('Apple', 'Apple iPhone 5S (A1457)', 0.009),
+]
+OTHER_HANDSET_SHARE = 1 - sum(share for _, _, share in HANDSETS)
+OTHER_HANDSETS = 1500
+
+# Distinct cell locations
+LOCATIONS = 45000
+
+# Sessions start in April 2019 and last between the shortest and longest real sessions
+START_TIME = pd.Timestamp('2019-04-01')
+START_SPAN_S = 30 * 24 * 3600
+MIN_DURATION_MS = 7142
+MAX_DURATION_MS = 1859336
+
+
+def _lognormal(rng, n, median, sigma):
+    return np.round(rng.lognormal(np.log(median), sigma, n))
+
+
+def _with_nulls(rng, values, rate):
+    values = values.astype(np.float64)
+    values[rng.random(len(values)) < rate] = np.nan
+    return values
+
+
+def _names(rng, n, prefix_letters, digits):
+    """
+    Identifiers like L77566A: a letter, `digits` digits and a letter.
+    """
+    letters = np.array(list(prefix_letters))
+    return np.char.add(np.char.add(rng.choice(letters, n),
+                                   np.char.zfill(rng.integers(0, 10 ** digits, n).astype(str), digits)),
+                       rng.choice(letters, n)).astype(object)
+
+
+def _pools(seed):
+    """
+    Lookup values shared by every block: handsets, cell locations and the Start/End label of
+    every minute a session can start or end in, since formatting timestamps row by row is slow.
+    """
+    rng = np.random.default_rng([seed, 2 ** 32 - 1])
+    manufacturers = [m for m, _, _ in HANDSETS] + list(rng.choice(['Samsung', 'Huawei', 'Apple', 'Xiaomi', 'Oppo', 'Lenovo', 'Nokia'], OTHER_HANDSETS))
+    types = [t for _, t, _ in HANDSETS] + [f"{m} Model {i:04d}" for i, m in enumerate(manufacturers[len(HANDSETS):])]
+    shares = np.r_[[share for _, _, share in HANDSETS], np.full(OTHER_HANDSETS, OTHER_HANDSET_SHARE / OTHER_HANDSETS)]
+    return {
+        'manufacturers': np.array(manufacturers, dtype=object),
+        'types': np.array(types, dtype=object),
+        'handset_cdf': np.cumsum(shares) / shares.sum(),
+        'locations': _names(rng, LOCATIONS, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 5),
+        'minutes': (START_TIME + pd.to_timedelta(np.arange((START_SPAN_S + MAX_DURATION_MS // 1000) // 60 + 1), unit='min'))
+        .strftime('%m/%d/%Y %H:%M').to_numpy(dtype=object),
+    }
+
+
+def generate_block(block, num_rows, num_subscribers, seed, pools):
+    """
+    Generate the sessions of one block. Every column comes from the generator of the block, in
+    a fixed order, so a block only depends on the seed, its index and its size.
+    """
+    rng = np.random.default_rng([seed, block])
+    n = num_rows
+    df = {}
+
+    df['Bearer Id'] = _with_nulls(rng, rng.uniform(6.9e18, 1.32e19, n), NULL_RATES['Bearer Id'])
+    start_s = rng.integers(0, START_SPAN_S, n)
+    duration_ms = np.clip(_lognormal(rng, n, 86399, 0.7), MIN_DURATION_MS, MAX_DURATION_MS)
+    df['Start'] = pools['minutes'][start_s // 60]
+    df['Start ms'] = rng.integers(0, 1000, n).astype(np.float64)
+    df['End'] = pools['minutes'][(start_s + duration_ms.astype(np.int64) // 1000) // 60]
+    df['End ms'] = rng.integers(0, 1000, n).astype(np.float64)
+    df['Dur. (ms)'] = duration_ms
+
+    device_missing = rng.random(n) < NULL_RATES['IMEI']
+    df['IMSI'] = 2.08201e14 + rng.integers(0, 10 ** 9, n)
+    subscriber = rng.integers(0, num_subscribers, n)
+    df['MSISDN/Number'] = _with_nulls(rng, 33601000000.0 + subscriber, NULL_RATES['MSISDN/Number'])
+    df['IMEI'] = rng.uniform(3.5e13, 8.7e13, n).round()
+    df['Last Location Name'] = pools['locations'][rng.integers(0, LOCATIONS, n)]
+    df['Last Location Name'][rng.random(n) < NULL_RATES['Last Location Name']] = None
+
+    df['Avg RTT DL (ms)'] = _with_nulls(rng, _lognormal(rng, n, 45, 0.9), NULL_RATES['Avg RTT DL (ms)'])
+    df['Avg RTT UL (ms)'] = _with_nulls(rng, _lognormal(rng, n, 5, 1.2), NULL_RATES['Avg RTT UL (ms)'])
+    # Bearer throughput is bimodal: idle bearers around 50 kbps and active ones around 20 Mbps
+    active = rng.random(n) < 0.3
+    df['Avg Bearer TP DL (kbps)'] = np.where(active, _lognormal(rng, n, 20000, 1.0), _lognormal(rng, n, 50, 0.5))
+    df['Avg Bearer TP UL (kbps)'] = np.where(active, _lognormal(rng, n, 1500, 1.0), _lognormal(rng, n, 45, 0.5))
+    df['TCP DL Retrans. Vol (Bytes)'] = _with_nulls(rng, _lognormal(rng, n, 5e5, 2.0), NULL_RATES['TCP DL Retrans. Vol (Bytes)'])
+    df['TCP UL Retrans. Vol (Bytes)'] = _with_nulls(rng, _lognormal(rng, n, 2e4, 2.0), NULL_RATES['TCP UL Retrans. Vol (Bytes)'])
+
+    # Throughput histograms in percent of the session, summing to 100
+    for columns, null_rate in ((DL_TP_COLUMNS, DL_TP_NULL_RATE), (UL_TP_COLUMNS, UL_TP_NULL_RATE)):
+        shares = np.floor(rng.dirichlet([8, 1, 0.5, 0.5], n) * 100)
+        shares[:, 0] += 100 - shares.sum(axis=1)
+        shares[rng.random(n) < null_rate] = np.nan
+        for i, col in enumerate(columns):
+            df[col] = shares[:, i]
+
+    df['HTTP DL (Bytes)'] = _with_nulls(rng, _lognormal(rng, n, 1e6, 2.5), NULL_RATES['HTTP DL (Bytes)'])
+    df['HTTP UL (Bytes)'] = _with_nulls(rng, _lognormal(rng, n, 5e4, 2.5), NULL_RATES['HTTP UL (Bytes)'])
+    df['Activity Duration DL (ms)'] = _lognormal(rng, n, 40000, 1.5)
+    df['Activity Duration UL (ms)'] = _lognormal(rng, n, 40000, 1.5)
+    df['Dur. (ms).1'] = duration_ms * 1000 + rng.integers(0, 1000, n)
+
+    handset = np.minimum(np.searchsorted(pools['handset_cdf'], rng.random(n)), len(pools['types']) - 1)
+    df['Handset Manufacturer'] = pools['manufacturers'][handset]
+    df['Handset Type'] = pools['types'][handset]
+
+    for col, median in (('Nb of sec with 125000B < Vol DL', 200), ('Nb of sec with 1250B < Vol UL < 6250B', 50),
+                        ('Nb of sec with 31250B < Vol DL < 125000B', 80), ('Nb of sec with 37500B < Vol UL', 10),
+                        ('Nb of sec with 6250B < Vol DL < 31250B', 60), ('Nb of sec with 6250B < Vol UL < 37500B', 10),
+                        ('Nb of sec with Vol DL < 6250B', 130), ('Nb of sec with Vol UL < 1250B', 150)):
+        df[col] = _with_nulls(rng, _lognormal(rng, n, median, 1.5), NULL_RATES[col])
+
+    total_dl = np.zeros(n)
+    total_ul = np.zeros(n)
+    for app, (max_dl, max_ul) in APP_BYTES.items():
+        df[f'{app} DL (Bytes)'] = rng.uniform(0, max_dl, n).round()
+        df[f'{app} UL (Bytes)'] = rng.uniform(0, max_ul, n).round()
+        total_dl += df[f'{app} DL (Bytes)']
+        total_ul += df[f'{app} UL (Bytes)']
+    df['Total UL (Bytes)'] = total_ul
+    df['Total DL (Bytes)'] = total_dl
+
+    df = pd.DataFrame(df)
+    df.loc[device_missing, DEVICE_COLUMNS] = None
+    return df
+
+
+def generate_xdr(num_rows, seed=42):
+    """
+    Yield `num_rows` synthetic xDR sessions as DataFrames of BLOCK_ROWS rows at most.
+    """
+    num_subscribers = max(1, int(num_rows / SESSIONS_PER_SUBSCRIBER))
+    pools = _pools(seed)
+    for block, start in enumerate(range(0, num_rows, BLOCK_ROWS)):
+        yield generate_block(block, min(BLOCK_ROWS, num_rows - start), num_subscribers, seed, pools)
+
+
+def write_xdr_artifact(num_rows, file_name='xdr_synthetic', seed=42):
+    """
+    Write synthetic sessions to an artifact block by block and return its path.
+    """
+    from utils import ArtifactWriter
+
+    with ArtifactWriter(file_name) as writer:
+        for chunk in generate_xdr(num_rows, seed):
+            writer.write(chunk)
+    return writer.file_path
+
+
+def write_xdr_table(num_rows, table_name, seed=42):
+    """
+    Load synthetic sessions into a database table, replacing it.
+    """
+    from components.db_connections import DBConnection
+
+    with DBConnection() as db_connection:
+        for i, chunk in enumerate(generate_xdr(num_rows, seed)):
+            if i == 0:
+                db_connection.write_dataframe_to_table(chunk, table_name)
+            else:
+                db_connection.append_dataframe_to_table(chunk, table_name)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    table_name = None
+    if '--table' in args:
+        position = args.index('--table')
+        table_name = args[position + 1] if position + 1 < len(args) else None
+        del args[position:position + 2]
+        if table_name is None:
+            args = []
+    if len(args) not in (1, 2):
+        print("Usage: python benchmarks/synthetic_xdr.py <num_rows> [<artifact_name>] [--table <table_name>]")
+        sys.exit(1)
+
+    num_rows = int(args[0])
+    if table_name:
+        write_xdr_table(num_rows, table_name)
+        print(f"{num_rows} sessions written to table {table_name}")
+    else:
+        print(write_xdr_artifact(num_rows, args[1] if len(args) == 2 else 'xdr_synthetic'))
@@ -0,0 +1,175 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import logging
+from exception import CustomException
+from utils import iter_artifact_chunks, save_artifact
+from instrumentation import instrumented, annotate
+from config import AGGREGATION_CHUNK_ROWS, MSISDN_COLUMN
+from components.db_connections import DBConnection
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Number of xDR sessions of the subscriber
+SESSIONS_COLUMN = 'Sessions'
+DURATION_COLUMN = 'Dur. (ms)'
+TOTAL_COLUMNS = ['Total DL (Bytes)', 'Total UL (Bytes)']
+APPLICATIONS = ['Social Media', 'Google', 'Email', 'Youtube', 'Netflix', 'Gaming', 'Other']
+APPLICATION_COLUMNS = [f'{app} {direction} (Bytes)' for app in APPLICATIONS for direction in ('DL', 'UL')]
+# Columns summed per subscriber, in the order of the aggregate table
+SUM_COLUMNS = [DURATION_COLUMN] + TOTAL_COLUMNS + APPLICATION_COLUMNS
+# Added to the final table: total DL + UL
+TOTAL_TRAFFIC_COLUMN = 'Total Traffic (Bytes)'
+# The same aggregates as a metric spec for DBConnection.aggregate_table
+AGGREGATE_METRICS = {SESSIONS_COLUMN: ('count', None), **{col: ('sum', col) for col in SUM_COLUMNS}}
+
+
+def group_sums(keys, columns):
+    """
+    Sum the values of every column over the rows that share a key, in a single hash-grouping
+    pass over the keys.
+
+    Args:
+    - keys (numpy.ndarray): The key of every row, without missing values.
+    - columns (list): 1-D float arrays with one value per key, or None to count the rows.
+
+    Returns:
+    - tuple: The unique keys, in order of first appearance, and the sums of every column.
+    """
+    codes, uniques = pd.factorize(keys)
+    return uniques, [np.bincount(codes, weights=values, minlength=len(uniques)) for values in columns]
+
+
+def aggregate_frame(keys, sums, columns):
+    """
+    Wrap grouped sums in a DataFrame indexed by MSISDN.
+    """
+    return pd.DataFrame(dict(zip(columns, sums)), index=pd.Index(keys, name=MSISDN_COLUMN))
+
+
+def partial_aggregates(df):
+    """
+    Aggregate one chunk of sessions per MSISDN: the number of sessions and the sum of every
+    column in SUM_COLUMNS.
+
+    Sessions without an MSISDN are left out and missing values count as 0, as with
+    `df.groupby(MSISDN_COLUMN).sum()`.
+
+    Returns:
+    - pandas.DataFrame: Indexed by MSISDN, with SESSIONS_COLUMN followed by SUM_COLUMNS.
+    """
+    msisdn = df[MSISDN_COLUMN].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(msisdn)
+    columns = [None]
+    for col in SUM_COLUMNS:
+        values = df[col].to_numpy(dtype=np.float64)[valid]
+        columns.append(np.where(np.isnan(values), 0.0, values))
+    keys, sums = group_sums(msisdn[valid], columns)
+    return aggregate_frame(keys, sums, [SESSIONS_COLUMN] + SUM_COLUMNS)
+
+
+def merge_aggregates(partials):
+    """
+    Merge partial aggregates of different chunks into one row per MSISDN.
+    """
+    columns = [SESSIONS_COLUMN] + SUM_COLUMNS
+    partials = [partial for partial in partials if len(partial)]
+    if len(partials) == 1:
+        return partials[0]
+    if not partials:
+        return aggregate_frame(np.empty(0), [np.empty(0)] * len(columns), columns)
+    keys, sums = group_sums(np.concatenate([partial.index.to_numpy() for partial in partials]),
+                            [np.concatenate([partial[col].to_numpy() for partial in partials]) for col in columns])
+    return aggregate_frame(keys, sums, columns)
+
+
+def finalize_aggregates(aggregates):
+    """
+    Turn merged aggregates into the per-subscriber feature table: one row per MSISDN in
+    ascending order, with the session count as an integer and the total traffic added.
+    """
+    df = aggregates.sort_index().reset_index()
+    df[SESSIONS_COLUMN] = df[SESSIONS_COLUMN].astype(np.int64)
+    df[TOTAL_TRAFFIC_COLUMN] = df[TOTAL_COLUMNS[0]] + df[TOTAL_COLUMNS[1]]
+    return df
+
+
+@instrumented()
+def aggregate_sessions(chunks):
+    """
+    Aggregate an iterator of session chunks per MSISDN.
+
+    Every chunk is reduced to its partial aggregates as it is read. Partials are merged into
+    the running total once they hold as many rows as it does, so every row is merged a
+    bounded number of times and memory stays proportional to the number of subscribers.
+
+    Returns:
+    - pandas.DataFrame: The per-subscriber feature table, see finalize_aggregates.
+    """
+    merged = merge_aggregates([])
+    pending, pending_rows, rows = [], 0, 0
+    for chunk in chunks:
+        rows += len(chunk)
+        partial = partial_aggregates(chunk)
+        pending.append(partial)
+        pending_rows += len(partial)
+        if pending_rows >= len(merged):
+            merged = merge_aggregates([merged] + pending)
+            pending, pending_rows = [], 0
+    df = finalize_aggregates(merge_aggregates([merged] + pending))
+    logger.info("Aggregated %d sessions into %d subscribers", rows, len(df))
+    return df
+
+
+@instrumented()
+def build_user_aggregates(source, chunksize=AGGREGATION_CHUNK_ROWS, file_name='user_aggregates', pushdown=True):
+    """
+    Compute the per-subscriber engagement features in one pass over the sessions and save them
+    as an artifact, which the pipeline can take as its source.
+
+    Args:
+    - source (str): A data file written by save_artifact, or the name of a database table.
+    - chunksize (int): The number of sessions read at a time.
+    - file_name (str): The name of the artifact to write.
+    - pushdown (bool): Whether to aggregate a table with a GROUP BY in the database, which
+      only transfers the per-subscriber rows, instead of streaming its sessions.
+
+    Returns:
+    - str: The path of the saved artifact.
+    """
+    try:
+        columns = [MSISDN_COLUMN] + SUM_COLUMNS
+        if os.path.isfile(source):
+            df = aggregate_sessions(iter_artifact_chunks(source, chunksize, columns=columns))
+        elif pushdown:
+            with DBConnection() as db_connection:
+                df = db_connection.aggregate_table(source, MSISDN_COLUMN, AGGREGATE_METRICS)
+            # SUM over a subscriber's NULLs is NULL in SQL but 0 in pandas
+            df = finalize_aggregates(df.set_index(MSISDN_COLUMN).fillna(0))
+        else:
+            with DBConnection() as db_connection:
+                df = aggregate_sessions(db_connection.read_table_in_chunks(source, chunksize, columns=columns))
+        annotate(df_out=df)
+
+        file_path = save_artifact(df, file_name)
+        logger.info("Per-subscriber aggregates saved to %s", file_path)
+        return file_path
+    except CustomException as e:
+        logger.error("Custom Exception occurred: %s", e)
+        raise
+    except Exception as e:
+        error_message = f"Error aggregating sessions: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != '--no-pushdown']
+    if len(args) not in (1, 2):
+        print("Usage: python aggregation.py <table_name|data_file> [<chunksize>] [--no-pushdown]")
+        sys.exit(1)
+
+    build_user_aggregates(args[0], int(args[1]) if len(args) == 2 else AGGREGATION_CHUNK_ROWS,
+                          pushdown='--no-pushdown' not in sys.argv)
@@ -0,0 +1,76 @@
+import os
+import json
+import numpy as np
+
+# Files of an exported K-means model inside the model directory
+CENTROIDS_FILE = "centroids.npy"
+METADATA_FILE = "centroids.json"
+
+
+def export_centroids(model, model_dir):
+    """
+    Export the cluster centers of a fitted K-means model as a plain float64 matrix plus JSON
+    metadata, so that serving can memory-map them instead of unpickling the model.
+
+    Both files are written under temporary names and renamed into place.
+
+    Args:
+        model: A fitted KMeans or MiniBatchKMeans model.
+        model_dir: The directory to write centroids.npy and centroids.json to.
+
+    Returns:
+        The path of the centroid matrix.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    centers = np.ascontiguousarray(model.cluster_centers_, dtype=np.float64)
+    metadata = {
+        'model_class': type(model).__name__,
+        'n_clusters': int(centers.shape[0]),
+        'n_features': int(centers.shape[1]),
+        'feature_names': [str(name) for name in getattr(model, 'feature_names_in_', [])],
+        'inertia': float(getattr(model, 'inertia_', float('nan'))),
+    }
+
+    centroids_path = os.path.join(model_dir, CENTROIDS_FILE)
+    metadata_path = os.path.join(model_dir, METADATA_FILE)
+    with open(centroids_path + '.tmp', 'wb') as f:
+        np.save(f, centers)
+    with open(metadata_path + '.tmp', 'w') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(centroids_path + '.tmp', centroids_path)
+    os.replace(metadata_path + '.tmp', metadata_path)
+    return centroids_path
+
+
+class CentroidModel:
+    """
+    Nearest-centroid scorer over an exported centroid matrix.
+
+    The matrix is memory-mapped read-only, so every worker process serving the same model
+    shares the same pages, and scoring needs only numpy.
+    """
+
+    def __init__(self, model_dir):
+        self.model_dir = model_dir
+        self.centers = np.load(os.path.join(model_dir, CENTROIDS_FILE), mmap_mode='r')
+        with open(os.path.join(model_dir, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        # ||c||^2 of every center; the ||x||^2 term is the same for all centers of a row
+        self._center_norms = np.einsum('ij,ij->i', self.centers, self.centers)
+
+    @property
+    def n_features_in_(self):
+        return self.centers.shape[1]
+
+    @property
+    def n_clusters(self):
+        return self.centers.shape[0]
+
+    def predict(self, features):
+        """
+        Return the index of the closest center for every row of `features`.
+        """
+        features = np.asarray(features, dtype=np.float64)
+        if features.ndim == 1:
+            features = features.reshape(1, -1)
+        return np.argmin(self._center_norms - 2.0 * features @ self.centers.T, axis=1)
@@ -1,35 +1,68 @@
 import sys
 import pandas as pd
-from utils import drop_missing_columns, impute_missing_values, save_cleaned_data
+from utils import drop_missing_msisdn, drop_missing_columns, impute_missing_values, save_cleaned_data, clean_in_chunks, optimize_dtypes
+from config import COMPACT_DTYPES
+from components.group_imputation import GroupStatistics, group_imputation_enabled, impute_by_group
 from components.db_connections import DBConnection
 import logging
+from instrumentation import instrumented, annotate
 from exception import CustomException
 
 # Get logger
 logger = logging.getLogger(__name__)
 
 
-def clean_data(table_name):
+def clean_frame(df):
+    """
+    Clean a DataFrame held in memory and return the cleaned copy.
+    """
+    # Drop sessions without a subscriber, then columns with more than 70% missing values
+    df = drop_missing_msisdn(df)
+    df = drop_missing_columns(df)
+
+    # Cap outliers and fill what the subscriber's other sessions can tell
+    if group_imputation_enabled():
+        df = impute_by_group(df)
+
+    # Impute the remaining missing values
+    df = impute_missing_values(df)
+
+    # Store the cleaned data with compact dtypes so that later stages reload it that way
+    if COMPACT_DTYPES:
+        df = optimize_dtypes(df)
+    return df
+
+
+@instrumented()
+def clean_data(table_name, chunksize=None):
     """
     Clean the data by dropping columns with more than 70% missing values and imputing missing values.
     Save cleaned data to artifacts folder.
+
+    When `chunksize` is given the table is streamed from the database in two passes instead of
+    being loaded at once, which keeps memory flat for tables larger than RAM.
     """
     try:
         # Instantiate DBConnection class
         db_connection = DBConnection()
 
+        if chunksize:
+            clean_in_chunks(
+                lambda columns=None: db_connection.read_table_in_chunks(table_name, chunksize, columns=columns),
+                'cleaned_data', group_statistics=GroupStatistics() if group_imputation_enabled() else None)
+            logger.info("Data cleaned in chunks of %d rows and saved successfully", chunksize)
+            return
+
         # Read the specified table from the database into a Pandas DataFrame
         df = db_connection.read_table_to_dataframe(table_name)
         logger.info("Data loaded successfully from table: %s", table_name)
+        annotate(df_in=df)
 
-        # Drop columns with more than 70% missing values
-        df = drop_missing_columns(df)
-
-        # Impute missing values
-        df = impute_missing_values(df)
+        df = clean_frame(df)
+        annotate(df_out=df)
 
         # Save cleaned data
-        save_cleaned_data(df, 'cleaned_data.csv')
+        save_cleaned_data(df, 'cleaned_data')
         logger.info("Data cleaned and saved successfully")
 
     except CustomException as e:
@@ -45,15 +78,16 @@ def clean_data(table_name):
 
 if __name__ == "__main__":
     # Check if the correct number of arguments is provided
-    if len(sys.argv) != 2:
-        print("Usage: python clean.py <table_name>")
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python clean.py <table_name> [<chunksize>]")
         sys.exit(1)
 
-    # Get the table name from command-line argument
+    # Get the table name and optional chunk size from command-line arguments
     table_name = sys.argv[1]
+    chunksize = int(sys.argv[2]) if len(sys.argv) == 3 else None
 
     # Call the clean_data function with the provided table name
-    clean_data(table_name)
+    clean_data(table_name, chunksize)
 
 
 
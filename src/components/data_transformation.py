@@ -2,34 +2,92 @@ import sys
 import os
 import pandas as pd
 import logging
+from instrumentation import instrumented, annotate
 from exception import CustomException
-from utils import encode_categorical_variables, standardize_numerical_values, perform_pca, save_transformed_data
+from utils import encode_categorical_variables, standardize_numerical_values, perform_pca, save_transformed_data, load_artifact
+from utils import PreprocessingPipeline, save_model, save_vocabularies, ArtifactWriter, iter_artifact_chunks
+from utils import fit_encoders_in_chunks, encode_in_chunks, fit_scaler_in_chunks, scale_in_chunks, fit_pca_in_chunks
+from config import PCA_SOLVER, PCA_BATCH_SIZE
 
 # Get logger
 logger = logging.getLogger(__name__)
 
+def fit_transform(df):
+    """
+    Fit the preprocessing steps on cleaned data held in memory.
+
+    Returns the principal components and the fitted PreprocessingPipeline.
+    """
+    columns = list(df.columns)
+
+    # Encode categorical variables
+    df, encoders = encode_categorical_variables(df, return_encoders=True)
+
+    # Standardize numerical values
+    df, scaler, scaled_columns = standardize_numerical_values(df, return_scaler=True)
+
+    # Perform PCA
+    df_pca, pca = perform_pca(df, return_model=True)
+    return df_pca, PreprocessingPipeline(columns, encoders, scaler, scaled_columns, pca)
+
+@instrumented()
+def fit_in_chunks(file_path, chunksize=PCA_BATCH_SIZE):
+    """
+    Fit the preprocessing steps on a cleaned data file without loading it: one pass builds the
+    vocabularies, one fits the scaler with partial fits and one fits IncrementalPCA on the
+    encoded and scaled chunks.
+
+    Returns the fitted PreprocessingPipeline.
+    """
+    def encoded_chunks():
+        return encode_in_chunks(encoders, iter_artifact_chunks(file_path, chunksize))
+
+    encoders = fit_encoders_in_chunks(iter_artifact_chunks(file_path, chunksize))
+    scaler, scaled_columns = fit_scaler_in_chunks(encoded_chunks())
+    pca = fit_pca_in_chunks(scale_in_chunks(scaler, scaled_columns, encoded_chunks()))
+    columns = list(next(iter_artifact_chunks(file_path, 1)).columns)
+    return PreprocessingPipeline(columns, encoders, scaler, scaled_columns, pca)
+
+
+def transform_in_chunks(pipeline, file_path, chunksize=PCA_BATCH_SIZE):
+    """
+    Project a cleaned data file chunk by chunk with fitted preprocessing steps, yielding PC frames.
+    """
+    for chunk in iter_artifact_chunks(file_path, chunksize):
+        yield pipeline.transform(chunk)
+
+@instrumented()
 def transform_data(file_path):
     """
     Transform the cleaned data by encoding categorical variables, standardizing numerical values, and performing PCA.
-    Save transformed data to artifacts folder.
+    Save transformed data to artifacts folder, and the fitted steps as preprocessor.pkl
+    and the category vocabularies as vocabularies.json next to the model.
+
+    With the 'incremental' PCA solver the data is streamed in chunks of PCA_BATCH_SIZE rows
+    instead of being loaded, see fit_in_chunks.
     """
     try:
-        # Load cleaned data
-        df = pd.read_csv(file_path)
-        logger.info("Cleaned data loaded successfully from %s", file_path)
-
-        # Encode categorical variables
-        df = encode_categorical_variables(df)
-
-        # Standardize numerical values
-        df = standardize_numerical_values(df)
+        if PCA_SOLVER == 'incremental':
+            pipeline = fit_in_chunks(file_path)
+            with ArtifactWriter('transformed_data') as writer:
+                for chunk in transform_in_chunks(pipeline, file_path):
+                    writer.write(chunk)
+            logger.info("Transformed data saved successfully to %s in chunks", writer.file_path)
+        else:
+            # Load cleaned data
+            df = load_artifact(file_path)
+            logger.info("Cleaned data loaded successfully from %s", file_path)
+            df_pca, pipeline = fit_transform(df)
+            annotate(df_in=df, df_out=df_pca)
 
-        # Perform PCA
-        df_pca = perform_pca(df)
+            # Save transformed data
+            save_transformed_data(df_pca, 'transformed_data')
+            logger.info("Transformed data saved successfully")
 
-        # Save transformed data
-        save_transformed_data(df_pca, 'transformed_data.csv')
-        logger.info("Transformed data saved successfully")
+        # Save the fitted preprocessing steps for serving
+        save_model(pipeline, "preprocessor.pkl")
+        save_vocabularies(pipeline.encoders)
+        logger.info("Preprocessing pipeline version %s saved", pipeline.version)
 
     except CustomException as e:
         # Handle custom exceptions
@@ -1,27 +1,173 @@
 import os
+import io
+import csv
 import sys
 import logging
-from typing import Optional, Any
+import threading
+from typing import Optional, Any, Dict, Iterator, List, Tuple, Union
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, table, column, literal_column, func, cast, and_, inspect
+from sqlalchemy import types as sqltypes
+from sqlalchemy.engine import Engine
 import pandas as pd
 from logger import logging  
 from exception import CustomException
+from config import DB_CHUNK_SIZE, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+from config import DB_WRITE_METHOD, DB_WRITE_BATCH_SIZE, DB_ATOMIC_REPLACE
+from utils import optimize_dtypes
+from instrumentation import instrumented
 from sqlalchemy.sql import text
   
 
+# Aggregate functions accepted in a metric spec, mapped to their SQL function. SUM and AVG of
+# integer columns return numeric in PostgreSQL, which the driver turns into Decimal objects, so
+# they are cast to double precision to arrive as float64 columns
+AGGREGATE_FUNCTIONS = {
+    'sum': lambda argument: cast(func.sum(argument), sqltypes.Float),
+    'mean': lambda argument: cast(func.avg(argument), sqltypes.Float),
+    'count': func.count,
+    'min': func.min,
+    'max': func.max,
+}
+
+# Comparison operators accepted in the `where` filter of a query
+FILTER_OPERATORS = {
+    '==': lambda col, value: col == value,
+    '!=': lambda col, value: col != value,
+    '<': lambda col, value: col < value,
+    '<=': lambda col, value: col <= value,
+    '>': lambda col, value: col > value,
+    '>=': lambda col, value: col >= value,
+    'in': lambda col, value: col.in_(list(value)),
+}
+
+
+def filter_conditions(where: Optional[Dict[Any, Any]]) -> list:
+    """
+    Turns a `where` filter into SQLAlchemy conditions, to be combined with AND.
+
+    Keys are column names, or SQL expressions built with SQLAlchemy such as
+    func.to_timestamp(column('End'), 'MM/DD/YYYY HH24:MI'). Values are sent as bound parameters.
+
+    Args:
+    - where (dict, optional): Column -> value for equality, or column -> (operator, value) with
+      operators from FILTER_OPERATORS.
+
+    Returns:
+    - list: The conditions.
+    """
+    conditions = []
+    for key, condition in (where or {}).items():
+        operator, value = condition if isinstance(condition, tuple) else ('==', condition)
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Unknown filter operator '{operator}', expected one of {sorted(FILTER_OPERATORS)}")
+        conditions.append(FILTER_OPERATORS[operator](column(key) if isinstance(key, str) else key, value))
+    return conditions
+
+
+# Process-wide engines keyed by database URL, so every DBConnection reuses one pool
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(db_url: str, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW,
+               pool_recycle: int = DB_POOL_RECYCLE, pool_pre_ping: bool = DB_POOL_PRE_PING) -> Engine:
+    """
+    Returns the shared engine for a database URL, creating it on first use.
+
+    The pool settings only apply when the engine is created; later calls for the same URL
+    return the existing engine.
+
+    Args:
+    - db_url (str): The database URL.
+    - pool_size (int): The number of connections kept open in the pool.
+    - max_overflow (int): The number of connections allowed beyond pool_size.
+    - pool_recycle (int): Seconds after which a pooled connection is replaced.
+    - pool_pre_ping (bool): Whether to test connections before handing them out.
+
+    Returns:
+    - sqlalchemy.engine.Engine: The shared engine.
+    """
+    with _engines_lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            engine = create_engine(db_url, pool_size=pool_size, max_overflow=max_overflow,
+                                   pool_recycle=pool_recycle, pool_pre_ping=pool_pre_ping)
+            _engines[db_url] = engine
+        return engine
+
+
+def dispose_engines(close: bool = True) -> None:
+    """
+    Closes the pooled connections of every shared engine and forgets them.
+
+    Args:
+    - close (bool): Whether to close the connections. A forked worker process passes False,
+      since the connections it inherited belong to its parent and must stay open there.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose(close=close)
+        _engines.clear()
+
+
+def copy_insert_method(pd_table, conn, keys, data_iter) -> None:
+    """
+    Insertion method for DataFrame.to_sql that streams rows through PostgreSQL COPY FROM STDIN.
+
+    pandas calls it once per batch of `chunksize` rows. The batch is serialized as CSV into
+    an in-memory buffer and loaded with a single COPY, which avoids per-row INSERT overhead.
+    Missing values are sent as empty unquoted fields, which COPY reads as NULL.
+
+    Args:
+    - pd_table (pandas.io.sql.SQLTable): The target table.
+    - conn (sqlalchemy.engine.Connection): The connection used by to_sql.
+    - keys (list): The column names.
+    - data_iter (iterable): The rows of the batch.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    target = quote(pd_table.name)
+    if pd_table.schema:
+        target = f'{quote(pd_table.schema)}.{target}'
+    columns = ', '.join(quote(key) for key in keys)
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(data_iter)
+    buffer.seek(0)
+
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {target} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
 class DBConnection:
     """
     A class to handle database connections and operations.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW,
+                 pool_recycle: int = DB_POOL_RECYCLE, pool_pre_ping: bool = DB_POOL_PRE_PING) -> None:
         """
         Initializes the DBConnection object.
+
+        Args:
+        - pool_size (int): The number of connections kept open in the shared pool.
+        - max_overflow (int): The number of connections allowed beyond pool_size.
+        - pool_recycle (int): Seconds after which a pooled connection is replaced.
+        - pool_pre_ping (bool): Whether to test connections before handing them out.
         """
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_recycle = pool_recycle
+        self.pool_pre_ping = pool_pre_ping
         self._load_env_variables()
         self._setup_logging()
 
+    def __enter__(self) -> "DBConnection":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.dispose()
+
     def _setup_logging(self) -> None:
         """
         Sets up logging configuration.
@@ -53,57 +199,316 @@ class DBConnection:
         """
         return f'postgresql://{self.db_user}:{self.db_password}@{self.db_host}:{self.port}/{self.db_name}'
 
-    def read_table_to_dataframe(self, table_name: str) -> pd.DataFrame:
+    @property
+    def engine(self) -> Engine:
+        """
+        The process-wide engine for this connection's database URL.
+        """
+        return get_engine(self._get_db_url(), pool_size=self.pool_size, max_overflow=self.max_overflow,
+                          pool_recycle=self.pool_recycle, pool_pre_ping=self.pool_pre_ping)
+
+    def dispose(self) -> None:
+        """
+        Closes the pooled connections for this connection's database URL.
+
+        Other DBConnection objects pointing at the same database will transparently
+        create a new engine on their next operation.
+        """
+        with _engines_lock:
+            engine = _engines.pop(self._get_db_url(), None)
+        if engine is not None:
+            engine.dispose()
+
+    def _build_select_query(self, table_name: str, columns: Optional[List[str]] = None,
+                            where: Optional[Dict[Any, Any]] = None):
+        """
+        Builds a SELECT statement for a table, optionally projecting a subset of columns.
+
+        Identifiers are quoted by SQLAlchemy, so column names such as 'MSISDN/Number'
+        are safe to pass through.
+
+        Args:
+        - table_name (str): The name of the table, optionally schema-qualified.
+        - columns (list, optional): The columns to select. All columns when omitted.
+        - where (dict, optional): A filter on the rows, see filter_conditions.
+
+        Returns:
+        - sqlalchemy.sql.Select: The SELECT statement.
+        """
+        schema, _, name = table_name.rpartition('.')
+        source = table(name, schema=schema or None)
+        if columns:
+            query = select(*[column(col) for col in columns]).select_from(source)
+        else:
+            query = select(literal_column('*')).select_from(source)
+        conditions = filter_conditions(where)
+        return query.where(and_(*conditions)) if conditions else query
+
+    def _build_aggregate_query(self, table_name: str, group_by: Union[str, List[str]],
+                               metrics: Dict[str, Tuple[str, Optional[str]]],
+                               where: Optional[Dict[Any, Any]] = None, dropna: bool = True):
+        """
+        Builds a SELECT ... GROUP BY statement from a metric spec.
+
+        Identifiers are quoted by SQLAlchemy and filter values are sent as bound parameters, so
+        neither can inject SQL. Functions and operators outside AGGREGATE_FUNCTIONS and
+        FILTER_OPERATORS are rejected.
+
+        Args:
+        - table_name (str): The name of the table, optionally schema-qualified.
+        - group_by (str or list): The grouping column(s).
+        - metrics (dict): Output column name -> (function, column). The column may be None
+          for 'count', which then counts rows.
+        - where (dict, optional): A filter on the rows, see filter_conditions.
+        - dropna (bool): Whether to leave out rows whose grouping key is NULL, as pandas does.
+
+        Returns:
+        - sqlalchemy.sql.Select: The aggregate statement, ordered by the grouping columns.
+        """
+        keys = [group_by] if isinstance(group_by, str) else list(group_by)
+        if not keys or not metrics:
+            raise ValueError("An aggregate query needs at least one grouping column and one metric")
+
+        selected = [column(key) for key in keys]
+        for name, (function, col) in metrics.items():
+            if function not in AGGREGATE_FUNCTIONS:
+                raise ValueError(f"Unknown aggregate function '{function}', expected one of {sorted(AGGREGATE_FUNCTIONS)}")
+            if col is None and function != 'count':
+                raise ValueError(f"Metric '{name}' needs a column for '{function}'")
+            argument = literal_column('*') if col is None else column(col)
+            selected.append(AGGREGATE_FUNCTIONS[function](argument).label(name))
+
+        conditions = [column(key).isnot(None) for key in keys] if dropna else []
+        conditions += filter_conditions(where)
+
+        schema, _, name = table_name.rpartition('.')
+        query = select(*selected).select_from(table(name, schema=schema or None))
+        if conditions:
+            query = query.where(and_(*conditions))
+        return query.group_by(*[column(key) for key in keys]).order_by(*[column(key) for key in keys])
+
+    @instrumented('db_aggregate')
+    def aggregate_table(self, table_name: str, group_by: Union[str, List[str]],
+                        metrics: Dict[str, Tuple[str, Optional[str]]], where: Optional[Dict[Any, Any]] = None,
+                        dropna: bool = True, dtype: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        """
+        Aggregates a table in the database and returns one row per group, so only the grouped
+        result crosses the network instead of every raw row.
+
+        Usage:
+            db_connection.aggregate_table('xdr_data', 'MSISDN/Number',
+                                          {'sessions': ('count', None),
+                                           'duration_ms': ('sum', 'Dur. (ms)'),
+                                           'avg_rtt_dl': ('mean', 'Avg RTT DL (ms)')},
+                                          where={'Dur. (ms)': ('>', 0)})
+
+        As in SQL, the aggregates skip NULLs, and the sum of a group that only holds NULLs is NULL.
+
+        Args:
+        - table_name (str): The name of the table to aggregate.
+        - group_by (str or list): The grouping column(s).
+        - metrics (dict): Output column name -> (function, column), with functions from
+          AGGREGATE_FUNCTIONS.
+        - where (dict, optional): Column -> value for equality, or column -> (operator, value)
+          with operators from FILTER_OPERATORS.
+        - dropna (bool): Whether to leave out rows whose grouping key is NULL.
+        - dtype (dict, optional): Explicit dtypes to apply to the resulting columns.
+
+        Returns:
+        - pandas.DataFrame: The grouping columns followed by one column per metric.
+        """
+        try:
+            engine = self.engine
+            query = self._build_aggregate_query(table_name, group_by, metrics, where, dropna)
+            return pd.read_sql(query, con=engine, dtype=dtype)
+        except Exception as e:
+            error_message = f"Error aggregating table '{table_name}': {str(e)}"
+            self.logger.error(error_message)
+            raise CustomException(error_message, error_detail=sys.exc_info())
+
+    def table_dtypes(self, table_name: str, columns: Optional[List[str]] = None) -> Dict[str, str]:
+        """
+        Returns the pandas dtypes of the numeric columns of a table, from its column types.
+
+        Passing them to read_table_in_chunks gives every chunk the same dtypes, even a chunk in
+        which a column only holds NULLs. Other columns are left to pandas.
+
+        Args:
+        - table_name (str): The name of the table, optionally schema-qualified.
+        - columns (list, optional): The columns to describe. All columns when omitted.
+
+        Returns:
+        - dict: Column name -> 'Int64' for integer columns or 'float64' for other numeric columns.
+        """
+        schema, _, name = table_name.rpartition('.')
+        dtypes = {}
+        for col in inspect(self.engine).get_columns(name, schema=schema or None):
+            if columns and col['name'] not in columns:
+                continue
+            if isinstance(col['type'], sqltypes.Integer):
+                dtypes[col['name']] = 'Int64'
+            elif isinstance(col['type'], (sqltypes.Float, sqltypes.Numeric)):
+                dtypes[col['name']] = 'float64'
+        return dtypes
+
+    def table_fingerprint(self, table_name: str) -> Dict[str, Any]:
+        """
+        Summarizes the content of a table in the database, so that a change can be detected
+        without transferring its rows.
+
+        Every row is hashed as text by PostgreSQL and the hashes are added up, which does not
+        depend on the order of the rows. The query still scans the table, but only returns one row.
+
+        Args:
+        - table_name (str): The name of the table, optionally schema-qualified.
+
+        Returns:
+        - dict: The columns and their types, the number of rows and the sum of the row hashes.
+        """
+        try:
+            schema, _, name = table_name.rpartition('.')
+            columns = [[col['name'], str(col['type'])]
+                       for col in inspect(self.engine).get_columns(name, schema=schema or None)]
+            source = table(name, schema=schema or None).alias('t')
+            row_hash = func.hashtextextended(cast(literal_column('t'), sqltypes.Text), 0)
+            with self.engine.connect() as conn:
+                rows, hash_sum = conn.execute(select(func.count(), func.sum(row_hash)).select_from(source)).one()
+            return {'columns': columns, 'rows': rows, 'hash_sum': str(hash_sum)}
+        except Exception as e:
+            error_message = f"Error fingerprinting table '{table_name}': {str(e)}"
+            self.logger.error(error_message)
+            raise CustomException(error_message, error_detail=sys.exc_info())
+
+    @instrumented('db_read')
+    def read_table_to_dataframe(self, table_name: str, columns: Optional[List[str]] = None,
+                                dtype: Optional[Dict[str, Any]] = None, compact: bool = False) -> pd.DataFrame:
         """
         Reads a table from the database into a Pandas DataFrame.
 
         Args:
         - table_name (str): The name of the table to read.
+        - columns (list, optional): The columns to select. All columns when omitted.
+        - dtype (dict, optional): Explicit dtypes to apply to the resulting columns.
+        - compact (bool): Whether to shrink the columns to the dtypes chosen by utils.plan_dtypes.
 
         Returns:
         - pandas.DataFrame: The DataFrame containing the table data.
         """
         try:
-            db_url = self._get_db_url()
-            engine = create_engine(db_url)
-            query = f'SELECT * FROM {table_name}'
-            df = pd.read_sql(query, con=engine)
+            engine = self.engine
+            query = self._build_select_query(table_name, columns)
+            df = pd.read_sql(query, con=engine, dtype=dtype)
+            if compact:
+                df = optimize_dtypes(df)
             return df
         except Exception as e:
             error_message = f"Error reading table '{table_name}': {str(e)}"
             self.logger.error(error_message)
             raise CustomException(error_message, error_detail=sys.exc_info())
 
+    def read_table_in_chunks(self, table_name: str, chunksize: int = DB_CHUNK_SIZE,
+                             columns: Optional[List[str]] = None,
+                             dtype: Optional[Dict[str, Any]] = None,
+                             where: Optional[Dict[Any, Any]] = None) -> Iterator[pd.DataFrame]:
+        """
+        Streams a table from the database as a sequence of DataFrames.
+
+        A server-side cursor is used, so only one chunk of rows is held in memory at a time
+        regardless of the size of the table.
+
+        Args:
+        - table_name (str): The name of the table to read.
+        - chunksize (int): The number of rows per chunk.
+        - columns (list, optional): The columns to select. All columns when omitted.
+        - dtype (dict, optional): Explicit dtypes to apply to every chunk. Recommended, since
+          a chunk with only NULLs in a column would otherwise infer a different dtype.
+        - where (dict, optional): A filter on the rows, see filter_conditions.
+
+        Yields:
+        - pandas.DataFrame: The next chunk of rows.
+        """
+        try:
+            engine = self.engine
+            query = self._build_select_query(table_name, columns, where)
+            with engine.connect().execution_options(stream_results=True, max_row_buffer=chunksize) as conn:
+                for chunk in pd.read_sql(query, con=conn, chunksize=chunksize, dtype=dtype):
+                    yield chunk
+        except Exception as e:
+            error_message = f"Error streaming table '{table_name}': {str(e)}"
+            self.logger.error(error_message)
+            raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+    def _to_sql(self, df: pd.DataFrame, table_name: str, con, if_exists: str, method: str,
+                batch_size: int) -> None:
+        """
+        Writes a DataFrame with the requested insertion method.
 
-    def write_dataframe_to_table(self, df: pd.DataFrame, table_name: str) -> None:
+        Args:
+        - df (pandas.DataFrame): The DataFrame to write.
+        - table_name (str): The name of the table, optionally schema-qualified.
+        - con: The engine or connection to write through.
+        - if_exists (str): 'replace' or 'append', as in DataFrame.to_sql.
+        - method (str): 'copy' for COPY FROM STDIN, 'insert' for INSERT statements.
+        - batch_size (int): The number of rows sent per batch.
+        """
+        if method not in ('copy', 'insert'):
+            raise ValueError(f"Unknown write method '{method}', expected 'copy' or 'insert'")
+        schema, _, name = table_name.rpartition('.')
+        df.to_sql(name, con=con, schema=schema or None, if_exists=if_exists, index=False,
+                  chunksize=batch_size, method=copy_insert_method if method == 'copy' else None)
+
+    def write_dataframe_to_table(self, df: pd.DataFrame, table_name: str, method: str = DB_WRITE_METHOD,
+                                 batch_size: int = DB_WRITE_BATCH_SIZE,
+                                 atomic: bool = DB_ATOMIC_REPLACE) -> None:
         """
         Writes a Pandas DataFrame to a new table in the database.
 
+        With `atomic`, the frame is loaded into a staging table which then replaces the target
+        in the same transaction, so readers never observe a missing or half-written table.
+
         Args:
         - df (pandas.DataFrame): The DataFrame to write.
         - table_name (str): The name of the new table.
+        - method (str): 'copy' for COPY FROM STDIN, 'insert' for INSERT statements.
+        - batch_size (int): The number of rows sent per batch.
+        - atomic (bool): Whether to swap in the new table through a staging table.
         """
         try:
-            db_url = self._get_db_url()
-            engine = create_engine(db_url)
-            df.to_sql(table_name, con=engine, if_exists='replace', index=False)
+            engine = self.engine
+            if not atomic:
+                self._to_sql(df, table_name, engine, 'replace', method, batch_size)
+                return
+
+            quote = engine.dialect.identifier_preparer.quote
+            schema, _, name = table_name.rpartition('.')
+            staging_name = f'{name}__staging'
+            qualify = (lambda identifier: f'{quote(schema)}.{quote(identifier)}') if schema else quote
+            with engine.begin() as conn:
+                self._to_sql(df, f'{schema}.{staging_name}' if schema else staging_name, conn, 'replace',
+                             method, batch_size)
+                conn.execute(text(f'DROP TABLE IF EXISTS {qualify(name)}'))
+                conn.execute(text(f'ALTER TABLE {qualify(staging_name)} RENAME TO {quote(name)}'))
+            self.logger.info("Table '%s' replaced atomically with %d rows", table_name, len(df))
         except Exception as e:
             error_message = f"Error writing DataFrame to table '{table_name}': {str(e)}"
             self.logger.error(error_message)
             raise CustomException(error_message, error_detail=sys.exc_info())
 
-    def append_dataframe_to_table(self, df: pd.DataFrame, table_name: str) -> None:
+    def append_dataframe_to_table(self, df: pd.DataFrame, table_name: str, method: str = DB_WRITE_METHOD,
+                                  batch_size: int = DB_WRITE_BATCH_SIZE) -> None:
         """
         Appends a Pandas DataFrame to an existing table in the database.
 
         Args:
         - df (pandas.DataFrame): The DataFrame to append.
         - table_name (str): The name of the existing table.
+        - method (str): 'copy' for COPY FROM STDIN, 'insert' for INSERT statements.
+        - batch_size (int): The number of rows sent per batch.
         """
         try:
-            db_url = self._get_db_url()
-            engine = create_engine(db_url)
-            df.to_sql(table_name, con=engine, if_exists='append', index=False)
+            engine = self.engine
+            self._to_sql(df, table_name, engine, 'append', method, batch_size)
         except Exception as e:
             error_message = f"Error appending DataFrame to table '{table_name}': {str(e)}"
             self.logger.error(error_message)
@@ -117,8 +522,7 @@ class DBConnection:
         """
         try:
             table_name = input("Enter the name of the table to delete: ")
-            db_url = self._get_db_url()
-            engine = create_engine(db_url)
+            engine = self.engine
             with engine.connect() as conn:
                 conn.execute(text('DROP TABLE IF EXISTS :table_name'), {'table_name': table_name})
                 self.logger.info(f"Table '{table_name}' deleted successfully.")
@@ -156,4 +560,7 @@ if __name__ == "__main__":
     except CustomException as e:
         # Handle any custom exceptions raised during the operations
         print("Custom Exception occurred:", e)
+    finally:
+        # Release the pooled connections
+        db_connection.dispose()
 
@@ -3,7 +3,7 @@ import os
 import pandas as pd
 import logging
 from exception import CustomException
-from utils import encode_categorical_variables, standardize_numerical_values, perform_pca, save_transformed_data
+from utils import encode_categorical_variables, standardize_numerical_values, perform_pca, save_transformed_data, load_artifact
 
 # Get logger
 logger = logging.getLogger(__name__)
@@ -15,7 +15,7 @@ def transform_data(file_path):
     """
     try:
         # Load cleaned data
-        df = pd.read_csv(file_path)
+        df = load_artifact(file_path)
         logger.info("Cleaned data loaded successfully from %s", file_path)
 
         # Encode categorical variables
@@ -28,7 +28,7 @@ def transform_data(file_path):
         df_pca = perform_pca(df)
 
         # Save transformed data
-        save_transformed_data(df_pca, 'transformed_data.csv')
+        save_transformed_data(df_pca, 'transformed_data')
         logger.info("Transformed data saved successfully")
 
     except CustomException as e:
@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from sqlalchemy import select, table, column, func, cast, Text, BigInteger
+from exception import CustomException
+from utils import ArtifactWriter, load_artifact, iter_artifact_chunks, worker_context
+from instrumentation import instrumented
+from config import ARTIFACTS_DIR, ARTIFACT_FORMAT, DB_CHUNK_SIZE, XDR_TIME_FORMAT_SQL
+from config import EXTRACT_MODE, EXTRACT_PARTITIONS, EXTRACT_WORKERS
+from config import EXTRACT_RANGE_COLUMN, EXTRACT_TIME_COLUMN, EXTRACT_HASH_COLUMN
+from components.db_connections import DBConnection
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Column each partitioning mode splits the rows on
+PARTITION_COLUMNS = {'range': EXTRACT_RANGE_COLUMN, 'time': EXTRACT_TIME_COLUMN, 'hash': EXTRACT_HASH_COLUMN}
+# Written next to the part files: the mode, the partitions and the rows of every part
+MANIFEST_FILE = 'manifest.json'
+
+
+def partition_key(mode, col):
+    """
+    The SQL expression a mode partitions on: the column itself, or for 'time' the column
+    parsed into a timestamp by PostgreSQL.
+    """
+    if mode == 'time':
+        return func.to_timestamp(column(col), XDR_TIME_FORMAT_SQL)
+    return column(col)
+
+
+def partition_hash(col, partitions):
+    """
+    The partition of every row in 'hash' mode, from 0 to partitions - 1.
+    """
+    return func.mod(func.abs(cast(func.hashtext(cast(column(col), Text)), BigInteger)), partitions)
+
+
+def partition_where(mode, col, partition):
+    """
+    Turn a partition into a `where` filter for DBConnection.read_table_in_chunks.
+
+    A partition is plain data, so that it can be sent to a worker process:
+    ('range', low, high) for low <= key < high, either bound None when the range is open,
+    ('hash', i, partitions) for the rows hashed to i, or ('null',) for the rows without a key.
+    """
+    kind = partition[0]
+    if kind == 'null':
+        return {partition_key(mode, col): None}
+    if kind == 'hash':
+        return {partition_hash(col, partition[2]): partition[1]}
+    where = {}
+    # A new expression for every bound, so that both are kept as separate keys
+    if partition[1] is not None:
+        where[partition_key(mode, col)] = ('>=', partition[1])
+    if partition[2] is not None:
+        where[partition_key(mode, col)] = ('<', partition[2])
+    return where
+
+
+def plan_partitions(db_connection, table_name, mode, col, partitions):
+    """
+    Split a table into partitions for a mode, see partition_where.
+
+    'range' and 'time' split [min, max] of the key into equal-width ranges, found with one
+    MIN/MAX query. The first and last ranges are open, so rows inserted meanwhile are not lost.
+    Every mode ends with a partition for the rows whose key is NULL.
+    """
+    if mode == 'hash':
+        return [('hash', i, partitions) for i in range(partitions)] + [('null',)]
+    if mode not in ('range', 'time'):
+        raise ValueError(f"Unknown partitioning mode '{mode}', expected 'range', 'time' or 'hash'")
+
+    schema, _, name = table_name.rpartition('.')
+    key = partition_key(mode, col)
+    with db_connection.engine.connect() as conn:
+        low, high = conn.execute(select(func.min(key), func.max(key)).select_from(
+            table(name, schema=schema or None))).one()
+    if low is None or low == high:
+        return [('range', None, None), ('null',)]
+    bounds = [None] + [low + (high - low) * i / partitions for i in range(1, partitions)] + [None]
+    return [('range', bounds[i], bounds[i + 1]) for i in range(partitions)] + [('null',)]
+
+
+def _extract_partition(table_name, mode, col, index, partition, file_name, chunksize, columns, dtype, fmt):
+    """
+    Stream one partition of a table into its own artifact.
+    """
+    start = time.perf_counter()
+    try:
+        db_connection = DBConnection(pool_size=1, max_overflow=0)
+        with ArtifactWriter(file_name, fmt) as writer:
+            for chunk in db_connection.read_table_in_chunks(table_name, chunksize, columns=columns, dtype=dtype,
+                                                            where=partition_where(mode, col, partition)):
+                # An empty partition writes no file rather than one with untyped columns
+                if len(chunk):
+                    writer.write(chunk)
+    except Exception as e:
+        # CustomException cannot be unpickled in the parent, so send its message instead
+        raise RuntimeError(f"Partition {index} {partition}: {e}") from None
+    return {'index': index, 'partition': partition,
+            'file': os.path.basename(writer.file_path) if os.path.exists(writer.file_path) else None,
+            'rows': writer.rows_written, 'wall_time_s': time.perf_counter() - start}
+
+
+@instrumented()
+def extract_table(table_name, file_name=None, mode=EXTRACT_MODE, partitions=EXTRACT_PARTITIONS,
+                  workers=EXTRACT_WORKERS, chunksize=DB_CHUNK_SIZE, columns=None, fmt=ARTIFACT_FORMAT):
+    """
+    Read a table over several connections at once and write every partition straight to its
+    own artifact, in a directory of part files.
+
+    Every worker process streams its partitions with a server-side cursor through one
+    connection, so up to `workers` queries run at the same time and the decoding of rows is
+    spread over as many cores. The directory is filled under a temporary name and only
+    replaces the previous extract once every partition is written.
+
+    Args:
+    - table_name (str): The name of the table to read.
+    - file_name (str): The name of the directory in the artifacts folder, the table name by default.
+    - mode (str): 'range', 'time' or 'hash', see PARTITION_COLUMNS.
+    - partitions (int): The number of partitions, besides the one of rows without a key.
+    - workers (int): The number of worker processes, and of database connections.
+    - chunksize (int): The number of rows fetched at a time by a worker.
+    - columns (list, optional): The columns to read. All columns when omitted.
+    - fmt (str): The artifact format of the part files.
+
+    Returns:
+    - str: The path of the directory of part files.
+    """
+    try:
+        start = time.perf_counter()
+        col = PARTITION_COLUMNS.get(mode)
+        output_dir = os.path.join(ARTIFACTS_DIR, file_name or table_name)
+        temp_dir = output_dir + '.tmp'
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+
+        try:
+            with DBConnection() as db_connection:
+                plan = plan_partitions(db_connection, table_name, mode, col, partitions)
+                dtype = db_connection.table_dtypes(table_name, columns)
+            logger.info("Extracting %s in %d partitions by %s of '%s' with %d workers",
+                        table_name, len(plan), mode, col, workers)
+
+            results = []
+            name = os.path.relpath(temp_dir, ARTIFACTS_DIR)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context([__name__])) as executor:
+                futures = [executor.submit(_extract_partition, table_name, mode, col, index, partition,
+                                           os.path.join(name, f'part-{index:05d}'), chunksize, columns, dtype, fmt)
+                           for index, partition in enumerate(plan)]
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    logger.info("Partition %d of %d done: %d rows", results[-1]['index'], len(plan),
+                                results[-1]['rows'])
+        except Exception:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+
+        results.sort(key=lambda result: result['index'])
+        rows = sum(result['rows'] for result in results)
+        manifest = {'table': table_name, 'mode': mode, 'column': col, 'rows': rows, 'workers': workers,
+                    'wall_time_s': time.perf_counter() - start, 'partitions': results}
+        with open(os.path.join(temp_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2, default=str)
+
+        # Swap the complete extract in, then remove the previous one
+        shutil.rmtree(output_dir + '.old', ignore_errors=True)
+        if os.path.isdir(output_dir):
+            os.replace(output_dir, output_dir + '.old')
+        os.replace(temp_dir, output_dir)
+        shutil.rmtree(output_dir + '.old', ignore_errors=True)
+        logger.info("Extracted %d rows of %s to %s in %.1fs", rows, table_name, output_dir, manifest['wall_time_s'])
+        return output_dir
+    except Exception as e:
+        error_message = f"Error extracting table '{table_name}': {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+def partition_files(directory):
+    """
+    The part files of an extract, in partition order.
+    """
+    with open(os.path.join(directory, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    return [os.path.join(directory, result['file']) for result in manifest['partitions'] if result['file']]
+
+
+def load_partitions(directory, columns=None):
+    """
+    Load every part of an extract into one DataFrame.
+    """
+    return pd.concat([load_artifact(path, columns=columns) for path in partition_files(directory)],
+                     ignore_index=True)
+
+
+def iter_partition_chunks(directory, chunksize, columns=None):
+    """
+    Iterate over the parts of an extract as DataFrames of at most `chunksize` rows.
+    """
+    for path in partition_files(directory):
+        yield from iter_artifact_chunks(path, chunksize, columns=columns)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3, 4):
+        print("Usage: python extraction.py <table_name> [<range|time|hash> [<partitions>]]")
+        sys.exit(1)
+
+    extract_table(sys.argv[1], mode=sys.argv[2] if len(sys.argv) >= 3 else EXTRACT_MODE,
+                  partitions=int(sys.argv[3]) if len(sys.argv) == 4 else EXTRACT_PARTITIONS)
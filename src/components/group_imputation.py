@@ -0,0 +1,179 @@
+import sys
+import logging
+import numpy as np
+import pandas as pd
+from exception import CustomException
+from instrumentation import instrumented
+from config import (GROUP_IMPUTATION_KEY, GROUP_MODE_COLUMNS, GROUP_MEAN_COLUMNS, OUTLIER_CAP_METHOD,
+                    OUTLIER_CAP_COLUMNS, OUTLIER_IQR_FACTOR, OUTLIER_PERCENTILES)
+from components.summaries import QuantileSketch
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+
+def _plain(series):
+    # Categories differ from chunk to chunk, so group on the values themselves
+    return series.astype(object) if isinstance(series.dtype, pd.CategoricalDtype) else series
+
+
+class PartialSums:
+    """
+    Sums indexed by group, added up from the partial sums of chunks.
+
+    Partials are only merged, with one hash-grouped sum, once they hold as many rows as the
+    merged total, which is much faster than aligning the indexes after every chunk.
+    """
+
+    def __init__(self):
+        self.merged = None
+        self.pending = []
+        self.pending_rows = 0
+
+    def add(self, partial):
+        self.pending.append(partial)
+        self.pending_rows += len(partial)
+        if self.merged is None or self.pending_rows >= len(self.merged):
+            self.result()
+
+    def result(self):
+        parts = ([] if self.merged is None else [self.merged]) + self.pending
+        if len(parts) > 1:
+            combined = pd.concat(parts)
+            self.merged = combined.groupby(level=list(range(combined.index.nlevels)), sort=False).sum()
+        elif parts:
+            self.merged = parts[0]
+        self.pending, self.pending_rows = [], 0
+        return self.merged
+
+
+def group_modes(pair_counts):
+    """
+    The most frequent value of every group from counts indexed by (group, value); the smallest
+    value on ties, as Series.mode().iloc[0] picks.
+    """
+    if pair_counts.empty:
+        return pd.Series(dtype=object)
+    keys = pair_counts.index.get_level_values(0).to_numpy()
+    values = pair_counts.index.get_level_values(1)
+    value_ranks, _ = pd.factorize(values, sort=True)
+    key_codes, unique_keys = pd.factorize(keys)
+    order = np.lexsort((value_ranks, -pair_counts.to_numpy(), key_codes))
+    first = order[np.r_[True, key_codes[order][1:] != key_codes[order][:-1]]]
+    return pd.Series(values[first], index=pd.Index(keys[first]))
+
+
+class GroupStatistics:
+    """
+    Per-group modes and means and per-column outlier caps, accumulated one chunk at a time.
+
+    Every statistic is computed with hash-grouped pandas kernels (groupby size/sum/count) over
+    whole chunks, never with a Python call per group. Modes and means only use the rows of the
+    group, so a group without any value of a column is left for the global imputation.
+    """
+
+    def __init__(self, key=GROUP_IMPUTATION_KEY, mode_columns=GROUP_MODE_COLUMNS, mean_columns=GROUP_MEAN_COLUMNS,
+                 cap_method=OUTLIER_CAP_METHOD, cap_columns=OUTLIER_CAP_COLUMNS):
+        if cap_method not in (None, 'iqr', 'percentile'):
+            raise ValueError(f"Unknown outlier cap method '{cap_method}', expected 'iqr', 'percentile' or None")
+        self.key = key
+        self.mode_columns = list(mode_columns)
+        self.mean_columns = list(mean_columns)
+        self.cap_method = cap_method
+        self.cap_columns = list(cap_columns) if cap_method else []
+        self.pair_counts = {}
+        self.means = PartialSums()
+        self.sketches = {}
+        self._fills = None
+
+    def update(self, df):
+        """
+        Fold one chunk of rows into the statistics.
+        """
+        self._fills = None
+        for col in self.cap_columns:
+            if col in df.columns:
+                self.sketches.setdefault(col, QuantileSketch()).update(df[col])
+        if self.key not in df.columns:
+            return self
+
+        grouped = df[df[self.key].notna()]
+        for col in self.mode_columns:
+            if col in grouped.columns:
+                pairs = pd.DataFrame({self.key: grouped[self.key], col: _plain(grouped[col])}).dropna()
+                self.pair_counts.setdefault(col, PartialSums()).add(pairs.groupby([self.key, col], sort=False).size())
+
+        columns = [col for col in self.mean_columns if col in grouped.columns]
+        if columns:
+            by_key = grouped[[self.key] + columns].groupby(self.key, sort=False)
+            self.means.add(pd.concat([by_key.sum(), by_key.count().add_suffix(' count')], axis=1))
+        return self
+
+    def _capped(self, col):
+        return col in self.cap_columns and col in self.sketches and self.sketches[col].count > 0
+
+    def caps(self, col):
+        """
+        The (lower, upper) bounds values of a column are clipped to.
+        """
+        sketch = self.sketches[col]
+        if self.cap_method == 'percentile':
+            return sketch.quantile(OUTLIER_PERCENTILES[0]), sketch.quantile(OUTLIER_PERCENTILES[1])
+        q1, q3 = sketch.quantile(0.25), sketch.quantile(0.75)
+        return q1 - OUTLIER_IQR_FACTOR * (q3 - q1), q3 + OUTLIER_IQR_FACTOR * (q3 - q1)
+
+    def fill_values(self):
+        """
+        {column: Series of the fill value of every group}, computed once after the last update.
+        """
+        if self._fills is None:
+            self._fills = {col: group_modes(counts.result()) for col, counts in self.pair_counts.items()}
+            totals = self.means.result()
+            for col in self.mean_columns:
+                if totals is not None and col in totals.columns:
+                    counts = totals[f'{col} count']
+                    means = (totals[col] / counts.where(counts > 0)).dropna()
+                    # The means are of the raw values, so they are capped like the values they fill
+                    self._fills[col] = means.clip(*self.caps(col)) if self._capped(col) else means
+        return self._fills
+
+    def apply(self, df):
+        """
+        Clip the outliers of a DataFrame or chunk, then fill its missing values with the
+        statistics of their group. Values the groups cannot fill are left missing.
+        """
+        for col in self.cap_columns:
+            if col in df.columns and self._capped(col):
+                df[col] = df[col].clip(*self.caps(col))
+        if self.key not in df.columns:
+            return df
+
+        for col, fills in self.fill_values().items():
+            if col in df.columns and df[col].isna().any():
+                missing = df[col].isna()
+                filled = df.loc[missing, self.key].map(fills)
+                if isinstance(df[col].dtype, pd.CategoricalDtype):
+                    df[col] = df[col].astype(object)
+                df.loc[missing, col] = filled
+        return df
+
+
+def group_imputation_enabled():
+    return GROUP_IMPUTATION_KEY is not None or OUTLIER_CAP_METHOD is not None
+
+
+@instrumented()
+def impute_by_group(df):
+    """
+    Cap outliers and fill missing values with per-group modes and means, as configured in
+    config.py. The remaining missing values are left for impute_missing_values.
+    """
+    try:
+        statistics = GroupStatistics().update(df)
+        df = statistics.apply(df)
+        logger.info("Imputed missing values by %s", GROUP_IMPUTATION_KEY)
+        return df
+    except Exception as e:
+        error_message = f"Error imputing missing values by group: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import logging
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from sqlalchemy import func, column, select, table
+from exception import CustomException
+from utils import iter_artifact_chunks, save_artifact
+from instrumentation import instrumented, annotate
+from config import (AGGREGATION_CHUNK_ROWS, AGGREGATE_STATE_FILE, AGGREGATE_FULL_REBUILD_EVERY, MSISDN_COLUMN,
+                    XDR_TIME_FORMAT, XDR_TIME_FORMAT_SQL)
+from components.aggregation import SESSIONS_COLUMN, DURATION_COLUMN, SUM_COLUMNS, TOTAL_COLUMNS, TOTAL_TRAFFIC_COLUMN
+from components.db_connections import DBConnection
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Sessions are placed in time by their End, so a session is folded in once it has finished.
+# End has a resolution of one minute, so the latest minute of the source may still be filling
+# up: it is left for the next run
+START_COLUMN = 'Start'
+END_COLUMN = 'End'
+# Columns averaged per subscriber. The state keeps their sum and their number of non-missing
+# values, which merge by addition, and the mean is only taken when the features are written
+MEAN_COLUMNS = ['Avg RTT DL (ms)', 'Avg RTT UL (ms)', 'Avg Bearer TP DL (kbps)', 'Avg Bearer TP UL (kbps)',
+                'TCP DL Retrans. Vol (Bytes)', 'TCP UL Retrans. Vol (Bytes)']
+# Columns whose smallest and largest value per subscriber are kept
+RANGE_COLUMNS = [DURATION_COLUMN]
+FIRST_START_COLUMN = 'First Start (s)'
+LAST_END_COLUMN = 'Last End (s)'
+
+# The columns of the state, grouped by how two states are merged: added, smallest or largest.
+# Timestamps are stored as seconds since the epoch
+STATE_SUM_COLUMNS = ([SESSIONS_COLUMN] + SUM_COLUMNS + [f'{col} sum' for col in MEAN_COLUMNS]
+                     + [f'{col} count' for col in MEAN_COLUMNS])
+STATE_MIN_COLUMNS = [f'{col} min' for col in RANGE_COLUMNS] + [FIRST_START_COLUMN]
+STATE_MAX_COLUMNS = [f'{col} max' for col in RANGE_COLUMNS] + [LAST_END_COLUMN]
+SOURCE_COLUMNS = [MSISDN_COLUMN, START_COLUMN, END_COLUMN] + SUM_COLUMNS + MEAN_COLUMNS
+
+# Schema metadata key holding the watermark and run counters, so that they are replaced
+# together with the state in one rename
+STATE_METADATA_KEY = b'aggregate_state'
+
+
+def session_times(values):
+    """
+    Parse Start or End labels into seconds since the epoch, NaN where missing or malformed.
+    """
+    times = pd.to_datetime(pd.Series(values), format=XDR_TIME_FORMAT, errors='coerce').to_numpy(dtype='datetime64[s]')
+    seconds = times.astype(np.int64).astype(np.float64)
+    seconds[np.isnat(times)] = np.nan
+    return seconds
+
+
+def reduce_groups(keys, sums, mins, maxs):
+    """
+    Group rows by key in one hash-grouping pass and reduce every column: add the `sums`
+    columns, and keep the smallest of the `mins` and the largest of the `maxs` ones. Missing
+    values are ignored by all three.
+
+    Returns:
+    - pandas.DataFrame: The reduced columns, indexed by the unique keys.
+    """
+    codes, uniques = pd.factorize(keys)
+    reduced = {}
+    for name, values in sums.items():
+        reduced[name] = np.bincount(codes, weights=np.where(np.isnan(values), 0.0, values), minlength=len(uniques))
+    for reduction, columns in ((np.fmin, mins), (np.fmax, maxs)):
+        for name, values in columns.items():
+            reduced[name] = np.full(len(uniques), np.nan)
+            reduction.at(reduced[name], codes, values)
+    return pd.DataFrame(reduced, index=pd.Index(uniques, name=MSISDN_COLUMN))
+
+
+def empty_state():
+    return reduce_groups(np.empty(0), *[{col: np.empty(0) for col in columns}
+                                        for columns in (STATE_SUM_COLUMNS, STATE_MIN_COLUMNS, STATE_MAX_COLUMNS)])
+
+
+def partial_state(df, end_s, start_s):
+    """
+    Reduce a chunk of sessions to the state columns per MSISDN; sessions without an MSISDN are left out.
+    """
+    msisdn = df[MSISDN_COLUMN].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(msisdn)
+
+    def values(col):
+        return df[col].to_numpy(dtype=np.float64)[valid]
+
+    sums = {SESSIONS_COLUMN: np.ones(int(valid.sum()))}
+    sums.update({col: values(col) for col in SUM_COLUMNS})
+    for col in MEAN_COLUMNS:
+        sums[f'{col} sum'] = values(col)
+        sums[f'{col} count'] = (~np.isnan(sums[f'{col} sum'])).astype(np.float64)
+    mins = {f'{col} min': values(col) for col in RANGE_COLUMNS}
+    mins[FIRST_START_COLUMN] = start_s[valid]
+    maxs = {f'{col} max': values(col) for col in RANGE_COLUMNS}
+    maxs[LAST_END_COLUMN] = end_s[valid]
+    return reduce_groups(msisdn[valid], sums, mins, maxs)
+
+
+def merge_states(states):
+    """
+    Merge states or partial states into one row per MSISDN.
+    """
+    states = [state for state in states if len(state)]
+    if len(states) == 1:
+        return states[0]
+    if not states:
+        return empty_state()
+
+    def stacked(columns):
+        return {col: np.concatenate([state[col].to_numpy() for state in states]) for col in columns}
+
+    return reduce_groups(np.concatenate([state.index.to_numpy() for state in states]),
+                         stacked(STATE_SUM_COLUMNS), stacked(STATE_MIN_COLUMNS), stacked(STATE_MAX_COLUMNS))
+
+
+@instrumented()
+def fold_sessions(state, chunks, after=None, before=None):
+    """
+    Fold the sessions that ended after `after` and before `before` into a state.
+
+    Partial states are merged into the running state once they hold as many rows as it does,
+    as in aggregation.aggregate_sessions.
+
+    Args:
+    - state (pandas.DataFrame): The state to fold into.
+    - chunks (iterable): DataFrames with the SOURCE_COLUMNS.
+    - after (float, optional): Exclusive lower bound on End, in seconds since the epoch.
+    - before (float, optional): Exclusive upper bound on End, in seconds since the epoch.
+
+    Returns:
+    - tuple: The new state, the latest End folded (or None if no session was) and the number
+      of sessions folded, including those without an MSISDN.
+    """
+    pending, pending_rows = [], 0
+    watermark, rows, untimed = None, 0, 0
+    for chunk in chunks:
+        end_s = session_times(chunk[END_COLUMN])
+        selected = ~np.isnan(end_s)
+        untimed += int((~selected).sum())
+        if after is not None:
+            selected &= end_s > after
+        if before is not None:
+            selected &= end_s < before
+        if not selected.any():
+            continue
+
+        chunk = chunk[selected]
+        end_s = end_s[selected]
+        rows += len(chunk)
+        watermark = max(watermark if watermark is not None else -np.inf, float(end_s.max()))
+        pending.append(partial_state(chunk, end_s, session_times(chunk[START_COLUMN])))
+        pending_rows += len(pending[-1])
+        if pending_rows >= len(state):
+            state = merge_states([state] + pending)
+            pending, pending_rows = [], 0
+
+    if untimed:
+        logger.warning("Skipped %d sessions without a valid %s", untimed, END_COLUMN)
+    return merge_states([state] + pending), watermark, rows
+
+
+def sql_session_end():
+    """
+    End parsed into a timestamp by PostgreSQL, in the time zone of the session like the
+    timestamps compared with it.
+    """
+    return func.to_timestamp(column(END_COLUMN), XDR_TIME_FORMAT_SQL)
+
+
+def sql_timestamp(seconds):
+    """
+    The wall-clock time of seconds since the epoch, which is how session_times reads the labels.
+    """
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+def latest_session_end(source, chunksize):
+    """
+    The latest End of a data file or database table in seconds since the epoch, or None if it is empty.
+    """
+    if os.path.isfile(source):
+        latest = np.nan
+        for chunk in iter_artifact_chunks(source, chunksize, columns=[END_COLUMN]):
+            latest = np.fmax(latest, np.nanmax(session_times(chunk[END_COLUMN]), initial=np.nan))
+        return None if np.isnan(latest) else float(latest)
+
+    schema, _, name = source.rpartition('.')
+    with DBConnection() as db_connection, db_connection.engine.connect() as conn:
+        latest = conn.execute(select(func.max(sql_session_end())).select_from(table(name, schema=schema or None))).scalar()
+    return None if latest is None else latest.replace(tzinfo=timezone.utc).timestamp()  # keep the wall-clock time
+
+
+def read_sessions(source, chunksize, after=None, before=None):
+    """
+    Stream the SOURCE_COLUMNS of a data file or database table. For a table, only the sessions
+    that ended between `after` and `before` (seconds since the epoch, both exclusive) are read.
+    """
+    if os.path.isfile(source):
+        yield from iter_artifact_chunks(source, chunksize, columns=SOURCE_COLUMNS)
+        return
+
+    where = {}
+    if after is not None:
+        where[sql_session_end()] = ('>', sql_timestamp(after))
+    if before is not None:
+        where[sql_session_end()] = ('<', sql_timestamp(before))
+    with DBConnection() as db_connection:
+        yield from db_connection.read_table_in_chunks(source, chunksize, columns=SOURCE_COLUMNS, where=where)
+
+
+def load_state(state_file=AGGREGATE_STATE_FILE):
+    """
+    Load the persisted state and its metadata, or an empty state and {} if there is none.
+    """
+    if not os.path.exists(state_file):
+        return empty_state(), {}
+    table = feather.read_table(state_file, memory_map=True)
+    metadata = json.loads(table.schema.metadata[STATE_METADATA_KEY])
+    return table.to_pandas().set_index(MSISDN_COLUMN), metadata
+
+
+def save_state(state, metadata, state_file=AGGREGATE_STATE_FILE):
+    """
+    Save the state with its metadata in one Feather file, replaced in a single rename so that
+    the watermark can never disagree with the state.
+    """
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    table = pa.Table.from_pandas(state.reset_index(), preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           STATE_METADATA_KEY: json.dumps(metadata).encode()})
+    feather.write_feather(table, state_file + '.tmp', compression='uncompressed')
+    os.replace(state_file + '.tmp', state_file)
+
+
+def compare_states(state, expected, rtol=1e-9):
+    """
+    Return the MSISDNs whose aggregates differ between two states, or that only one holds.
+    """
+    index = state.index.union(expected.index)
+    state, expected = state.reindex(index), expected.reindex(index)
+    differs = np.zeros(len(index), dtype=bool)
+    for col in STATE_SUM_COLUMNS + STATE_MIN_COLUMNS + STATE_MAX_COLUMNS:
+        differs |= ~np.isclose(state[col].to_numpy(), expected[col].to_numpy(), rtol=rtol, equal_nan=True)
+    return index[differs]
+
+
+def user_features(state):
+    """
+    Turn a state into the per-subscriber feature table: the columns of
+    aggregation.build_user_aggregates, then the means, ranges and first and last session times.
+    """
+    df = state.sort_index()
+    features = pd.DataFrame({SESSIONS_COLUMN: df[SESSIONS_COLUMN].astype(np.int64)}, index=df.index)
+    for col in SUM_COLUMNS:
+        features[col] = df[col]
+    features[TOTAL_TRAFFIC_COLUMN] = df[TOTAL_COLUMNS[0]] + df[TOTAL_COLUMNS[1]]
+    for col in MEAN_COLUMNS:
+        features[col] = df[f'{col} sum'] / df[f'{col} count'].where(df[f'{col} count'] > 0)
+    for col in RANGE_COLUMNS:
+        features[f'{col} min'] = df[f'{col} min']
+        features[f'{col} max'] = df[f'{col} max']
+    features['First Start'] = pd.to_datetime(df[FIRST_START_COLUMN], unit='s')
+    features['Last End'] = pd.to_datetime(df[LAST_END_COLUMN], unit='s')
+    return features.reset_index()
+
+
+@instrumented()
+def refresh_user_aggregates(source, chunksize=AGGREGATION_CHUNK_ROWS, state_file=AGGREGATE_STATE_FILE,
+                            rebuild=None, file_name='user_features'):
+    """
+    Bring the persisted per-subscriber state up to date with the sessions that ended after its
+    watermark, and save the per-subscriber features as an artifact. Sessions in the latest
+    minute of the source are left for the next run, since more of them may still arrive.
+
+    The first run, or a run on a different source, builds the state from every session. Every
+    AGGREGATE_FULL_REBUILD_EVERY runs, or when `rebuild` is True, the state is also rebuilt from
+    the same sessions and compared with the incremental one. Sessions that
+    arrive with an End before the watermark are only picked up this way, so on a mismatch the
+    rebuilt state replaces the incremental one.
+
+    Args:
+    - source (str): A data file written by save_artifact, or the name of a database table.
+    - chunksize (int): The number of sessions read at a time.
+    - state_file (str): The persisted state.
+    - rebuild (bool, optional): True to verify with a full rebuild, False to never do so,
+      None to follow AGGREGATE_FULL_REBUILD_EVERY.
+    - file_name (str): The name of the feature artifact to write.
+
+    Returns:
+    - dict: What the run did: mode, new sessions, subscribers, watermark and verification result.
+    """
+    try:
+        state, metadata = load_state(state_file)
+        if metadata.get('source') != source:
+            state, metadata = empty_state(), {'source': source, 'watermark_s': None, 'sessions_folded': 0,
+                                              'runs_since_rebuild': 0, 'last_rebuild': None}
+            mode = 'initial'
+        else:
+            mode = 'incremental'
+
+        after = metadata['watermark_s']
+        before = latest_session_end(source, chunksize)
+        state, watermark, rows = fold_sessions(state, read_sessions(source, chunksize, after, before),
+                                               after=after, before=before)
+        if watermark is not None:
+            metadata['watermark_s'] = watermark
+        metadata['sessions_folded'] += rows
+        metadata['runs_since_rebuild'] += 1
+        logger.info("Folded %d new sessions into the state of %d subscribers", rows, len(state))
+
+        report = {'mode': mode, 'new_sessions': rows, 'verified': False, 'mismatches': None}
+        if mode == 'initial':
+            metadata['runs_since_rebuild'] = 0
+            metadata['last_rebuild'] = datetime.now(timezone.utc).isoformat()
+        elif rebuild or (rebuild is None and metadata['runs_since_rebuild'] >= AGGREGATE_FULL_REBUILD_EVERY):
+            rebuilt, _, rebuilt_rows = fold_sessions(empty_state(), read_sessions(source, chunksize, before=before),
+                                                     before=before)
+            mismatches = compare_states(state, rebuilt)
+            if len(mismatches):
+                logger.warning("The incremental state differs from a full rebuild for %d subscribers; "
+                               "replacing it with the rebuild", len(mismatches))
+                state = rebuilt
+                metadata['sessions_folded'] = rebuilt_rows
+            else:
+                logger.info("The incremental state matches a full rebuild")
+            metadata['runs_since_rebuild'] = 0
+            metadata['last_rebuild'] = datetime.now(timezone.utc).isoformat()
+            report.update(verified=True, mismatches=len(mismatches))
+
+        metadata['updated_at'] = datetime.now(timezone.utc).isoformat()
+        save_state(state, metadata, state_file)
+
+        features = user_features(state)
+        annotate(df_out=features)
+        save_artifact(features, file_name)
+
+        watermark = metadata['watermark_s']
+        report.update(subscribers=len(state), sessions_folded=metadata['sessions_folded'],
+                      watermark=None if watermark is None else datetime.fromtimestamp(watermark, timezone.utc).isoformat())
+        return report
+    except CustomException as e:
+        logger.error("Custom Exception occurred: %s", e)
+        raise
+    except Exception as e:
+        error_message = f"Error refreshing per-subscriber aggregates: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != '--rebuild']
+    if len(args) != 1:
+        print("Usage: python incremental_aggregation.py <table_name|data_file> [--rebuild]")
+        sys.exit(1)
+
+    print(json.dumps(refresh_user_aggregates(args[0], rebuild=True if '--rebuild' in sys.argv else None), indent=2))
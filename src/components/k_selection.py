@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score, davies_bouldin_score, calinski_harabasz_score
+from threadpoolctl import threadpool_limits
+from utils import load_artifact, save_report, worker_context
+from instrumentation import instrumented
+from exception import CustomException
+from config import ARTIFACTS_DIR, COMPUTE_DTYPE
+from config import KSWEEP_MIN_K, KSWEEP_MAX_K, KSWEEP_SAMPLE_SIZE, KSWEEP_SILHOUETTE_SAMPLE_SIZE, KSWEEP_RULE
+from config import KSWEEP_WORKERS, KSWEEP_THREADS_PER_WORKER, KSWEEP_PARALLEL_MIN_ROWS
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Data and thread limits of the current worker process, set once by _init_worker
+_worker_data = None
+_worker_limits = None
+
+
+def _init_worker(data, threads_per_worker):
+    """
+    Receive the sample once per worker and cap the native threads used by each fit.
+    """
+    global _worker_data, _worker_limits
+    _worker_data = data
+    _worker_limits = threadpool_limits(limits=threads_per_worker)
+
+
+def _score_k(k):
+    """
+    Score k clusters on the worker's sample, see score_k.
+    """
+    return score_k(_worker_data, k)
+
+
+def score_k(data, k):
+    """
+    Fit K-means with k clusters on `data` and compute its quality scores.
+    """
+    start = time.perf_counter()
+    kmeans = KMeans(n_clusters=k, random_state=42)
+    labels = kmeans.fit_predict(data)
+    sample_size = min(KSWEEP_SILHOUETTE_SAMPLE_SIZE, len(data))
+    return {
+        'k': k,
+        'inertia': float(kmeans.inertia_),
+        'silhouette': float(silhouette_score(data, labels, sample_size=sample_size, random_state=42)),
+        'davies_bouldin': float(davies_bouldin_score(data, labels)),
+        'calinski_harabasz': float(calinski_harabasz_score(data, labels)),
+        'fit_time_s': time.perf_counter() - start,
+    }
+
+
+def elbow_k(ks, inertias):
+    """
+    Pick the elbow of the inertia curve: the k farthest from the straight line joining the
+    first and last points once both axes are scaled to [0, 1].
+    """
+    ks, inertias = np.asarray(ks, dtype=float), np.asarray(inertias, dtype=float)
+    if len(ks) < 3:
+        return int(ks[0])
+    x = (ks - ks[0]) / (ks[-1] - ks[0])
+    y = (inertias - inertias[-1]) / max(inertias[0] - inertias[-1], np.finfo(float).eps)
+    # The line runs from (0, 1) to (1, 0), so the distance is proportional to 1 - x - y
+    return int(ks[np.argmax(1 - x - y)])
+
+
+def pick_k(results, rule=KSWEEP_RULE):
+    """
+    Choose k from the sweep results with the given rule.
+    """
+    if rule == 'silhouette':
+        return max(results, key=lambda r: r['silhouette'])['k']
+    if rule == 'davies_bouldin':
+        return min(results, key=lambda r: r['davies_bouldin'])['k']
+    if rule == 'calinski_harabasz':
+        return max(results, key=lambda r: r['calinski_harabasz'])['k']
+    if rule == 'elbow':
+        return elbow_k([r['k'] for r in results], [r['inertia'] for r in results])
+    raise ValueError(f"Unknown k selection rule '{rule}'")
+
+
+@instrumented()
+def sweep_k(train_data_file, min_k=KSWEEP_MIN_K, max_k=KSWEEP_MAX_K, rule=KSWEEP_RULE):
+    """
+    Fit K-means for every k in [min_k, max_k] concurrently and pick the best k.
+
+    Candidates are fitted on a random sample of KSWEEP_SAMPLE_SIZE train rows across a process
+    pool, each worker limited to KSWEEP_THREADS_PER_WORKER native threads so that workers do
+    not oversubscribe the CPUs. With a single worker, or a sample of fewer than
+    KSWEEP_PARALLEL_MIN_ROWS rows, the candidates are fitted one after the other in this
+    process instead. The report is saved as k_sweep.json next to the model.
+
+    Returns:
+        dict: The sweep report, with the chosen k under 'best_k'.
+    """
+    try:
+        start = time.perf_counter()
+        data = load_artifact(train_data_file).to_numpy(dtype=COMPUTE_DTYPE)
+        if len(data) > KSWEEP_SAMPLE_SIZE:
+            rng = np.random.default_rng(42)
+            data = data[rng.choice(len(data), KSWEEP_SAMPLE_SIZE, replace=False)]
+        logger.info("Sweeping k from %d to %d on %d rows", min_k, max_k, len(data))
+
+        ks = list(range(min_k, max_k + 1))
+        workers = min(KSWEEP_WORKERS or os.cpu_count() or 1, len(ks))
+        if workers == 1 or len(data) < KSWEEP_PARALLEL_MIN_ROWS:
+            workers = 1
+            results = [score_k(data, k) for k in ks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context([__name__]), initializer=_init_worker,
+                                     initargs=(data, KSWEEP_THREADS_PER_WORKER)) as executor:
+                # Larger k values take longest, so submit them first
+                results = sorted(executor.map(_score_k, sorted(ks, reverse=True)), key=lambda r: r['k'])
+
+        report = {
+            'train_data_file': train_data_file,
+            'sample_rows': len(data),
+            'rule': rule,
+            'best_k': pick_k(results, rule),
+            'workers': workers,
+            'wall_time_s': time.perf_counter() - start,
+            'results': results,
+        }
+
+        report_file = save_report(report, "k_sweep.json", os.path.join(ARTIFACTS_DIR, "models"))
+        logger.info("k sweep picked k=%d by %s; report saved to %s", report['best_k'], rule, report_file)
+        return report
+    except Exception as e:
+        error_message = f"Error sweeping k: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 4, 5):
+        print("Usage: python k_selection.py <train_data_file> [<min_k> <max_k> [<rule>]]")
+        sys.exit(1)
+
+    train_data_file = sys.argv[1]
+    min_k = int(sys.argv[2]) if len(sys.argv) >= 4 else KSWEEP_MIN_K
+    max_k = int(sys.argv[3]) if len(sys.argv) >= 4 else KSWEEP_MAX_K
+    rule = sys.argv[4] if len(sys.argv) == 5 else KSWEEP_RULE
+
+    report = sweep_k(train_data_file, min_k, max_k, rule)
+    print("Best k:", report['best_k'])
@@ -1,38 +1,185 @@
 import sys
+import time
+import logging
+import tracemalloc
+import numpy as np
 import pandas as pd
 from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score, davies_bouldin_score, calinski_harabasz_score
+from sklearn.metrics import davies_bouldin_score, calinski_harabasz_score
+from sklearn.metrics import pairwise_distances_chunked
 from joblib import load
+from utils import load_artifact, save_report
+from instrumentation import instrumented, annotate
+from exception import CustomException
+from config import COMPUTE_DTYPE, SILHOUETTE_MODE, SILHOUETTE_SAMPLE_SIZE, SILHOUETTE_WORKING_MEMORY_MB
 
-def evaluate_model(model_path, test_data_path):
-    # Load the trained K-means model
-    kmeans_model = load(model_path)
+# Get logger
+logger = logging.getLogger(__name__)
 
-    # Load the test data
-    test_data = pd.read_csv(test_data_path)
+
+def silhouette_samples_chunked(data, labels, working_memory=SILHOUETTE_WORKING_MEMORY_MB):
+    """
+    Silhouette coefficient of every row, computed from blocks of pairwise distances so that at
+    most `working_memory` MiB of distances exist at once instead of the full n x n matrix.
+
+    Rows in singleton clusters get 0, as in sklearn.metrics.silhouette_samples.
+    """
+    _, labels = np.unique(labels, return_inverse=True)
+    counts = np.bincount(labels)
+    one_hot = np.zeros((len(labels), len(counts)), dtype=data.dtype)
+    one_hot[np.arange(len(labels)), labels] = 1
+
+    def reduce_block(distances, start):
+        # Sum of distances from each row of the block to the members of every cluster
+        cluster_sums = distances @ one_hot
+        block_labels = labels[start:start + len(distances)]
+        rows = np.arange(len(distances))
+        own_counts = counts[block_labels]
+        intra = cluster_sums[rows, block_labels] / np.maximum(own_counts - 1, 1)
+        cluster_sums[rows, block_labels] = np.inf
+        inter = (cluster_sums / counts).min(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = (inter - intra) / np.maximum(intra, inter)
+        return np.where(own_counts > 1, np.nan_to_num(scores), 0.0)
+
+    return np.concatenate(list(pairwise_distances_chunked(data, reduce_func=reduce_block,
+                                                          working_memory=working_memory)))
+
+
+def stratified_sample(labels, sample_size, random_state=42):
+    """
+    Indices of a sample with every cluster represented in proportion to its size.
+    """
+    rng = np.random.default_rng(random_state)
+    indices = []
+    for cluster in np.unique(labels):
+        members = np.flatnonzero(labels == cluster)
+        take = min(len(members), max(2, int(round(sample_size * len(members) / len(labels)))))
+        indices.append(rng.choice(members, take, replace=False))
+    return np.sort(np.concatenate(indices))
+
+
+def center_distances(data, centers):
+    """
+    Euclidean distances from every row to every center.
+    """
+    squared = (data ** 2).sum(axis=1)[:, None] - 2 * data @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+    return np.sqrt(np.maximum(squared, 0))
+
+
+def simplified_silhouette_samples(data, labels, centers):
+    """
+    Simplified silhouette of every row: distances to the own and nearest other cluster center
+    replace the mean distances to the members of those clusters. Linear in the number of rows.
+    """
+    distances = center_distances(data, centers)
+    rows = np.arange(len(data))
+    intra = distances[rows, labels]
+    distances[rows, labels] = np.inf
+    inter = distances.min(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.nan_to_num((inter - intra) / np.maximum(intra, inter))
+
+
+@instrumented()
+def evaluate_silhouette(data, labels, centers, mode=SILHOUETTE_MODE, sample_size=SILHOUETTE_SAMPLE_SIZE):
+    """
+    Compute the silhouette score with the requested mode and record its cost.
+
+    Returns:
+        dict: The score, the mode, the number of rows used, the runtime and the peak memory
+        allocated while computing it. 'sample' mode adds a 95% confidence interval.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = {'mode': mode}
+    if mode == 'exact':
+        scores = silhouette_samples_chunked(data, labels)
+    elif mode == 'sample':
+        sample = stratified_sample(labels, sample_size)
+        scores = silhouette_samples_chunked(data[sample], labels[sample])
+        half_width = 1.96 * scores.std(ddof=1) / np.sqrt(len(scores))
+        result['confidence_interval'] = [float(scores.mean() - half_width), float(scores.mean() + half_width)]
+    elif mode == 'simplified':
+        scores = simplified_silhouette_samples(data, labels, centers)
+    else:
+        tracemalloc.stop()
+        raise ValueError(f"Unknown silhouette mode '{mode}', expected 'exact', 'sample' or 'simplified'")
+    result['runtime_s'] = time.perf_counter() - start
+    result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result['score'] = float(scores.mean())
+    result['rows'] = len(scores)
+    return result
+
+
+@instrumented()
+def evaluation_metrics(kmeans_model, test_df, silhouette_mode=SILHOUETTE_MODE, sample_size=SILHOUETTE_SAMPLE_SIZE):
+    """
+    Compute the evaluation metrics of a trained K-means model on test data held in memory.
+    """
+    test_df = test_df.astype(COMPUTE_DTYPE)
+    test_data = test_df.to_numpy()
 
     # Predict cluster labels for the test data
-    test_cluster_labels = kmeans_model.predict(test_data)
+    test_cluster_labels = kmeans_model.predict(test_df)
 
     # Calculate evaluation metrics
-    inertia = kmeans_model.inertia_
-    silhouette = silhouette_score(test_data, test_cluster_labels)
-    davies_bouldin = davies_bouldin_score(test_data, test_cluster_labels)
-    calinski_harabasz = calinski_harabasz_score(test_data, test_cluster_labels)
-
-    # Print the evaluation metrics
-    print("Evaluation Metrics:")
-    print(f"Inertia: {inertia}")
-    print(f"Silhouette Score: {silhouette}")
-    print(f"Davies-Bouldin Index: {davies_bouldin}")
-    print(f"Calinski-Harabasz Index: {calinski_harabasz}")
+    silhouette = evaluate_silhouette(test_data, test_cluster_labels, kmeans_model.cluster_centers_,
+                                     silhouette_mode, sample_size)
+    return {
+        'inertia': float(kmeans_model.inertia_),
+        'silhouette': silhouette,
+        'davies_bouldin': float(davies_bouldin_score(test_data, test_cluster_labels)),
+        'calinski_harabasz': float(calinski_harabasz_score(test_data, test_cluster_labels)),
+    }
+
+
+@instrumented()
+def evaluate_model(model_path, test_data_path, silhouette_mode=SILHOUETTE_MODE, sample_size=SILHOUETTE_SAMPLE_SIZE):
+    """
+    Evaluate a trained K-means model on the test data.
+
+    The metrics are printed, saved as evaluation.json in the reports folder and returned.
+    """
+    try:
+        # Load the trained K-means model
+        kmeans_model = load(model_path)
+
+        # Load the test data
+        test_df = load_artifact(test_data_path)
+        annotate(df_in=test_df)
+
+        report = {'model_path': model_path, 'test_data_path': test_data_path}
+        report.update(evaluation_metrics(kmeans_model, test_df, silhouette_mode, sample_size))
+
+        # Print the evaluation metrics
+        print("Evaluation Metrics:")
+        print(f"Inertia: {report['inertia']}")
+        print(f"Silhouette Score ({report['silhouette']['mode']}): {report['silhouette']['score']}")
+        print(f"Davies-Bouldin Index: {report['davies_bouldin']}")
+        print(f"Calinski-Harabasz Index: {report['calinski_harabasz']}")
+
+        save_report(report, 'evaluation.json')
+        return report
+    except CustomException as e:
+        # Handle custom exceptions
+        logger.error("Custom Exception occurred: %s", e)
+        raise
+    except Exception as e:
+        # Handle other exceptions
+        error_message = f"Error evaluating model: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python evaluate_model.py <model_path> <test_data_path>")
+    if len(sys.argv) not in (3, 4, 5):
+        print("Usage: python evaluate_model.py <model_path> <test_data_path> [exact|sample|simplified] [<sample_size>]")
         sys.exit(1)
 
     model_path = sys.argv[1]
     test_data_path = sys.argv[2]
+    silhouette_mode = sys.argv[3] if len(sys.argv) >= 4 else SILHOUETTE_MODE
+    sample_size = int(sys.argv[4]) if len(sys.argv) == 5 else SILHOUETTE_SAMPLE_SIZE
 
-    evaluate_model(model_path, test_data_path)
+    evaluate_model(model_path, test_data_path, silhouette_mode, sample_size)
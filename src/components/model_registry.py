@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+from datetime import datetime, timezone
+from exception import CustomException
+from config import ARTIFACTS_DIR, MODEL_REGISTRY_DIR, VOCABULARIES_FILE
+from components.centroid_model import CENTROIDS_FILE, METADATA_FILE
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Files of a registry: one manifest per version, a pointer to the active version and the
+# list of versions activated so far, most recent last
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+HISTORY_FILE = "history.json"
+
+# Files copied into every version; the preprocessing pipeline and its vocabularies are optional
+MODEL_FILES = ("kmeans_model.pkl", CENTROIDS_FILE, METADATA_FILE)
+OPTIONAL_MODEL_FILES = ("preprocessor.pkl", VOCABULARIES_FILE)
+
+
+def file_checksum(path, block_size=1 << 20):
+    """
+    SHA-256 of a file, read block by block.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(path, data):
+    """
+    Write JSON under a temporary name and rename it into place, so readers never see a partial file.
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def version_dir(version, registry_dir=MODEL_REGISTRY_DIR):
+    return os.path.join(registry_dir, version)
+
+
+def list_versions(registry_dir=MODEL_REGISTRY_DIR):
+    """
+    Return the published versions, oldest first.
+    """
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(name for name in os.listdir(registry_dir)
+                  if os.path.exists(os.path.join(registry_dir, name, MANIFEST_FILE)))
+
+
+def read_manifest(version, registry_dir=MODEL_REGISTRY_DIR):
+    with open(os.path.join(version_dir(version, registry_dir), MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def verify_version(version, registry_dir=MODEL_REGISTRY_DIR):
+    """
+    Check every file of a version against the checksums of its manifest.
+
+    Raises:
+        ValueError: If a file is missing or its checksum does not match.
+    """
+    manifest = read_manifest(version, registry_dir)
+    for name, checksum in manifest['files'].items():
+        path = os.path.join(version_dir(version, registry_dir), name)
+        if not os.path.exists(path):
+            raise ValueError(f"Model version {version} is missing {name}")
+        if file_checksum(path) != checksum:
+            raise ValueError(f"Checksum mismatch for {name} in model version {version}")
+    return manifest
+
+
+def current_version(registry_dir=MODEL_REGISTRY_DIR):
+    """
+    Return the active version, or None if no version was activated yet.
+    """
+    path = os.path.join(registry_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
+
+
+def read_history(registry_dir=MODEL_REGISTRY_DIR):
+    path = os.path.join(registry_dir, HISTORY_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def _point_to(version, history, registry_dir):
+    """
+    Record the activation history and switch the CURRENT pointer with a single rename.
+    """
+    _write_json(os.path.join(registry_dir, HISTORY_FILE), history)
+    with open(os.path.join(registry_dir, CURRENT_FILE + '.tmp'), 'w') as f:
+        f.write(version + '\n')
+    os.replace(os.path.join(registry_dir, CURRENT_FILE + '.tmp'), os.path.join(registry_dir, CURRENT_FILE))
+
+
+def activate_version(version, registry_dir=MODEL_REGISTRY_DIR):
+    """
+    Make a published version the active one after verifying its checksums.
+    """
+    try:
+        verify_version(version, registry_dir)
+        history = read_history(registry_dir)
+        if not history or history[-1] != version:
+            history.append(version)
+        _point_to(version, history, registry_dir)
+        logger.info("Model version %s activated", version)
+        return version
+    except Exception as e:
+        error_message = f"Error activating model version {version}: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+def publish_model(source_dir=os.path.join(ARTIFACTS_DIR, "models"), registry_dir=MODEL_REGISTRY_DIR, activate=True,
+                  extra_files=()):
+    """
+    Copy the model files of `source_dir` into a new version directory of the registry, with a
+    manifest recording the SHA-256 of every file.
+
+    The version is staged in a temporary directory and renamed into place, so a version
+    directory either holds a complete model or does not exist.
+
+    Args:
+    - source_dir (str): The directory the model files were saved to by training.
+    - registry_dir (str): The root directory of the registry.
+    - activate (bool): Whether to make the new version the active one.
+    - extra_files (tuple): Files derived from the model, such as the segment index, to publish with it.
+
+    Returns:
+    - str: The new version.
+    """
+    try:
+        version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+        staging_dir = os.path.join(registry_dir, f".{version}.tmp")
+        os.makedirs(staging_dir)
+
+        files = {}
+        for name in MODEL_FILES + OPTIONAL_MODEL_FILES + tuple(extra_files):
+            source = os.path.join(source_dir, name)
+            if name in OPTIONAL_MODEL_FILES and not os.path.exists(source):
+                continue
+            shutil.copyfile(source, os.path.join(staging_dir, name))
+            files[name] = file_checksum(os.path.join(staging_dir, name))
+
+        with open(os.path.join(source_dir, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        manifest = {
+            'version': version,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'previous_version': current_version(registry_dir),
+            'n_clusters': metadata['n_clusters'],
+            'n_features': metadata['n_features'],
+            'files': files,
+        }
+        _write_json(os.path.join(staging_dir, MANIFEST_FILE), manifest)
+        os.rename(staging_dir, version_dir(version, registry_dir))
+        logger.info("Model version %s published to %s", version, registry_dir)
+
+        if activate:
+            activate_version(version, registry_dir)
+        return version
+    except Exception as e:
+        error_message = f"Error publishing model: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+def rollback(registry_dir=MODEL_REGISTRY_DIR):
+    """
+    Reactivate the version that was active before the current one.
+    """
+    try:
+        history = read_history(registry_dir)
+        if len(history) < 2:
+            raise ValueError("There is no previous model version to roll back to")
+        previous = history[-2]
+        verify_version(previous, registry_dir)
+        _point_to(previous, history[:-1], registry_dir)
+        logger.info("Model rolled back from version %s to %s", history[-1], previous)
+        return previous
+    except Exception as e:
+        error_message = f"Error rolling back model: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+def resolve_model_dir(fallback_dir, registry_dir=MODEL_REGISTRY_DIR):
+    """
+    Return the directory of the active version, or `fallback_dir` if the registry has none.
+    """
+    version = current_version(registry_dir)
+    return version_dir(version, registry_dir) if version else fallback_dir
+
+
+if __name__ == "__main__":
+    commands = ("publish", "list", "activate", "rollback")
+    if len(sys.argv) < 2 or sys.argv[1] not in commands or (sys.argv[1] == "activate" and len(sys.argv) != 3):
+        print("Usage: python model_registry.py publish | list | activate <version> | rollback")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == "publish":
+        print(publish_model())
+    elif command == "list":
+        active = current_version()
+        for version in list_versions():
+            print(("* " if version == active else "  ") + version)
+    elif command == "activate":
+        print(activate_version(sys.argv[2]))
+    else:
+        print(rollback())
@@ -1,32 +1,107 @@
+import os
 import sys
+import time
+import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
-from utils import save_model
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from utils import save_model, load_artifact, iter_artifact_chunks, save_report
+from components.k_selection import sweep_k
+from components.centroid_model import export_centroids
+from components.model_registry import publish_model
 import logging
+from instrumentation import instrumented
 from exception import CustomException
-from config import ARTIFACTS_DIR
+from config import ARTIFACTS_DIR, COMPUTE_DTYPE
+from config import KMEANS_MODE, KMEANS_BATCH_SIZE, KMEANS_MAX_EPOCHS, KMEANS_TOL, KMEANS_REASSIGNMENT_RATIO
 
 # Get logger
 logger = logging.getLogger(__name__)
 
-def train_kmeans(train_data_file, num_clusters):
+
+def fit_full_kmeans(train_data_file, num_clusters):
     """
-    Train a K-means clustering model on the train data.
+    Fit K-means on the whole train data loaded in memory.
     """
-    try:
-        # Load train data
-        train_df = pd.read_csv(train_data_file)
-        logger.info("Train data loaded successfully from %s", train_data_file)
+    train_df = load_artifact(train_data_file)
+    logger.info("Train data loaded successfully from %s", train_data_file)
+    return fit_kmeans(train_df, num_clusters)
+
+
+@instrumented()
+def fit_kmeans(train_df, num_clusters):
+    """
+    Fit K-means on train data held in memory.
+    """
+    kmeans = KMeans(n_clusters=num_clusters, random_state=42)
+    return kmeans.fit(train_df.astype(COMPUTE_DTYPE))
+
+
+@instrumented()
+def fit_minibatch_kmeans(train_data_file, num_clusters, with_inertia=True):
+    """
+    Fit mini-batch K-means with partial fits over chunks of the train data, so that only one
+    batch is in memory at a time.
+
+    Passes over the data are repeated until the centers move by less than KMEANS_TOL of their
+    norm or KMEANS_MAX_EPOCHS is reached. With `with_inertia`, one more pass sets inertia_ to
+    the inertia of the whole train data.
+    """
+    kmeans = MiniBatchKMeans(n_clusters=num_clusters, batch_size=KMEANS_BATCH_SIZE,
+                             reassignment_ratio=KMEANS_REASSIGNMENT_RATIO, random_state=42)
+    for epoch in range(1, KMEANS_MAX_EPOCHS + 1):
+        previous_centers = kmeans.cluster_centers_.copy() if hasattr(kmeans, 'cluster_centers_') else None
+        for chunk in iter_artifact_chunks(train_data_file, KMEANS_BATCH_SIZE):
+            kmeans.partial_fit(chunk.astype(COMPUTE_DTYPE))
+
+        if previous_centers is not None:
+            shift = np.linalg.norm(kmeans.cluster_centers_ - previous_centers) / np.linalg.norm(previous_centers)
+            logger.info("Mini-batch K-means epoch %d moved the centers by %.2e", epoch, shift)
+            if shift < KMEANS_TOL:
+                break
+
+    # partial_fit only tracks the inertia of the last batch
+    if with_inertia:
+        kmeans.inertia_ = compute_inertia(kmeans, train_data_file)
+    return kmeans
+
+
+def compute_inertia(kmeans, data_file):
+    """
+    Sum of squared distances of every row of `data_file` to its closest center, computed chunk by chunk.
+    """
+    return float(sum(-kmeans.score(chunk.astype(COMPUTE_DTYPE))
+                     for chunk in iter_artifact_chunks(data_file, KMEANS_BATCH_SIZE)))
 
-        # Instantiate K-means model
-        kmeans = KMeans(n_clusters=num_clusters, random_state=42)
 
-        # Train K-means model
-        kmeans.fit(train_df)
+def save_trained_model(kmeans):
+    """
+    Save the trained model and its centroids for serving, and publish them as a new model version.
+    """
+    save_model(kmeans, "kmeans_model.pkl")
+    export_centroids(kmeans, os.path.join(ARTIFACTS_DIR, "models"))
+    return publish_model(os.path.join(ARTIFACTS_DIR, "models"))
 
-        # Save the trained model
-        save_model(kmeans, "kmeans_model.pkl")
-        logger.info("K-means model trained and saved")
+
+@instrumented()
+def train_kmeans(train_data_file, num_clusters, mode=KMEANS_MODE):
+    """
+    Train a K-means clustering model on the train data.
+
+    `mode` is 'full' for K-means on the whole train set or 'minibatch' for streaming
+    mini-batch K-means.
+    """
+    try:
+        # Instantiate and train K-means model
+        if mode == 'full':
+            kmeans = fit_full_kmeans(train_data_file, num_clusters)
+        elif mode == 'minibatch':
+            kmeans = fit_minibatch_kmeans(train_data_file, num_clusters)
+        else:
+            raise ValueError(f"Unknown K-means mode '{mode}', expected 'full' or 'minibatch'")
+
+        version = save_trained_model(kmeans)
+        logger.info("K-means model trained in %s mode and published as version %s", mode, version)
+        return kmeans
     except CustomException as e:
         # Handle custom exceptions
         logger.error("Custom Exception occurred: %s", e)
@@ -37,15 +112,51 @@ def train_kmeans(train_data_file, num_clusters):
         logger.error(error_message)
         raise CustomException(error_message, error_detail=sys.exc_info())
 
+
+def compare_kmeans_modes(train_data_file, num_clusters):
+    """
+    Fit K-means in both modes and report the wall time and inertia of each on the full train data.
+
+    Only the fits are timed; the inertia of both modes is computed afterwards, in the same way.
+
+    The report is saved as kmeans_modes.json in the reports folder and returned.
+    """
+    try:
+        report = {'train_data_file': train_data_file, 'num_clusters': num_clusters, 'modes': {}}
+        fits = (('full', fit_full_kmeans),
+                ('minibatch', lambda data_file, k: fit_minibatch_kmeans(data_file, k, with_inertia=False)))
+        for mode, fit in fits:
+            start = time.perf_counter()
+            kmeans = fit(train_data_file, num_clusters)
+            wall_time = time.perf_counter() - start
+            report['modes'][mode] = {'wall_time_s': wall_time,
+                                     'inertia': compute_inertia(kmeans, train_data_file)}
+
+        full, minibatch = report['modes']['full'], report['modes']['minibatch']
+        report['inertia_ratio'] = minibatch['inertia'] / full['inertia']
+        report['speedup'] = full['wall_time_s'] / minibatch['wall_time_s']
+        save_report(report, 'kmeans_modes.json')
+        return report
+    except Exception as e:
+        error_message = f"Error comparing K-means modes: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
 if __name__ == "__main__":
     # Check if the correct number of arguments is provided
-    if len(sys.argv) != 3:
-        print("Usage: python model_training.py <train_data_file> <num_clusters>")
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python model_training.py <train_data_file> <num_clusters|auto> [full|minibatch|compare]")
         sys.exit(1)
 
-    # Get the path to the train data file and number of clusters from command-line arguments
+    # Get the path to the train data file and number of clusters from command-line arguments;
+    # 'auto' picks the number of clusters with a k sweep first
     train_data_file = sys.argv[1]
-    num_clusters = int(sys.argv[2])
+    num_clusters = sweep_k(train_data_file)['best_k'] if sys.argv[2] == 'auto' else int(sys.argv[2])
+    mode = sys.argv[3] if len(sys.argv) == 4 else KMEANS_MODE
 
-    # Call the train_kmeans function with the provided file path and number of clusters
-    train_kmeans(train_data_file, num_clusters)
+    if mode == 'compare':
+        print(compare_kmeans_modes(train_data_file, num_clusters))
+    else:
+        # Call the train_kmeans function with the provided file path and number of clusters
+        train_kmeans(train_data_file, num_clusters, mode)
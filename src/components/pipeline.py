@@ -0,0 +1,271 @@
+import os
+import sys
+import json
+import pickle
+import shutil
+import hashlib
+import logging
+from collections import namedtuple
+import pandas as pd
+import config
+from exception import CustomException
+from utils import load_artifact, save_model, save_report, save_vocabularies, split_data
+from instrumentation import measure, run_report_path
+from components.clean import clean_frame
+from components.data_transformation import fit_transform, fit_in_chunks, transform_in_chunks
+from components.model_training import fit_kmeans, fit_minibatch_kmeans, save_trained_model
+from components.model_evaluation import evaluation_metrics
+from components.model_registry import activate_version, current_version, file_checksum, list_versions
+from components.k_selection import sweep_k
+from components.db_connections import DBConnection
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Lists the outputs of a cached stage and the file each one is stored in
+OUTPUTS_FILE = "outputs.json"
+
+# A pipeline stage: `run(inputs, params)` returns a dict of outputs from the results of the
+# `inputs` stages; `params(num_clusters)` returns the settings its outputs depend on; `restore`,
+# if set, replays the side effects of the stage when its outputs are reused from the cache, and
+# returns False when they can no longer be reused, which runs the stage again
+Stage = namedtuple('Stage', ['name', 'inputs', 'params', 'run', 'restore'])
+
+
+class StageResult:
+    """
+    The outputs of one stage, identified by the fingerprint of everything they depend on.
+
+    Outputs reused from the cache are only read from disk if a later stage asks for them, so a
+    fully cached run loads nothing. `loaders` maps outputs that are not files to the function
+    producing them on first use.
+    """
+
+    def __init__(self, key, cache_dir, outputs=None, files=None, loaders=None):
+        self.key = key
+        self.cache_dir = cache_dir
+        self._outputs = dict(outputs or {})
+        self._files = dict(files or {})
+        self._loaders = dict(loaders or {})
+        if not self._files and cache_dir and os.path.exists(os.path.join(cache_dir, OUTPUTS_FILE)):
+            with open(os.path.join(cache_dir, OUTPUTS_FILE)) as f:
+                self._files = json.load(f)
+
+    def path(self, name):
+        return self._files[name] if os.path.isabs(self._files[name]) else os.path.join(self.cache_dir, self._files[name])
+
+    def __getitem__(self, name):
+        if name not in self._outputs and name in self._loaders:
+            self._outputs[name] = self._loaders[name]()
+        elif name not in self._outputs:
+            path = self.path(name)
+            if path.endswith('.pkl'):
+                with open(path, 'rb') as f:
+                    self._outputs[name] = pickle.load(f)
+            else:
+                self._outputs[name] = load_artifact(path)
+        return self._outputs[name]
+
+
+def fingerprint(data):
+    """
+    SHA-256 of a JSON-serializable value, independent of key order.
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def source_result(source):
+    """
+    The input of the pipeline: a data file written by save_artifact, fingerprinted by its bytes,
+    or a database table, fingerprinted in the database by DBConnection.table_fingerprint. Either
+    is only loaded if a stage has to run.
+    """
+    if os.path.isfile(source):
+        return StageResult(file_checksum(source), None, files={'raw': os.path.abspath(source)})
+
+    def read_table():
+        with DBConnection() as db_connection:
+            df = db_connection.read_table_to_dataframe(source)
+        logger.info("Data loaded successfully from table: %s", source)
+        return df
+
+    with DBConnection() as db_connection:
+        key = fingerprint({'table': source, 'content': db_connection.table_fingerprint(source)})
+    return StageResult(key, None, loaders={'raw': read_table})
+
+
+def write_outputs(outputs, cache_dir):
+    """
+    Store the outputs of a stage in its cache directory: DataFrames as Feather files, everything
+    else pickled. The directory is filled under a temporary name and renamed into place, so an
+    interrupted stage leaves no cache entry behind.
+    """
+    staging_dir = cache_dir + '.tmp'
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    files = {}
+    for name, value in outputs.items():
+        if isinstance(value, pd.DataFrame):
+            files[name] = name + '.feather'
+            value.reset_index(drop=True).to_feather(os.path.join(staging_dir, files[name]), compression='uncompressed')
+        else:
+            files[name] = name + '.pkl'
+            with open(os.path.join(staging_dir, files[name]), 'wb') as f:
+                pickle.dump(value, f)
+    with open(os.path.join(staging_dir, OUTPUTS_FILE), 'w') as f:
+        json.dump(files, f, indent=2)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.rename(staging_dir, cache_dir)
+    return files
+
+
+def run_clean(inputs, params):
+    return {'cleaned_data': clean_frame(inputs['source']['raw'])}
+
+
+def run_transform(inputs, params):
+    if params['pca_solver'] == 'incremental':
+        # Stream the cleaned data from the cache instead of holding the standardized matrix
+        path = inputs['clean'].path('cleaned_data')
+        preprocessor = fit_in_chunks(path)
+        transformed_df = pd.concat(transform_in_chunks(preprocessor, path), ignore_index=True)
+        return {'transformed_data': transformed_df, 'preprocessor': preprocessor}
+    transformed_df, preprocessor = fit_transform(inputs['clean']['cleaned_data'])
+    return {'transformed_data': transformed_df, 'preprocessor': preprocessor}
+
+
+def run_split(inputs, params):
+    train_df, test_df = split_data(inputs['transform']['transformed_data'])
+    return {'train_data': train_df, 'test_data': test_df}
+
+
+def run_train(inputs, params):
+    if params['num_clusters'] == 'auto':
+        num_clusters = sweep_k(inputs['split'].path('train_data'))['best_k']
+    else:
+        num_clusters = params['num_clusters']
+    if params['kmeans_mode'] == 'minibatch':
+        kmeans = fit_minibatch_kmeans(inputs['split'].path('train_data'), num_clusters)
+    else:
+        kmeans = fit_kmeans(inputs['split']['train_data'], num_clusters)
+
+    # Publish the model with the preprocessing pipeline it was trained after
+    save_model(inputs['transform']['preprocessor'], "preprocessor.pkl")
+    save_vocabularies(inputs['transform']['preprocessor'].encoders)
+    return {'kmeans_model': kmeans, 'model_version': save_trained_model(kmeans)}
+
+
+def restore_train(result):
+    version = result['model_version']
+    if version not in list_versions():
+        # Reusing the entry would report a model as trained that is no longer in the registry
+        logger.warning("Cached model version %s is no longer in the registry, training again", version)
+        return False
+    if version != current_version():
+        activate_version(version)
+
+
+def run_evaluate(inputs, params):
+    report = evaluation_metrics(inputs['train']['kmeans_model'], inputs['split']['test_data'],
+                                params['silhouette_mode'], params['silhouette_sample_size'])
+    save_report(report, 'evaluation.json')
+    return {'evaluation': report}
+
+
+STAGES = [
+    Stage('clean', ['source'],
+          lambda k: {'missing_threshold': config.MISSING_THRESHOLD, 'compact_dtypes': config.COMPACT_DTYPES,
+                     'dtype_category_ratio': config.DTYPE_CATEGORY_RATIO,
+                     'group_imputation': [config.GROUP_IMPUTATION_KEY, config.GROUP_MODE_COLUMNS,
+                                          config.GROUP_MEAN_COLUMNS],
+                     'outlier_caps': [config.OUTLIER_CAP_METHOD, config.OUTLIER_CAP_COLUMNS,
+                                      config.OUTLIER_IQR_FACTOR, config.OUTLIER_PERCENTILES]},
+          run_clean, None),
+    Stage('transform', ['clean'],
+          lambda k: {'pca_components': config.PCA_COMPONENTS, 'pca_solver': config.PCA_SOLVER,
+                     'pca_batch_size': config.PCA_BATCH_SIZE, 'compute_dtype': config.COMPUTE_DTYPE},
+          run_transform, None),
+    Stage('split', ['transform'],
+          lambda k: {'test_size': config.TEST_SIZE},
+          run_split, None),
+    Stage('train', ['transform', 'split'],
+          lambda k: {'num_clusters': k, 'kmeans_mode': config.KMEANS_MODE,
+                     'minibatch': [config.KMEANS_BATCH_SIZE, config.KMEANS_TOL, config.KMEANS_MAX_EPOCHS,
+                                   config.KMEANS_REASSIGNMENT_RATIO],
+                     'ksweep': [config.KSWEEP_MIN_K, config.KSWEEP_MAX_K, config.KSWEEP_RULE,
+                                config.KSWEEP_SAMPLE_SIZE, config.KSWEEP_SILHOUETTE_SAMPLE_SIZE] if k == 'auto' else None},
+          run_train, restore_train),
+    Stage('evaluate', ['train', 'split'],
+          lambda k: {'silhouette_mode': config.SILHOUETTE_MODE,
+                     'silhouette_sample_size': config.SILHOUETTE_SAMPLE_SIZE},
+          run_evaluate, lambda result: save_report(result['evaluation'], 'evaluation.json')),
+]
+
+
+def run_pipeline(source, num_clusters, force=False):
+    """
+    Run clean -> transform -> split -> train -> evaluate in one process, handing the outputs of
+    every stage to the next in memory.
+
+    A stage is skipped when its cache holds outputs for the same fingerprint: the stage name,
+    the settings in its `params` and the fingerprints of the stages it reads from. Changing a
+    setting therefore recomputes that stage and the stages after it only.
+
+    Args:
+    - source (str): A raw data file written by save_artifact, or the name of the raw database table.
+    - num_clusters (int or str): The number of clusters, or 'auto' to pick it with a k sweep.
+    - force (bool): Run every stage even if its outputs are cached.
+
+    Returns:
+    - dict: The status, fingerprint, timings and peak RSS of every stage, also saved as
+      pipeline_run.json; the sub-steps of every stage are in the run report.
+    """
+    try:
+        with measure('pipeline'):
+            results = {'source': source_result(source)}
+            report = {'source': source, 'num_clusters': num_clusters, 'run_report': run_report_path(), 'stages': {}}
+            for stage in STAGES:
+                with measure(stage.name) as measurement:
+                    params = stage.params(num_clusters)
+                    key = fingerprint({'stage': stage.name, 'params': params,
+                                       'inputs': [results[name].key for name in stage.inputs]})
+                    cache_dir = os.path.join(config.PIPELINE_CACHE_DIR, stage.name, key)
+
+                    cached = not force and os.path.exists(os.path.join(cache_dir, OUTPUTS_FILE))
+                    if cached:
+                        result = StageResult(key, cache_dir)
+                        cached = stage.restore is None or stage.restore(result) is not False
+                    if cached:
+                        status = 'cached'
+                    else:
+                        outputs = stage.run({name: results[name] for name in stage.inputs}, params)
+                        result = StageResult(key, cache_dir, outputs, write_outputs(outputs, cache_dir))
+                        status = 'ran'
+
+                results[stage.name] = result
+                report['stages'][stage.name] = {'status': status, 'key': key,
+                                                'wall_time_s': measurement.wall_time_s,
+                                                'cpu_time_s': measurement.cpu_time_s,
+                                                'peak_rss_mb': measurement.peak_rss / 2 ** 20}
+                logger.info("Stage %s %s in %.2fs", stage.name, status, measurement.wall_time_s)
+
+        save_report(report, 'pipeline_run.json')
+        return report
+    except CustomException as e:
+        logger.error("Custom Exception occurred: %s", e)
+        raise
+    except Exception as e:
+        error_message = f"Error running pipeline: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4) or (len(sys.argv) == 4 and sys.argv[3] != "--force"):
+        print("Usage: python pipeline.py <table_name|data_file> <num_clusters|auto> [--force]")
+        sys.exit(1)
+
+    num_clusters = sys.argv[2] if sys.argv[2] == 'auto' else int(sys.argv[2])
+    report = run_pipeline(sys.argv[1], num_clusters, force=len(sys.argv) == 4)
+    for name, stage in report['stages'].items():
+        print(f"{name:<10} {stage['status']:<7} {stage['wall_time_s']:8.2f}s")
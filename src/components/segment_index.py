@@ -0,0 +1,70 @@
+import os
+import json
+import numpy as np
+
+# Files of a segment index inside the model directory
+SEGMENT_MSISDN_FILE = "segment_msisdn.npy"
+SEGMENT_CLUSTER_FILE = "segment_cluster.npy"
+SEGMENT_METADATA_FILE = "segment_index.json"
+SEGMENT_FILES = (SEGMENT_MSISDN_FILE, SEGMENT_CLUSTER_FILE, SEGMENT_METADATA_FILE)
+
+
+def write_segment_index(msisdn, clusters, model_dir, metadata=None):
+    """
+    Write a segment index as two parallel arrays sorted by MSISDN, plus JSON metadata.
+
+    Every file is written under a temporary name and renamed into place.
+
+    Args:
+        msisdn: Unique MSISDNs in ascending order.
+        clusters: The cluster of every MSISDN.
+        model_dir: The directory of the model the clusters were assigned with.
+        metadata: Extra fields for segment_index.json.
+
+    Returns:
+        The paths of the written files.
+    """
+    msisdn = np.ascontiguousarray(msisdn, dtype=np.int64)
+    clusters = np.ascontiguousarray(clusters, dtype=np.int16)
+    if len(msisdn) != len(clusters) or np.any(msisdn[1:] <= msisdn[:-1]):
+        raise ValueError("MSISDNs must be unique, sorted and aligned with their clusters")
+
+    metadata = dict(metadata or {}, n_subscribers=int(len(msisdn)))
+    paths = [os.path.join(model_dir, name) for name in SEGMENT_FILES]
+    for path, array in zip(paths, (msisdn, clusters)):
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, array)
+    with open(paths[2] + '.tmp', 'w') as f:
+        json.dump(metadata, f, indent=2)
+    for path in paths:
+        os.replace(path + '.tmp', path)
+    return paths
+
+
+class SegmentIndex:
+    """
+    Lookup of the cluster of a subscriber by binary search over the memory-mapped MSISDNs.
+    """
+
+    def __init__(self, model_dir):
+        self.msisdn = np.load(os.path.join(model_dir, SEGMENT_MSISDN_FILE), mmap_mode='r')
+        self.clusters = np.load(os.path.join(model_dir, SEGMENT_CLUSTER_FILE), mmap_mode='r')
+        with open(os.path.join(model_dir, SEGMENT_METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+
+    def __len__(self):
+        return len(self.msisdn)
+
+    def lookup(self, msisdn):
+        """
+        Return the cluster of `msisdn`, or None if the subscriber is not in the index.
+        """
+        # Numbers outside the range of the stored MSISDNs cannot be in the index, and would
+        # overflow the conversion to the array dtype
+        bounds = np.iinfo(self.msisdn.dtype)
+        if not bounds.min <= msisdn <= bounds.max:
+            return None
+        position = int(np.searchsorted(self.msisdn, msisdn))
+        if position < len(self.msisdn) and self.msisdn[position] == msisdn:
+            return int(self.clusters[position])
+        return None
@@ -0,0 +1,116 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import logging
+from exception import CustomException
+from utils import load_artifact, iter_artifact_chunks
+from instrumentation import instrumented
+from config import ARTIFACTS_DIR, COMPUTE_DTYPE, MSISDN_COLUMN, SEGMENT_BATCH_ROWS
+from components.centroid_model import CentroidModel
+from components.segment_index import SEGMENT_FILES, write_segment_index
+from components.model_registry import MANIFEST_FILE, current_version, publish_model, verify_version, version_dir
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+
+def majority_segments(msisdn, clusters):
+    """
+    Reduce the cluster of every session to one cluster per MSISDN: the cluster most of its
+    sessions fall in, the smallest one on ties.
+
+    Returns the unique MSISDNs in ascending order and their clusters.
+    """
+    order = np.lexsort((clusters, msisdn))
+    msisdn, clusters = msisdn[order], clusters[order]
+
+    # Count the sessions of every (msisdn, cluster) pair from the runs of the sorted pairs
+    starts = np.flatnonzero(np.r_[True, (msisdn[1:] != msisdn[:-1]) | (clusters[1:] != clusters[:-1])])
+    counts = np.diff(np.r_[starts, len(msisdn)])
+    pair_msisdn, pair_cluster = msisdn[starts], clusters[starts]
+
+    # Put the most frequent pair of every MSISDN first and keep it
+    order = np.lexsort((pair_cluster, -counts, pair_msisdn))
+    pair_msisdn, pair_cluster = pair_msisdn[order], pair_cluster[order]
+    first = np.r_[True, pair_msisdn[1:] != pair_msisdn[:-1]]
+    return pair_msisdn[first], pair_cluster[first]
+
+
+@instrumented()
+def build_segment_index(cleaned_data_file, transformed_data_file, model_dir=None):
+    """
+    Assign every subscriber to a cluster and save the result as a segment index next to the model.
+
+    A published version is never changed: when the model is the active registry version, the
+    index is published with a copy of its files as a new version, which is activated if the
+    model is still the active one. A running API then picks the index up through its usual
+    reload on a version change.
+
+    The rows of the transformed data are the rows of the cleaned data in the same order, so the
+    MSISDNs are read from the cleaned data and the clusters are predicted batch by batch from
+    the transformed data. Cleaning drops the sessions without an MSISDN (drop_missing_msisdn),
+    so no MSISDN in the cleaned data is imputed; rows whose MSISDN is still missing are skipped.
+
+    Args:
+    - cleaned_data_file (str): The cleaned data artifact holding the MSISDN column.
+    - transformed_data_file (str): The principal components of the cleaned data.
+    - model_dir (str): The model to assign clusters with, written to in place; the active
+      registry version by default.
+
+    Returns:
+    - int: The number of subscribers in the index.
+    """
+    try:
+        version = None
+        if model_dir is None:
+            version = current_version()
+            model_dir = version_dir(version) if version else os.path.join(ARTIFACTS_DIR, "models")
+        model = CentroidModel(model_dir)
+
+        msisdn = load_artifact(cleaned_data_file, columns=[MSISDN_COLUMN])[MSISDN_COLUMN].to_numpy(dtype=np.float64)
+        clusters = np.empty(len(msisdn), dtype=np.int16)
+        offset = 0
+        for chunk in iter_artifact_chunks(transformed_data_file, SEGMENT_BATCH_ROWS):
+            clusters[offset:offset + len(chunk)] = model.predict(chunk.to_numpy(dtype=COMPUTE_DTYPE))
+            offset += len(chunk)
+        if offset != len(msisdn):
+            raise ValueError(f"The transformed data has {offset} rows but the cleaned data has {len(msisdn)}")
+
+        valid = np.isfinite(msisdn)
+        logger.info("Skipping %d rows without a valid MSISDN", int((~valid).sum()))
+        subscribers, segments = majority_segments(msisdn[valid].astype(np.int64), clusters[valid])
+
+        metadata = {'model_version': version, 'n_sessions': int(valid.sum())}
+        if version is None:
+            write_segment_index(subscribers, segments, model_dir, metadata)
+            logger.info("Segment index of %d subscribers saved to %s", len(subscribers), model_dir)
+            return len(subscribers)
+
+        # Stage the model files with the index outside the registry and publish them together
+        verify_version(version)
+        staging_dir = tempfile.mkdtemp(prefix='segment_index_', dir=ARTIFACTS_DIR)
+        try:
+            for name in os.listdir(model_dir):
+                if name != MANIFEST_FILE:
+                    shutil.copyfile(os.path.join(model_dir, name), os.path.join(staging_dir, name))
+            write_segment_index(subscribers, segments, staging_dir, metadata)
+            new_version = publish_model(staging_dir, activate=current_version() == version, extra_files=SEGMENT_FILES)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        logger.info("Segment index of %d subscribers published with the model of version %s as version %s",
+                    len(subscribers), version, new_version)
+        return len(subscribers)
+    except Exception as e:
+        error_message = f"Error building segment index: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python segmentation.py <cleaned_data_path> <transformed_data_path>")
+        sys.exit(1)
+
+    build_segment_index(sys.argv[1], sys.argv[2])
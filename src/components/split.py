@@ -1,24 +1,27 @@
 import sys
 import pandas as pd
-from utils import split_data, save_split_data
+from utils import split_data, save_split_data, load_artifact
 from config import ARTIFACTS_DIR
 import logging
+from instrumentation import instrumented, annotate
 from exception import CustomException
 
 # Get logger
 logger = logging.getLogger(__name__)
 
+@instrumented()
 def split_data_and_save(transformed_data_file):
     """
     Split the transformed data into train and test sets and save them to the artifacts folder.
     """
     try:
         # Load transformed data
-        df = pd.read_csv(transformed_data_file)
+        df = load_artifact(transformed_data_file)
         logger.info("Transformed data loaded successfully from %s", transformed_data_file)
 
         # Split data into train and test sets
         train_df, test_df = split_data(df)
+        annotate(df_in=df, df_out=(train_df, test_df))
 
         # Save train and test data
         save_split_data(train_df, test_df)
@@ -0,0 +1,416 @@
+import os
+import sys
+import math
+import logging
+import numpy as np
+import pandas as pd
+from exception import CustomException
+from utils import iter_artifact_chunks, save_report
+from instrumentation import instrumented
+from config import (AGGREGATION_CHUNK_ROWS, SUMMARY_TOP_K, SUMMARY_HEAVY_HITTER_CAPACITY, SUMMARY_COUNT_MIN_WIDTH,
+                    SUMMARY_COUNT_MIN_DEPTH, SUMMARY_QUANTILE_ACCURACY, SUMMARY_QUANTILE_MAX_BUCKETS)
+from components.db_connections import DBConnection
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Columns whose most frequent values are reported
+CATEGORY_COLUMNS = ['Handset Type', 'Handset Manufacturer']
+# Network quality metrics; the values of the columns of a metric are summarized together, as
+# with df[columns].stack() in the notebooks
+METRIC_COLUMNS = {
+    'tcp_retransmission_bytes': ['TCP DL Retrans. Vol (Bytes)', 'TCP UL Retrans. Vol (Bytes)'],
+    'rtt_ms': ['Avg RTT DL (ms)', 'Avg RTT UL (ms)'],
+    'throughput_kbps': ['Avg Bearer TP DL (kbps)', 'Avg Bearer TP UL (kbps)'],
+}
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+def _present(values):
+    """
+    The non-missing values of an array, Series or Categorical as a Series, categoricals as
+    plain values so that unused categories are not counted.
+    """
+    series = pd.Series(values)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)
+    return series.dropna()
+
+
+class SpaceSaving:
+    """
+    Mergeable Space-Saving summary of the most frequent values, holding at most `capacity` counters.
+
+    The count of a monitored value never underestimates its true count and overestimates it by
+    at most its `error`; a value that is not monitored occurred at most `missing` times.
+    """
+
+    def __init__(self, capacity=SUMMARY_HEAVY_HITTER_CAPACITY):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.float64)
+        self.errors = pd.Series(dtype=np.float64)
+        self.missing = 0.0
+        self.total = 0
+
+    def update(self, values):
+        self.add_counts(_present(values).value_counts())
+
+    def add_counts(self, counts):
+        """
+        Add exact counts of values, as returned by value_counts.
+        """
+        counts = counts.astype(np.float64)
+        self.total += int(counts.sum())
+        self._combine(counts, pd.Series(0.0, index=counts.index), 0.0)
+
+    def merge(self, other):
+        self.total += other.total
+        self._combine(other.counts, other.errors, other.missing)
+
+    def _combine(self, counts, errors, missing):
+        # A value missing from one side may have occurred up to that side's `missing` times there
+        index = self.counts.index.append(counts.index).unique()
+        combined = self.counts.reindex(index, fill_value=self.missing) + counts.reindex(index, fill_value=missing)
+        combined_errors = self.errors.reindex(index, fill_value=self.missing) + errors.reindex(index, fill_value=missing)
+        self.missing += missing
+        if len(combined) > self.capacity:
+            combined = combined.sort_values(ascending=False, kind='stable')
+            self.missing = max(self.missing, float(combined.iloc[self.capacity]))
+            combined = combined.iloc[:self.capacity]
+        self.counts = combined
+        self.errors = combined_errors[combined.index]
+
+    def top(self, n):
+        """
+        The `n` most frequent values with their count and error, most frequent first.
+        """
+        counts = self.counts.sort_values(ascending=False, kind='stable').iloc[:n]
+        return pd.DataFrame({'count': counts, 'error': self.errors[counts.index]})
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch: estimates the count of any value in `depth` x `width` counters.
+
+    Estimates never underestimate, and overestimate by at most e / width of the values counted
+    with probability 1 - e^-depth. Sketches with the same width, depth and seed merge by addition.
+    """
+
+    def __init__(self, width=SUMMARY_COUNT_MIN_WIDTH, depth=SUMMARY_COUNT_MIN_DEPTH, seed=0):
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self._multipliers = rng.integers(1, 2 ** 63, depth, dtype=np.uint64) | np.uint64(1)
+        self._offsets = rng.integers(0, 2 ** 63, depth, dtype=np.uint64)
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _buckets(self, values):
+        hashes = pd.util.hash_array(np.asarray(values))
+        return [((hashes * self._multipliers[row] + self._offsets[row]) >> np.uint64(32)) % np.uint64(self.width)
+                for row in range(self.depth)]
+
+    def update(self, values, counts=None):
+        """
+        Count values, or with `counts`, distinct values occurring that many times each.
+        """
+        if counts is None:
+            values = _present(values).to_numpy()
+        self.total += len(values) if counts is None else int(np.sum(counts))
+        for row, buckets in enumerate(self._buckets(values)):
+            self.table[row] += np.bincount(buckets.astype(np.intp), weights=counts,
+                                           minlength=self.width).astype(np.int64)
+
+    def merge(self, other):
+        if (other.width, other.depth, other.seed) != (self.width, self.depth, self.seed):
+            raise ValueError("Only Count-Min sketches with the same width, depth and seed can be merged")
+        self.table += other.table
+        self.total += other.total
+
+    def estimate(self, values):
+        return np.min([self.table[row, buckets.astype(np.intp)] for row, buckets in enumerate(self._buckets(values))],
+                      axis=0)
+
+    def error_bound(self):
+        return math.e / self.width * self.total
+
+    def confidence(self):
+        return 1 - math.exp(-self.depth)
+
+
+class HeavyHitters:
+    """
+    The most frequent values: candidates are kept by Space-Saving and their counts tightened
+    with a Count-Min sketch, since both only overestimate.
+    """
+
+    def __init__(self, capacity=SUMMARY_HEAVY_HITTER_CAPACITY, width=SUMMARY_COUNT_MIN_WIDTH,
+                 depth=SUMMARY_COUNT_MIN_DEPTH):
+        self.space_saving = SpaceSaving(capacity)
+        self.count_min = CountMinSketch(width, depth)
+
+    def update(self, values):
+        # Both sketches are fed the distinct values of the chunk with their counts
+        counts = _present(values).value_counts()
+        self.space_saving.add_counts(counts)
+        self.count_min.update(counts.index.to_numpy(), counts.to_numpy())
+
+    def merge(self, other):
+        self.space_saving.merge(other.space_saving)
+        self.count_min.merge(other.count_min)
+
+    def top(self, n):
+        """
+        The `n` most frequent values as dicts of the value, an upper and a lower bound of its
+        count and its share of all values, and an upper bound of the count of any other value.
+        """
+        candidates = self.space_saving.top(self.space_saving.capacity)
+        upper = np.minimum(candidates['count'].to_numpy(), self.count_min.estimate(candidates.index.to_numpy()))
+        lower = np.maximum(candidates['count'].to_numpy() - candidates['error'].to_numpy(), 0)
+        order = np.lexsort((-lower, -upper))
+        total = max(self.space_saving.total, 1)
+        # No value left out of the list occurred more often than this
+        max_unlisted = max([self.space_saving.missing] + [upper[i] for i in order[n:n + 1]])
+        return [{'value': candidates.index[i], 'count': int(upper[i]), 'min_count': int(lower[i]),
+                 'share': upper[i] / total} for i in order[:n]], int(max_unlisted)
+
+    def report(self, n):
+        top, max_unlisted = self.top(n)
+        return {'count': self.space_saving.total,
+                'top': top,
+                'max_unlisted_count': max_unlisted,
+                'count_min_error_bound': self.count_min.error_bound(),
+                'count_min_confidence': self.count_min.confidence()}
+
+
+class TopK:
+    """
+    The exact `k` largest (or smallest) values seen, keeping only `k` values between updates.
+    """
+
+    def __init__(self, k=SUMMARY_TOP_K, largest=True):
+        self.k = k
+        self.largest = largest
+        self.values = np.empty(0)
+
+    def update(self, values):
+        values = _present(values).to_numpy(dtype=np.float64)
+        if len(self.values) == self.k:
+            # Only values beating the current k-th can enter
+            threshold = self.values.min() if self.largest else self.values.max()
+            values = values[values > threshold] if self.largest else values[values < threshold]
+        values = np.concatenate([self.values, values])
+        if len(values) > self.k:
+            values = (np.partition(values, len(values) - self.k)[-self.k:] if self.largest
+                      else np.partition(values, self.k - 1)[:self.k])
+        self.values = values
+
+    def merge(self, other):
+        self.update(other.values)
+
+    def result(self):
+        ordered = np.sort(self.values)
+        return (ordered[::-1] if self.largest else ordered).tolist()
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative accuracy, after DDSketch.
+
+    Values are counted in buckets whose bounds grow geometrically by gamma = (1 + a) / (1 - a),
+    so every quantile is returned within a relative error `a` of a value of the data. When more
+    than `max_buckets` buckets are used, the lowest ones are collapsed, which only affects the
+    accuracy of the lowest quantiles.
+    """
+
+    # Values closer to zero than this are counted as zero
+    MIN_INDEXABLE = 1e-9
+
+    def __init__(self, relative_accuracy=SUMMARY_QUANTILE_ACCURACY, max_buckets=SUMMARY_QUANTILE_MAX_BUCKETS):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _add(self, store, values):
+        keys, counts = np.unique(np.ceil(np.log(values) / self._log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+
+    def _collapse(self, store, lowest):
+        # Fold the buckets nearest to the lowest value into one; for the negative store those
+        # hold the largest magnitudes
+        if len(store) <= self.max_buckets:
+            return
+        keys = sorted(store, reverse=not lowest)
+        target = keys[len(store) - self.max_buckets]
+        for key in keys[:len(store) - self.max_buckets]:
+            store[target] += store.pop(key)
+
+    def update(self, values):
+        values = _present(values).to_numpy(dtype=np.float64)
+        if not len(values):
+            return
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.zero_count += int((np.abs(values) < self.MIN_INDEXABLE).sum())
+        self._add(self.positive, values[values >= self.MIN_INDEXABLE])
+        self._add(self.negative, -values[values <= -self.MIN_INDEXABLE])
+        self._collapse(self.positive, lowest=True)
+        self._collapse(self.negative, lowest=False)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Only quantile sketches with the same relative accuracy can be merged")
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._collapse(self.positive, lowest=True)
+        self._collapse(self.negative, lowest=False)
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        """
+        The value of rank q * (count - 1), within the relative accuracy; None if the sketch is empty.
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return max(-self._value(key), self.min)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return min(self._value(key), self.max)
+        return self.max
+
+    def report(self):
+        return {'count': self.count,
+                'min': self.min if self.count else None,
+                'max': self.max if self.count else None,
+                'mean': self.sum / self.count if self.count else None,
+                'quantiles': {f'p{q * 100:g}': self.quantile(q) for q in QUANTILES},
+                'quantile_relative_error': self.relative_accuracy}
+
+
+class SessionSummary:
+    """
+    The one-pass summaries of the handsets and network quality metrics of a set of sessions.
+
+    Summaries of chunks read separately, e.g. by different workers, combine with `merge`.
+    """
+
+    def __init__(self, k=SUMMARY_TOP_K):
+        self.k = k
+        self.rows = 0
+        self.categories = {col: HeavyHitters() for col in CATEGORY_COLUMNS}
+        self.metrics = {name: {'top': TopK(k, largest=True), 'bottom': TopK(k, largest=False),
+                               'most_frequent': HeavyHitters(), 'distribution': QuantileSketch()}
+                        for name in METRIC_COLUMNS}
+
+    def update(self, df):
+        self.rows += len(df)
+        for col, sketch in self.categories.items():
+            sketch.update(df[col])
+        for name, columns in METRIC_COLUMNS.items():
+            # Column after column, in the order of the stacked values
+            values = np.concatenate([df[col].to_numpy(dtype=np.float64) for col in columns])
+            values = values[~np.isnan(values)]
+            for sketch in self.metrics[name].values():
+                sketch.update(values)
+
+    def merge(self, other):
+        self.rows += other.rows
+        for col, sketch in self.categories.items():
+            sketch.merge(other.categories[col])
+        for name, sketches in self.metrics.items():
+            for kind, sketch in sketches.items():
+                sketch.merge(other.metrics[name][kind])
+
+    def report(self):
+        return {
+            'rows': self.rows,
+            'categories': {col: sketch.report(self.k) for col, sketch in self.categories.items()},
+            'metrics': {name: {'columns': METRIC_COLUMNS[name],
+                               'top': sketches['top'].result(),
+                               'bottom': sketches['bottom'].result(),
+                               'most_frequent': sketches['most_frequent'].report(self.k),
+                               'distribution': sketches['distribution'].report()}
+                        for name, sketches in self.metrics.items()},
+        }
+
+
+@instrumented()
+def summarize_sessions(chunks, k=SUMMARY_TOP_K):
+    """
+    Summarize an iterator of session chunks in one pass, holding only the sketches in memory.
+    """
+    summary = SessionSummary(k)
+    for chunk in chunks:
+        summary.update(chunk)
+    return summary
+
+
+@instrumented()
+def build_summaries(source, chunksize=AGGREGATION_CHUNK_ROWS):
+    """
+    Summarize the handsets and network quality of every session and save the report as
+    summaries.json.
+
+    Args:
+    - source (str): A data file written by save_artifact, or the name of a database table.
+    - chunksize (int): The number of sessions read at a time.
+
+    Returns:
+    - dict: The report: the most frequent handsets and manufacturers, and the largest, smallest
+      and most frequent values and quantiles of every metric, with their error bounds.
+    """
+    try:
+        columns = CATEGORY_COLUMNS + [col for cols in METRIC_COLUMNS.values() for col in cols]
+        if os.path.isfile(source):
+            summary = summarize_sessions(iter_artifact_chunks(source, chunksize, columns=columns))
+        else:
+            with DBConnection() as db_connection:
+                summary = summarize_sessions(db_connection.read_table_in_chunks(source, chunksize, columns=columns))
+        report = summary.report()
+        save_report(report, 'summaries.json')
+        logger.info("Summarized %d sessions", summary.rows)
+        return report
+    except CustomException as e:
+        logger.error("Custom Exception occurred: %s", e)
+        raise
+    except Exception as e:
+        error_message = f"Error summarizing sessions: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python summaries.py <table_name|data_file> [<chunksize>]")
+        sys.exit(1)
+
+    build_summaries(sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else AGGREGATION_CHUNK_ROWS)
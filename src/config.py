@@ -2,7 +2,8 @@ import os
 
 # File paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-ARTIFACTS_DIR = os.path.join(os.path.dirname(BASE_DIR), 'artifacts')
+# Can be pointed elsewhere, e.g. by the benchmark suite, with the ARTIFACTS_DIR environment variable
+ARTIFACTS_DIR = os.getenv('ARTIFACTS_DIR', os.path.join(os.path.dirname(BASE_DIR), 'artifacts'))
 
 # Constants
 MISSING_THRESHOLD = 0.7
@@ -12,3 +13,155 @@ PCA_COMPONENTS = 45
 # the test size for splitting
 TEST_SIZE = 0.2
 
+# Group-aware cleaning: missing values of these columns are first filled with the mode or mean
+# of the subscriber's own sessions, grouped by this column (None to only impute globally)
+GROUP_IMPUTATION_KEY = 'MSISDN/Number'
+GROUP_MODE_COLUMNS = ['Handset Type', 'Handset Manufacturer', 'Last Location Name']
+GROUP_MEAN_COLUMNS = ['Avg RTT DL (ms)', 'Avg RTT UL (ms)', 'Avg Bearer TP DL (kbps)', 'Avg Bearer TP UL (kbps)',
+                      'TCP DL Retrans. Vol (Bytes)', 'TCP UL Retrans. Vol (Bytes)']
+# Outlier capping of these columns before imputation: 'iqr' clips values beyond
+# OUTLIER_IQR_FACTOR interquartile ranges from the quartiles, 'percentile' clips them to
+# OUTLIER_PERCENTILES, None keeps them
+OUTLIER_CAP_METHOD = None
+OUTLIER_CAP_COLUMNS = GROUP_MEAN_COLUMNS
+OUTLIER_IQR_FACTOR = 1.5
+OUTLIER_PERCENTILES = (0.01, 0.99)
+
+# Number of rows fetched per round trip when streaming tables from the database
+DB_CHUNK_SIZE = 50000
+
+# Connection pool settings for the engine shared by every DBConnection in the process
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+# Seconds after which pooled connections are recycled
+DB_POOL_RECYCLE = 1800
+DB_POOL_PRE_PING = True
+
+# How DataFrames are written to the database: 'copy' streams rows through PostgreSQL
+# COPY FROM STDIN, 'insert' uses the default pandas INSERT statements
+DB_WRITE_METHOD = 'copy'
+# Number of rows sent per COPY/INSERT batch
+DB_WRITE_BATCH_SIZE = 100000
+# Replace tables through a staging table swapped in a single transaction
+DB_ATOMIC_REPLACE = True
+
+# Format of the artifacts handed between pipeline stages: 'feather' (Arrow IPC, memory-mapped
+# on read), 'parquet' or 'csv' (export only, slow to re-parse)
+ARTIFACT_FORMAT = 'feather'
+
+# Shrink column dtypes when loading and cleaning: downcast integers and turn low-cardinality
+# strings into categoricals
+COMPACT_DTYPES = True
+# String columns whose share of distinct values is at most this ratio become categoricals
+DTYPE_CATEGORY_RATIO = 0.5
+# Floating point precision used by standardization, PCA and KMeans: 'float64' or 'float32'
+COMPUTE_DTYPE = 'float64'
+
+# PCA solver: 'auto' (exact, chosen by scikit-learn), 'randomized' (approximate, faster for
+# large matrices) or 'incremental' (partial fits over batches, bounded memory)
+PCA_SOLVER = 'auto'
+# Rows per batch for incremental PCA
+PCA_BATCH_SIZE = 10000
+
+# KMeans training mode: 'full' fits KMeans on the whole train set, 'minibatch' runs
+# MiniBatchKMeans partial fits over chunks of the train artifact
+KMEANS_MODE = 'full'
+# Rows per mini-batch
+KMEANS_BATCH_SIZE = 4096
+# Maximum passes over the train artifact in mini-batch mode
+KMEANS_MAX_EPOCHS = 20
+# Stop early once a pass moves the centers by less than this fraction of their norm
+KMEANS_TOL = 1e-4
+# Share of the batch size below which a cluster's center is reassigned
+KMEANS_REASSIGNMENT_RATIO = 0.01
+
+# Candidate numbers of clusters tried by the k sweep (inclusive)
+KSWEEP_MIN_K = 2
+KSWEEP_MAX_K = 10
+# Rows sampled from the train data to fit each candidate, and to estimate its silhouette
+KSWEEP_SAMPLE_SIZE = 50000
+KSWEEP_SILHOUETTE_SAMPLE_SIZE = 10000
+# How k is picked: 'silhouette', 'davies_bouldin', 'calinski_harabasz' or 'elbow'
+KSWEEP_RULE = 'silhouette'
+# Worker processes for the sweep (None for one per CPU) and BLAS/OpenMP threads per worker
+KSWEEP_WORKERS = None
+KSWEEP_THREADS_PER_WORKER = 1
+# Samples smaller than this are swept in the calling process, where starting the workers
+# would cost more than the fits
+KSWEEP_PARALLEL_MIN_ROWS = 20000
+
+# Silhouette evaluation mode: 'exact' (all pairwise distances, computed in bounded-memory
+# blocks), 'sample' (stratified sample with a confidence interval) or 'simplified'
+# (distances to the cluster centers only)
+SILHOUETTE_MODE = 'exact'
+# Rows drawn in 'sample' mode
+SILHOUETTE_SAMPLE_SIZE = 20000
+# Memory budget for one block of pairwise distances in 'exact' mode, in MiB
+SILHOUETTE_WORKING_MEMORY_MB = 256
+
+# Code given to categorical values outside the vocabulary learnt in training, and the file the
+# vocabularies are saved to next to the model
+UNSEEN_CATEGORY_CODE = -1
+VOCABULARIES_FILE = 'vocabularies.json'
+
+# Largest number of rows accepted by one batch prediction request, and rows per streamed block
+PREDICT_BATCH_MAX_ROWS = 1000000
+# Bytes allowed per value of a batch body, which bounds its size before it is read: enough for a
+# float64 written out in full as JSON text with its separator
+PREDICT_BATCH_MAX_BYTES_PER_VALUE = 32
+PREDICT_STREAM_BLOCK_ROWS = 10000
+# Largest number of records accepted by one raw prediction request
+PREDICT_RAW_MAX_RECORDS = 10000
+
+# Versioned model registry: one directory per published model version plus a pointer to the
+# active one, which the API reloads without a restart
+MODEL_REGISTRY_DIR = os.path.join(ARTIFACTS_DIR, 'models', 'registry')
+# Seconds between checks of the active registry version by the API, 0 to only reload on request
+MODEL_RELOAD_INTERVAL = 5
+
+# Column identifying the subscriber of every xDR session
+MSISDN_COLUMN = 'MSISDN/Number'
+# Rows read per chunk when aggregating sessions per subscriber
+AGGREGATION_CHUNK_ROWS = 100000
+# Format of the Start and End timestamps of the xDR sessions, for pandas and for PostgreSQL
+XDR_TIME_FORMAT = '%m/%d/%Y %H:%M'
+XDR_TIME_FORMAT_SQL = 'MM/DD/YYYY HH24:MI'
+
+# Parallel extraction of a table into partitioned artifacts: rows are split by equal-width
+# ranges of EXTRACT_RANGE_COLUMN ('range'), windows of EXTRACT_TIME_COLUMN ('time') or a hash of
+# EXTRACT_HASH_COLUMN ('hash'), and read by EXTRACT_WORKERS processes with one connection each
+EXTRACT_MODE = 'range'
+EXTRACT_PARTITIONS = 16
+EXTRACT_WORKERS = 4
+EXTRACT_RANGE_COLUMN = 'Bearer Id'
+EXTRACT_TIME_COLUMN = 'Start'
+EXTRACT_HASH_COLUMN = MSISDN_COLUMN
+# Persisted per-subscriber aggregate state, refreshed with the sessions past its watermark
+AGGREGATE_STATE_FILE = os.path.join(ARTIFACTS_DIR, 'aggregates', 'user_state.feather')
+# Incremental refreshes between full rebuilds that verify, and if needed replace, the state
+AGGREGATE_FULL_REBUILD_EVERY = 24
+# One-pass summaries of handsets and network quality: values reported per ranking, counters
+# kept by the Space-Saving heavy hitters, Count-Min sketch size (error of at most e / width of
+# the rows with probability 1 - e^-depth), and relative accuracy and bucket budget of the
+# quantile sketches
+SUMMARY_TOP_K = 10
+SUMMARY_HEAVY_HITTER_CAPACITY = 1000
+SUMMARY_COUNT_MIN_WIDTH = 2048
+SUMMARY_COUNT_MIN_DEPTH = 5
+SUMMARY_QUANTILE_ACCURACY = 0.01
+SUMMARY_QUANTILE_MAX_BUCKETS = 2048
+# Rows scored per batch when assigning every subscriber to a segment
+SEGMENT_BATCH_ROWS = 100000
+
+# Outputs of the pipeline stages, one directory per stage and fingerprint of its inputs
+PIPELINE_CACHE_DIR = os.path.join(ARTIFACTS_DIR, 'cache')
+
+# Record wall/CPU time, rows and peak RSS of every instrumented stage in a JSON run report
+INSTRUMENTATION_ENABLED = True
+# Most recent top-level measurements kept in memory and in the run report of a process, so that
+# a long-lived process calling instrumented functions does not grow without bound
+INSTRUMENTATION_MAX_RECORDS = 100
+# Seconds between RSS samples while a stage runs
+INSTRUMENTATION_RSS_INTERVAL = 0.01
+# Names of the stages to run under cProfile, e.g. ('transform_data', 'fit_kmeans')
+INSTRUMENTATION_PROFILE_STAGES = ()
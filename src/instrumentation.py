@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import functools
+import threading
+import logging
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import psutil
+from config import ARTIFACTS_DIR, INSTRUMENTATION_ENABLED, INSTRUMENTATION_RSS_INTERVAL, INSTRUMENTATION_PROFILE_STAGES
+from config import INSTRUMENTATION_MAX_RECORDS
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Every process writes its measurements to reports/run_<RUN_ID>.json
+RUN_ID = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+
+_process = psutil.Process()
+_local = threading.local()
+# The most recent top-level measurements, and how many older ones were dropped
+_records = deque(maxlen=INSTRUMENTATION_MAX_RECORDS)
+_dropped = 0
+_lock = threading.Lock()
+_active = set()
+_sampler = None
+
+
+class Measurement:
+    """
+    The timings, sizes and memory of one run of a stage or sub-step, with the measurements of
+    the sub-steps it ran.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.status = 'ok'
+        self.children = []
+        self.rows_in = self.columns_in = self.rows_out = self.columns_out = None
+        self.wall_time_s = self.cpu_time_s = None
+        self.rss_start = self.peak_rss = _process.memory_info().rss
+        self.rss_end = None
+        self.profile_path = None
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def annotate(self, df_in=None, df_out=None):
+        """
+        Record the shape of the input and/or output of the step; the output may be a tuple of frames.
+        """
+        rows, columns = _shape(df_in)
+        if rows is not None:
+            self.rows_in, self.columns_in = rows, columns
+        rows, columns = _shape(df_out)
+        if rows is not None:
+            self.rows_out, self.columns_out = rows, columns
+
+    def finish(self):
+        self.wall_time_s = time.perf_counter() - self._wall_start
+        self.cpu_time_s = time.process_time() - self._cpu_start
+        self.rss_end = _process.memory_info().rss
+        self.peak_rss = max(self.peak_rss, self.rss_end)
+
+    def to_dict(self):
+        rows = self.rows_in if self.rows_in is not None else self.rows_out
+        return {
+            'name': self.name,
+            'status': self.status,
+            'wall_time_s': self.wall_time_s,
+            'cpu_time_s': self.cpu_time_s,
+            'rows_in': self.rows_in,
+            'columns_in': self.columns_in,
+            'rows_out': self.rows_out,
+            'columns_out': self.columns_out,
+            'rows_per_s': rows / self.wall_time_s if rows and self.wall_time_s else None,
+            'rss_start_mb': self.rss_start / 2 ** 20,
+            'rss_end_mb': self.rss_end / 2 ** 20 if self.rss_end is not None else None,
+            'peak_rss_mb': self.peak_rss / 2 ** 20,
+            'profile': self.profile_path,
+            'steps': [child.to_dict() for child in self.children],
+        }
+
+
+def _shape(value):
+    """
+    (rows, columns) of a DataFrame or 2-D array, or of a tuple of them: the rows of all frames
+    added up and the columns of the first.
+    """
+    frames = [item for item in (value if isinstance(value, tuple) else (value,))
+              if len(getattr(item, 'shape', ())) == 2]
+    if not frames:
+        return None, None
+    return sum(frame.shape[0] for frame in frames), frames[0].shape[1]
+
+
+def _sample_rss():
+    """
+    Sample the RSS of the process while any measurement is running, since the OS only keeps the
+    peak of the whole process.
+    """
+    global _sampler
+    while True:
+        with _lock:
+            if not _active:
+                _sampler = None
+                return
+            rss = _process.memory_info().rss
+            for measurement in _active:
+                measurement.peak_rss = max(measurement.peak_rss, rss)
+        time.sleep(INSTRUMENTATION_RSS_INTERVAL)
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_measurement():
+    """
+    Return the innermost measurement running in this thread, or None.
+    """
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def annotate(df_in=None, df_out=None):
+    """
+    Record input/output shapes on the innermost running measurement, if there is one.
+    """
+    measurement = current_measurement()
+    if measurement is not None:
+        measurement.annotate(df_in, df_out)
+
+
+def run_report_path():
+    return os.path.join(ARTIFACTS_DIR, "reports", f"run_{RUN_ID}.json")
+
+
+def write_run_report():
+    """
+    Write the last INSTRUMENTATION_MAX_RECORDS finished top-level measurements of this process
+    to the JSON run report.
+    """
+    report = {'run_id': RUN_ID, 'pid': os.getpid(), 'argv': sys.argv, 'dropped_stages': _dropped,
+              'stages': [record.to_dict() for record in _records]}
+    path = run_report_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+@contextmanager
+def measure(name, profile=None):
+    """
+    Measure the block as a stage or, inside another measurement, as one of its sub-steps.
+
+    When the outermost measurement finishes, the run report is rewritten. With `profile`, or
+    when `name` is in INSTRUMENTATION_PROFILE_STAGES, the block also runs under cProfile and the
+    stats are dumped next to the run report.
+    """
+    global _sampler, _dropped
+    if not INSTRUMENTATION_ENABLED:
+        # Still timed, since callers such as the pipeline report stage times; only the RSS
+        # sampling, profiling and run report are skipped
+        measurement = Measurement(name)
+        try:
+            yield measurement
+        except BaseException:
+            measurement.status = 'failed'
+            raise
+        finally:
+            measurement.finish()
+        return
+
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    measurement = Measurement(name)
+    with _lock:
+        _active.add(measurement)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_rss, daemon=True)
+            _sampler.start()
+
+    # cProfile cannot nest, so sub-steps of a profiled stage are only part of its profile
+    profiler = None
+    if (profile or (profile is None and name in INSTRUMENTATION_PROFILE_STAGES)) \
+            and not any(m.profile_path for m in stack):
+        profiler = cProfile.Profile()
+        measurement.profile_path = os.path.join(ARTIFACTS_DIR, "reports", "profiles", f"{RUN_ID}_{name}.prof")
+        profiler.enable()
+
+    stack.append(measurement)
+    try:
+        yield measurement
+    except BaseException:
+        measurement.status = 'failed'
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(os.path.dirname(measurement.profile_path), exist_ok=True)
+            profiler.dump_stats(measurement.profile_path)
+        measurement.finish()
+        stack.pop()
+        with _lock:
+            _active.discard(measurement)
+
+        logger.info("%s %s in %.3fs wall, %.3fs CPU, peak RSS %.1f MiB", name, measurement.status,
+                    measurement.wall_time_s, measurement.cpu_time_s, measurement.peak_rss / 2 ** 20)
+        if parent is not None:
+            parent.children.append(measurement)
+        else:
+            if len(_records) == _records.maxlen:
+                _dropped += 1
+            _records.append(measurement)
+            write_run_report()
+
+
+def instrumented(name=None):
+    """
+    Decorator measuring every call of a function with `measure`, under the function name by default.
+
+    The first DataFrame or array argument is recorded as the input and the DataFrames or arrays
+    returned as the output.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(name or func.__name__) as measurement:
+                inputs = [arg for arg in list(args) + list(kwargs.values()) if len(getattr(arg, 'shape', ())) == 2]
+                if inputs:
+                    measurement.annotate(df_in=inputs[0])
+                result = func(*args, **kwargs)
+                measurement.annotate(df_out=result)
+                return result
+        return wrapper
+    return decorator
@@ -1,23 +1,321 @@
 import pandas as pd
 import os
 import logging
-from config import MISSING_THRESHOLD, ARTIFACTS_DIR
+from config import MISSING_THRESHOLD, ARTIFACTS_DIR, MSISDN_COLUMN
 from exception import CustomException
 import sys
 
 import pandas as pd
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.decomposition import PCA
-from config import PCA_COMPONENTS
+from sklearn.preprocessing import StandardScaler
+from sklearn.decomposition import PCA, IncrementalPCA
+from config import PCA_COMPONENTS, PCA_SOLVER, PCA_BATCH_SIZE
 from sklearn.model_selection import train_test_split
 from config import ARTIFACTS_DIR, TEST_SIZE 
 
 import pickle
+import math
+import multiprocessing
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+import json
+import sklearn
+from datetime import datetime, timezone
+from config import ARTIFACT_FORMAT, COMPACT_DTYPES, DTYPE_CATEGORY_RATIO, COMPUTE_DTYPE
+from config import UNSEEN_CATEGORY_CODE, VOCABULARIES_FILE
+from instrumentation import instrumented
 
 # Get logger
 logger = logging.getLogger(__name__)
 
+# File extension used for each artifact format
+ARTIFACT_EXTENSIONS = {'feather': '.feather', 'parquet': '.parquet', 'csv': '.csv'}
 
+
+def artifact_path(file_name, fmt=ARTIFACT_FORMAT):
+    """
+    Return the path of an artifact in the artifacts folder, with the extension of `fmt`.
+    """
+    if fmt not in ARTIFACT_EXTENSIONS:
+        raise ValueError(f"Unknown artifact format '{fmt}', expected one of {sorted(ARTIFACT_EXTENSIONS)}")
+    base_name, _ = os.path.splitext(file_name)
+    return os.path.join(ARTIFACTS_DIR, base_name + ARTIFACT_EXTENSIONS[fmt])
+
+
+def save_artifact(df, file_name, fmt=ARTIFACT_FORMAT):
+    """
+    Save a DataFrame to the artifacts folder in the given format and return its path.
+
+    Feather files are written uncompressed so that they can be memory-mapped on read. The file
+    is written under a temporary name and then renamed, so DataFrames still mapped from a
+    previous version of the artifact keep seeing their own data.
+    """
+    os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+    file_path = artifact_path(file_name, fmt)
+    temp_path = file_path + '.tmp'
+    if fmt == 'feather':
+        df.reset_index(drop=True).to_feather(temp_path, compression='uncompressed')
+    elif fmt == 'parquet':
+        df.to_parquet(temp_path, index=False)
+    else:
+        df.to_csv(temp_path, index=False)
+        write_dtype_plan(file_path, df)
+    os.replace(temp_path, file_path)
+    return file_path
+
+
+def dtype_plan_path(file_path):
+    """
+    Path of the dtype plan stored next to a CSV artifact.
+    """
+    return os.path.splitext(file_path)[0] + '.dtypes.json'
+
+
+def write_dtype_plan(file_path, df):
+    """
+    Record the dtypes of a CSV artifact, which the format cannot store itself, so that it is
+    reloaded with the same layout. Feather and Parquet keep pandas dtypes in their metadata.
+    """
+    with open(dtype_plan_path(file_path), 'w') as f:
+        json.dump({col: str(dtype) for col, dtype in df.dtypes.items()}, f, indent=2)
+
+
+def load_artifact(file_path, columns=None):
+    """
+    Load an artifact written by save_artifact, choosing the reader from the file extension.
+
+    Feather files are memory-mapped and converted without consolidating columns, so numeric
+    columns without nulls are read without copying.
+    """
+    try:
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension == ARTIFACT_EXTENSIONS['feather']:
+            table = feather.read_table(file_path, columns=columns, memory_map=True)
+            return table.to_pandas(split_blocks=True)
+        if extension == ARTIFACT_EXTENSIONS['parquet']:
+            return pd.read_parquet(file_path, columns=columns, memory_map=True)
+        df = pd.read_csv(file_path, usecols=columns)
+        if os.path.exists(dtype_plan_path(file_path)):
+            with open(dtype_plan_path(file_path)) as f:
+                plan = json.load(f)
+            df = apply_dtype_plan(df, plan)
+        return df
+    except Exception as e:
+        error_message = f"Error loading artifact {file_path}: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+class ArtifactWriter:
+    """
+    Write a DataFrame artifact one chunk at a time, in the same formats as save_artifact.
+
+    The schema of the first chunk is used for the whole file; later chunks are cast to it.
+    As with save_artifact, the file only replaces an existing artifact once it is complete.
+
+    Usage:
+        with ArtifactWriter('cleaned_data') as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(self, file_name, fmt=ARTIFACT_FORMAT):
+        self.fmt = fmt
+        self.file_path = artifact_path(file_name, fmt)
+        self.temp_path = self.file_path + '.tmp'
+        self.schema = None
+        self.rows_written = 0
+        self._writer = None
+
+    def __enter__(self):
+        os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # Leave any existing artifact untouched when writing failed
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def write(self, df):
+        """
+        Append a chunk to the artifact.
+        """
+        if self.fmt == 'csv':
+            if self.rows_written == 0:
+                write_dtype_plan(self.file_path, df)
+            df.to_csv(self.temp_path, index=False, mode='w' if self.rows_written == 0 else 'a',
+                      header=self.rows_written == 0)
+        else:
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            if self._writer is None:
+                self.schema = table.schema
+                if self.fmt == 'feather':
+                    options = pa.ipc.IpcWriteOptions(compression=None)
+                    self._writer = pa.ipc.new_file(self.temp_path, self.schema, options=options)
+                else:
+                    self._writer = pq.ParquetWriter(self.temp_path, self.schema)
+            self._writer.write_table(table)
+        self.rows_written += len(df)
+
+    def close(self):
+        """
+        Finalize the artifact and move it into place. Called automatically when used as a
+        context manager.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self.temp_path):
+            os.replace(self.temp_path, self.file_path)
+
+
+def iter_artifact_chunks(file_path, chunksize, columns=None):
+    """
+    Iterate over an artifact written by save_artifact as DataFrames of at most `chunksize` rows.
+
+    Feather files are memory-mapped and sliced without copying; Parquet files are decoded one
+    batch at a time.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ARTIFACT_EXTENSIONS['feather']:
+        table = feather.read_table(file_path, columns=columns, memory_map=True)
+        for batch in table.to_batches(max_chunksize=chunksize):
+            yield batch.to_pandas(split_blocks=True)
+    elif extension == ARTIFACT_EXTENSIONS['parquet']:
+        for batch in pq.ParquetFile(file_path, memory_map=True).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        plan = {}
+        if os.path.exists(dtype_plan_path(file_path)):
+            with open(dtype_plan_path(file_path)) as f:
+                plan = json.load(f)
+        for chunk in pd.read_csv(file_path, usecols=columns, chunksize=chunksize):
+            yield apply_dtype_plan(chunk, plan)
+
+
+def export_artifact_to_csv(file_path):
+    """
+    Export an artifact to CSV next to the original file and return the CSV path.
+    """
+    csv_path = os.path.splitext(file_path)[0] + ARTIFACT_EXTENSIONS['csv']
+    load_artifact(file_path).to_csv(csv_path, index=False)
+    logger.info("Artifact %s exported to %s", file_path, csv_path)
+    return csv_path
+
+
+def worker_context(preload=()):
+    """
+    The multiprocessing context of worker process pools.
+
+    Forking is avoided: the parent has threads, such as the instrumentation RSS sampler or an
+    OpenMP pool of an earlier fit, whose locks a forked child could inherit in a held state.
+    Workers are forked from a clean forkserver process that has already imported the `preload`
+    modules, or spawned where forkserver is not available.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(list(preload))
+    return context
+
+
+def smallest_integer_dtype(min_value, max_value):
+    """
+    Return the smallest integer dtype holding every value in [min_value, max_value], or None
+    when no 64-bit integer type does.
+    """
+    for dtype in ('int8', 'int16', 'int32', 'int64'):
+        info = np.iinfo(dtype)
+        if info.min <= min_value and max_value <= info.max:
+            return dtype
+    if min_value >= 0 and max_value <= np.iinfo('uint64').max:
+        return 'uint64'
+    return None
+
+
+def plan_column_dtype(dtype, min_value, max_value, integral, distinct, count):
+    """
+    Choose the compact dtype of a column from its summary statistics.
+
+    Integer columns and float columns holding only whole numbers are downcast to the smallest
+    integer dtype; string columns with few distinct values become categoricals.
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return str(dtype)
+    if pd.api.types.is_numeric_dtype(dtype):
+        if count and integral:
+            return smallest_integer_dtype(min_value, max_value) or str(dtype)
+        return str(dtype)
+    if (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)) \
+            and count and distinct <= DTYPE_CATEGORY_RATIO * count:
+        return 'category'
+    return str(dtype)
+
+
+def plan_dtypes(df):
+    """
+    Return a {column: dtype} map that stores `df` in as little memory as possible without
+    changing any value. Columns with missing values keep a nullable-compatible dtype.
+    """
+    plan = {}
+    for col in df.columns:
+        series = df[col]
+        has_nulls = series.isna().any()
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series) \
+                and not has_nulls and len(series):
+            values = series.to_numpy()
+            integral = bool(np.all(np.isfinite(values)) and np.all(np.mod(values, 1) == 0))
+            plan[col] = plan_column_dtype(series.dtype, values.min(), values.max(), integral, None, len(series))
+        elif pd.api.types.is_numeric_dtype(series):
+            plan[col] = str(series.dtype)
+        else:
+            plan[col] = plan_column_dtype(series.dtype, None, None, False, series.nunique(), len(series))
+    return plan
+
+
+def apply_dtype_plan(df, plan):
+    """
+    Cast the columns of `df` named in `plan` to their planned dtypes.
+    """
+    changes = {col: dtype for col, dtype in plan.items()
+               if col in df.columns and str(df[col].dtype) != str(dtype)}
+    return df.astype(changes) if changes else df
+
+
+@instrumented()
+def optimize_dtypes(df):
+    """
+    Shrink `df` to the dtypes chosen by plan_dtypes.
+    """
+    try:
+        before = df.memory_usage(deep=True).sum()
+        df = apply_dtype_plan(df, plan_dtypes(df))
+        logger.info("Compacted dtypes from %d to %d bytes", before, df.memory_usage(deep=True).sum())
+        return df
+    except Exception as e:
+        error_message = f"Error optimizing dtypes: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+def drop_missing_msisdn(df):
+    """
+    Drop the sessions without an MSISDN, so that no cleaned row carries an imputed subscriber
+    and every row of the cleaned data can be assigned to a segment.
+    """
+    if MSISDN_COLUMN not in df.columns:
+        return df
+    return df[df[MSISDN_COLUMN].notna()]
+
+
+@instrumented()
 def drop_missing_columns(df):
     """
     Drop columns with more than MISSING_THRESHOLD missing values.
@@ -33,19 +331,140 @@ def drop_missing_columns(df):
         raise CustomException(error_message, error_detail=sys.exc_info())
 
 
+class MissingValueStatistics:
+    """
+    Per-column statistics for dropping sparse columns and imputing the rest, accumulated
+    one chunk at a time so that a table never has to be held in memory at once.
+
+    Numerical sums are kept as exactly rounded partial sums (math.fsum), which makes the
+    resulting means independent of how the rows were split into chunks.
+    """
+
+    def __init__(self):
+        self.row_count = 0
+        self.columns = []
+        self.null_counts = {}
+        self.numeric = {}
+        self.sum_partials = {}
+        self.value_counts = {}
+        self.dtypes = {}
+        self.mins = {}
+        self.maxs = {}
+        self.integral = {}
+
+    def update(self, df):
+        """
+        Fold one chunk of rows into the statistics.
+        """
+        self.row_count += len(df)
+        for col in df.columns:
+            series = df[col]
+            if col not in self.null_counts:
+                self.columns.append(col)
+                self.null_counts[col] = 0
+                self.numeric[col] = pd.api.types.is_numeric_dtype(series)
+                self.sum_partials[col] = []
+                self.value_counts[col] = pd.Series(dtype='int64')
+                self.dtypes[col] = series.dtype
+                self.integral[col] = True
+
+            values = series.dropna()
+            self.null_counts[col] += len(series) - len(values)
+            if len(values) == 0:
+                # An all-null chunk carries no dtype information
+                continue
+            if pd.api.types.is_numeric_dtype(values) and not self.numeric[col]:
+                self.numeric[col] = True
+                self.dtypes[col] = values.dtype
+            if self.numeric[col]:
+                chunk_min, chunk_max = values.min(), values.max()
+                self.mins[col] = min(self.mins.get(col, chunk_min), chunk_min)
+                self.maxs[col] = max(self.maxs.get(col, chunk_max), chunk_max)
+                values = values.to_numpy(dtype='float64')
+                if self.integral[col] and not pd.api.types.is_integer_dtype(series):
+                    self.integral[col] = bool(np.all(np.isfinite(values)) and np.all(np.mod(values, 1) == 0))
+                chunk_sum = math.fsum(values)
+                # Keep the rounding error of the chunk sum so that the total stays exact
+                self.sum_partials[col].extend([chunk_sum, math.fsum(np.append(values, -chunk_sum))])
+            else:
+                self.value_counts[col] = self.value_counts[col].add(values.value_counts(), fill_value=0)
+        return self
+
+    def kept_columns(self):
+        """
+        Columns with at least MISSING_THRESHOLD non-missing values, in their original order.
+        """
+        threshold = MISSING_THRESHOLD * self.row_count
+        return [col for col in self.columns if self.row_count - self.null_counts[col] >= threshold]
+
+    def fill_value(self, col):
+        """
+        The mean of a numerical column or the mode of a categorical column.
+
+        Ties between modes are broken towards the smallest value, as DataFrame.mode does.
+        """
+        if self.numeric[col]:
+            count = self.row_count - self.null_counts[col]
+            return math.fsum(self.sum_partials[col]) / count if count else np.nan
+        counts = self.value_counts[col]
+        if counts.empty:
+            return np.nan
+        return counts.sort_index().idxmax()
+
+    def dtype_plan(self, columns):
+        """
+        The compact dtypes of `columns` after imputation, matching what plan_dtypes returns
+        for the imputed table read in one piece.
+        """
+        plan = {}
+        for col in columns:
+            count = self.row_count - self.null_counts[col]
+            if self.numeric[col] and not pd.api.types.is_bool_dtype(self.dtypes[col]):
+                if not count:
+                    plan[col] = 'float64'
+                    continue
+                dtype = 'float64' if self.null_counts[col] else self.dtypes[col]
+                min_value, max_value, integral = self.mins[col], self.maxs[col], self.integral[col]
+                if self.null_counts[col]:
+                    fill = self.fill_value(col)
+                    min_value, max_value = min(min_value, fill), max(max_value, fill)
+                    integral = integral and float(fill).is_integer()
+                plan[col] = plan_column_dtype(dtype, min_value, max_value, integral, None, self.row_count)
+            elif self.numeric[col]:
+                plan[col] = str(self.dtypes[col])
+            else:
+                dtype = plan_column_dtype(self.dtypes[col], None, None, False, len(self.value_counts[col]),
+                                          self.row_count)
+                if dtype == 'category':
+                    # Fixed categories keep every chunk's dictionary identical
+                    dtype = pd.CategoricalDtype(sorted(self.value_counts[col].index))
+                plan[col] = dtype
+        return plan
+
+
+def apply_imputation(df, statistics):
+    """
+    Fill the missing values of a DataFrame or chunk with the fill values of `statistics`.
+
+    Numerical columns that contain nulls anywhere in the table are returned as float64, so
+    every chunk ends up with the same dtypes as the table read in one piece.
+    """
+    for col in df.columns:
+        if statistics.numeric[col] and statistics.null_counts[col]:
+            df[col] = df[col].astype('float64')
+        if df[col].isna().any():
+            df[col] = df[col].fillna(statistics.fill_value(col))
+    return df
+
+
+@instrumented()
 def impute_missing_values(df):
     """
     Impute missing values in numerical columns with mean and categorical columns with mode.
     """
     try:
-        numerical_cols = df.select_dtypes(include='number').columns
-        categorical_cols = df.select_dtypes(exclude='number').columns
-
-        # Impute numerical columns with mean
-        df[numerical_cols] = df[numerical_cols].fillna(df[numerical_cols].mean())
-
-        # Impute categorical columns with mode
-        df[categorical_cols] = df[categorical_cols].fillna(df[categorical_cols].mode().iloc[0])
+        statistics = MissingValueStatistics().update(df)
+        df = apply_imputation(df, statistics)
 
         logger.info("Imputed missing values")
         return df
@@ -55,17 +474,75 @@ def impute_missing_values(df):
         raise CustomException(error_message, error_detail=sys.exc_info())
 
 
-def save_cleaned_data(df, file_name):
+@instrumented()
+def clean_in_chunks(read_chunks, file_name, fmt=ARTIFACT_FORMAT, compact=COMPACT_DTYPES, group_statistics=None):
     """
-    Save cleaned data to artifacts folder.
+    Drop sparse columns, impute missing values and save the result without loading the
+    whole table, producing the same artifact as drop_missing_msisdn, drop_missing_columns
+    and impute_missing_values.
+
+    The first pass collects null counts, sums and frequency tables; the second pass reads
+    only the kept columns, imputes each chunk and appends it to the artifact.
+
+    With `group_statistics`, an object with the update/apply methods of
+    components.group_imputation.GroupStatistics, the first pass also feeds it and every
+    chunk goes through its apply before the global imputation. An extra pass then collects
+    the global fill values from the group-imputed chunks.
+
+    Args:
+        read_chunks: A callable taking an optional `columns` list and returning a fresh
+            iterator of DataFrame chunks, e.g. a wrapper around DBConnection.read_table_in_chunks.
+        file_name: The name of the cleaned artifact.
+        fmt: The artifact format.
+        compact: Whether to store the artifact with the dtypes chosen by plan_dtypes.
+        group_statistics: Group-aware capping and imputation applied before the global one.
+
+    Returns:
+        The path of the cleaned artifact.
     """
     try:
-        # Create artifacts directory if it doesn't exist
-        if not os.path.exists(ARTIFACTS_DIR):
-            os.makedirs(ARTIFACTS_DIR)
+        # The MSISDN column has no nulls left, so it is never dropped and every pass can filter on it
+        def read_subscriber_chunks(columns=None):
+            return (drop_missing_msisdn(chunk) for chunk in read_chunks(columns=columns))
+
+        statistics = MissingValueStatistics()
+        for chunk in read_subscriber_chunks():
+            statistics.update(chunk)
+            if group_statistics is not None:
+                group_statistics.update(chunk)
+        kept_columns = statistics.kept_columns()
+        logger.info("Scanned %d rows; keeping %d of %d columns", statistics.row_count,
+                    len(kept_columns), len(statistics.columns))
+
+        def prepare(chunk):
+            chunk = chunk[kept_columns]
+            return chunk if group_statistics is None else group_statistics.apply(chunk)
+
+        if group_statistics is not None:
+            # Columns are dropped on the raw nulls, but filled with the global statistics of
+            # what the groups left missing
+            statistics = MissingValueStatistics()
+            for chunk in read_subscriber_chunks(columns=kept_columns):
+                statistics.update(prepare(chunk))
+
+        plan = statistics.dtype_plan(kept_columns) if compact else {}
+        with ArtifactWriter(file_name, fmt) as writer:
+            for chunk in read_subscriber_chunks(columns=kept_columns):
+                writer.write(apply_dtype_plan(apply_imputation(prepare(chunk), statistics), plan))
+        logger.info("Cleaned data saved successfully to %s", writer.file_path)
+        return writer.file_path
+    except Exception as e:
+        error_message = f"Error cleaning data in chunks: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
 
-        file_path = os.path.join(ARTIFACTS_DIR, file_name)
-        df.to_csv(file_path, index=False)
+
+def save_cleaned_data(df, file_name, fmt=ARTIFACT_FORMAT):
+    """
+    Save cleaned data to artifacts folder.
+    """
+    try:
+        file_path = save_artifact(df, file_name, fmt)
         logger.info("Cleaned data saved successfully to %s", file_path)
     except Exception as e:
         error_message = f"Error saving cleaned data: {str(e)}"
@@ -75,55 +552,320 @@ def save_cleaned_data(df, file_name):
 
 ################################################################################################################################ Data_transformation
 
-def encode_categorical_variables(df):
+class CategoricalEncoder:
+    """
+    Label encoding of one column with a vocabulary that can be saved and extended.
+
+    A fitted vocabulary is sorted, so values get the same codes as with LabelEncoder, but
+    values are looked up in a hash index instead of being sorted on every call, and a
+    categorical column is encoded through its categories only. Values outside the vocabulary,
+    such as a handset released after training, and missing values get UNSEEN_CATEGORY_CODE.
+    """
+
+    def __init__(self, classes=()):
+        self.classes_ = np.asarray(classes, dtype=object)
+        self._index = None
+
+    @staticmethod
+    def unique_values(values):
+        """
+        The distinct non-missing values of a column, read from its categories when it has them.
+        """
+        values = values if isinstance(values, pd.Series) else pd.Series(values)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values.cat.remove_unused_categories().cat.categories.to_numpy(dtype=object)
+        return pd.unique(values.dropna().to_numpy(dtype=object))
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = pd.Index(self.classes_, dtype=object)
+        return self._index
+
+    def fit(self, values):
+        self.classes_ = np.sort(self.unique_values(values))
+        self._index = None
+        return self
+
+    def partial_fit(self, values):
+        """
+        Append the values not in the vocabulary yet. Codes already handed out never change.
+        """
+        uniques = self.unique_values(values)
+        new = np.sort(uniques[self.index.get_indexer(uniques) < 0])
+        if len(new):
+            self.classes_ = np.concatenate([self.classes_, new])
+            self._index = None
+        return self
+
+    def transform(self, values):
+        values = values if isinstance(values, pd.Series) else pd.Series(values)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = self.index.get_indexer(values.cat.categories.astype(object))
+            # Missing values have category code -1, which picks the appended unseen code
+            return np.append(codes, UNSEEN_CATEGORY_CODE).astype(np.int64)[values.cat.codes.to_numpy()]
+        codes = self.index.get_indexer(values.to_numpy(dtype=object)).astype(np.int64)
+        codes[codes < 0] = UNSEEN_CATEGORY_CODE
+        return codes
+
+    def fit_transform(self, values):
+        values = values if isinstance(values, pd.Series) else pd.Series(values)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return self.fit(values).transform(values)
+        # One hash pass gives the codes in order of appearance, which are then remapped to the sorted order
+        codes, uniques = pd.factorize(values.to_numpy(dtype=object))
+        order = np.argsort(uniques)
+        self.classes_ = np.asarray(uniques, dtype=object)[order]
+        self._index = None
+        ranks = np.empty(len(order) + 1, dtype=np.int64)
+        ranks[order] = np.arange(len(order))
+        ranks[-1] = UNSEEN_CATEGORY_CODE
+        return ranks[codes]
+
+    def __getstate__(self):
+        # The index is rebuilt on first use rather than pickled
+        return {'classes_': self.classes_}
+
+    def __setstate__(self, state):
+        self.classes_ = state['classes_']
+        self._index = None
+
+
+@instrumented()
+def encode_categorical_variables(df, return_encoders=False):
     """
     Encode categorical variables using label encoding.
+
+    With `return_encoders`, the fitted encoder of every column is returned as well.
     """
     # Identify categorical columns
-    categorical_cols = df.select_dtypes(include=['object']).columns
+    categorical_cols = df.select_dtypes(include=['object', 'category']).columns
     
-    # Perform label encoding
-    label_encoder = LabelEncoder()
+    # Perform label encoding, keeping one fitted encoder per column. The columns are encoded one
+    # after the other: hashing object values holds the GIL, so threads would not run them at the
+    # same time, and worker processes would cost more to send the columns to than to encode them
+    encoders = {}
     for col in categorical_cols:
-        df[col] = label_encoder.fit_transform(df[col])
+        encoders[col] = CategoricalEncoder()
+        df[col] = encoders[col].fit_transform(df[col])
     
-    return df
+    return (df, encoders) if return_encoders else df
+
+
+def fit_encoders_in_chunks(chunks):
+    """
+    Fit a CategoricalEncoder for every categorical column over an iterator of DataFrame
+    chunks, giving the same codes as encode_categorical_variables on the whole table.
+    """
+    uniques = {}
+    for chunk in chunks:
+        for col in chunk.select_dtypes(include=['object', 'category']).columns:
+            values = CategoricalEncoder.unique_values(chunk[col])
+            uniques[col] = values if col not in uniques else pd.unique(np.concatenate([uniques[col], values]))
+    return {col: CategoricalEncoder().fit(values) for col, values in uniques.items()}
+
+
+def encode_in_chunks(encoders, chunks):
+    """
+    Encode the categorical columns of an iterator of DataFrame chunks with fitted encoders.
+    """
+    for chunk in chunks:
+        for col, encoder in encoders.items():
+            if col in chunk.columns:
+                chunk[col] = encoder.transform(chunk[col])
+        yield chunk
+
+
+def save_vocabularies(encoders, file_name=VOCABULARIES_FILE):
+    """
+    Save the vocabulary of every encoder as JSON next to the model, so that other tools can
+    encode new data with the same codes: the code of a value is its position in the list.
+    """
+    try:
+        model_dir = os.path.join(ARTIFACTS_DIR, "models")
+        os.makedirs(model_dir, exist_ok=True)
+        file_path = os.path.join(model_dir, file_name)
+        vocabularies = {col: encoder.classes_.tolist() for col, encoder in encoders.items()}
+        with open(file_path + '.tmp', 'w') as f:
+            json.dump({'unseen_code': UNSEEN_CATEGORY_CODE, 'vocabularies': vocabularies}, f, default=str)
+        os.replace(file_path + '.tmp', file_path)
+        logger.info("Vocabularies saved successfully to %s", file_path)
+        return file_path
+    except Exception as e:
+        error_message = f"Error saving vocabularies: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())
 
 
-def standardize_numerical_values(df):
+def load_vocabularies(file_path):
+    """
+    Load encoders saved with save_vocabularies, as {column: CategoricalEncoder}.
+    """
+    with open(file_path) as f:
+        vocabularies = json.load(f)['vocabularies']
+    return {col: CategoricalEncoder(classes) for col, classes in vocabularies.items()}
+
+
+@instrumented()
+def standardize_numerical_values(df, return_scaler=False):
     """
     Standardize numerical values using StandardScaler.
+
+    With `return_scaler`, the fitted scaler and the columns it was fitted on are returned as well.
     """
     # Identify numerical columns
-    numerical_cols = df.select_dtypes(include=['float64', 'int64']).columns
+    numerical_cols = df.select_dtypes(include='number').columns
     
     # Perform standardization
     scaler = StandardScaler()
-    df[numerical_cols] = scaler.fit_transform(df[numerical_cols])
+    scaled = scaler.fit_transform(df[numerical_cols].to_numpy(dtype=COMPUTE_DTYPE))
+    df[numerical_cols] = pd.DataFrame(scaled, columns=numerical_cols, index=df.index)
     
-    return df
+    return (df, scaler, list(numerical_cols)) if return_scaler else df
+
+
+def fit_scaler_in_chunks(chunks):
+    """
+    Fit a StandardScaler on the numerical columns of an iterator of DataFrame chunks with
+    partial fits, giving the same means and variances as standardize_numerical_values.
+
+    Returns the fitted scaler and the columns it was fitted on.
+    """
+    scaler, numerical_cols = StandardScaler(), None
+    for chunk in chunks:
+        if numerical_cols is None:
+            numerical_cols = list(chunk.select_dtypes(include='number').columns)
+        scaler.partial_fit(chunk[numerical_cols].to_numpy(dtype=COMPUTE_DTYPE))
+    if numerical_cols is None:
+        raise ValueError("At least one chunk is needed to fit the scaler")
+    return scaler, numerical_cols
+
+
+def scale_in_chunks(scaler, numerical_cols, chunks):
+    """
+    Standardize the numerical columns of an iterator of DataFrame chunks with a fitted scaler.
+    """
+    for chunk in chunks:
+        chunk[numerical_cols] = pd.DataFrame(scaler.transform(chunk[numerical_cols].to_numpy(dtype=COMPUTE_DTYPE)),
+                                             columns=numerical_cols, index=chunk.index)
+        yield chunk
+
+
+def pca_frame(pca_data, index=None):
+    """
+    Wrap projected data in a DataFrame with PC1..PCn columns.
+    """
+    return pd.DataFrame(data=pca_data, columns=[f'PC{i}' for i in range(1, pca_data.shape[1]+1)], index=index)
+
+
+def build_pca(solver=PCA_SOLVER, n_components=PCA_COMPONENTS):
+    """
+    Create an unfitted PCA estimator for the given solver.
+
+    'auto' and 'randomized' use PCA (the latter with a fixed seed); 'incremental' uses
+    IncrementalPCA, which fits batch by batch and bounds the memory of the SVD.
+    """
+    if solver == 'incremental':
+        return IncrementalPCA(n_components=n_components, batch_size=PCA_BATCH_SIZE)
+    if solver in ('auto', 'full', 'randomized'):
+        return PCA(n_components=n_components, svd_solver=solver, random_state=42)
+    raise ValueError(f"Unknown PCA solver '{solver}'")
+
+
+def fit_pca_in_chunks(chunks):
+    """
+    Fit an IncrementalPCA projection over an iterator of DataFrame chunks that do not fit
+    in memory together.
+
+    As in perform_pca, narrow inputs keep all of their columns. Every partial fit needs at least
+    as many rows as components, so small chunks are merged with the next one and a short
+    remainder is merged into the last batch.
+    """
+    pca = None
+    held, pending = None, None
+    for chunk in chunks:
+        if pca is None:
+            pca = IncrementalPCA(n_components=min(PCA_COMPONENTS, chunk.shape[1]))
+        data = chunk.to_numpy(dtype=COMPUTE_DTYPE)
+        pending = data if pending is None else np.vstack([pending, data])
+        if len(pending) >= pca.n_components:
+            if held is not None:
+                pca.partial_fit(held)
+            held, pending = pending, None
+    if held is not None and pending is not None:
+        held = np.vstack([held, pending])
+    elif held is None:
+        held = pending
+    if held is None or len(held) < pca.n_components:
+        raise ValueError(f"At least {pca.n_components if pca else PCA_COMPONENTS} rows are needed to fit PCA")
+    return pca.partial_fit(held)
+
+
+def transform_pca_in_chunks(pca, chunks):
+    """
+    Project an iterator of DataFrame chunks with a fitted PCA, yielding one PC frame per chunk.
+    """
+    for chunk in chunks:
+        yield pca_frame(pca.transform(chunk.to_numpy(dtype=COMPUTE_DTYPE)), index=chunk.index)
 
 
-def perform_pca(df):
+@instrumented()
+def perform_pca(df, return_model=False):
     """
     Perform PCA for dimensionality reduction.
+
+    With `return_model`, the fitted projection is returned as well, so that it can be
+    reused with transform_pca_in_chunks or at serving time.
     """
-    pca = PCA(n_components=PCA_COMPONENTS)
-    pca_data = pca.fit_transform(df)
+    # Narrow inputs, such as the per-subscriber aggregates, keep all of their columns
+    pca = build_pca(n_components=min(PCA_COMPONENTS, df.shape[1]))
+    pca_data = pca.fit_transform(df.to_numpy(dtype=COMPUTE_DTYPE))
     
-    return pd.DataFrame(data=pca_data, columns=[f'PC{i}' for i in range(1, PCA_COMPONENTS+1)])
+    result = pca_frame(pca_data)
+    return (result, pca) if return_model else result
+
+class PreprocessingPipeline:
+    """
+    The encoders, scaler and PCA projection fitted by the transform stage.
+
+    It is saved next to the model so that new records can be transformed exactly as the
+    training data was, without refitting anything.
+    """
+
+    def __init__(self, columns, encoders, scaler, scaled_columns, pca):
+        self.columns = list(columns)
+        self.encoders = encoders
+        self.scaler = scaler
+        self.scaled_columns = list(scaled_columns)
+        self.pca = pca
+        self.version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+        self.sklearn_version = sklearn.__version__
 
-def save_transformed_data(df, file_name):
+    def transform(self, df):
+        """
+        Transform cleaned records into principal components with the fitted steps.
+
+        Raises ValueError when a column is missing. Categorical values not seen in training are
+        encoded as UNSEEN_CATEGORY_CODE.
+        """
+        missing = [col for col in self.columns if col not in df.columns]
+        if missing:
+            raise ValueError(f"Missing columns: {missing}")
+        df = df[self.columns].copy()
+        for col, encoder in self.encoders.items():
+            df[col] = encoder.transform(df[col])
+        df[self.scaled_columns] = pd.DataFrame(
+            self.scaler.transform(df[self.scaled_columns].to_numpy(dtype=COMPUTE_DTYPE)),
+            columns=self.scaled_columns, index=df.index)
+        return pca_frame(self.pca.transform(df.to_numpy(dtype=COMPUTE_DTYPE)), index=df.index)
+
+
+def save_transformed_data(df, file_name, fmt=ARTIFACT_FORMAT):
     """
     Save transformed data to artifacts folder.
     """
     try:
-        # Create artifacts directory if it doesn't exist
-        if not os.path.exists(ARTIFACTS_DIR):
-            os.makedirs(ARTIFACTS_DIR)
-
-        file_path = os.path.join(ARTIFACTS_DIR, file_name)
-        df.to_csv(file_path, index=False)
+        file_path = save_artifact(df, file_name, fmt)
         logger.info("Transformed data saved successfully to %s", file_path)
     except Exception as e:
         error_message = f"Error saving transformed data: {str(e)}"
@@ -132,6 +874,7 @@ def save_transformed_data(df, file_name):
     
 ###################################################################################################################################################Splitting Data
 
+@instrumented()
 def split_data(df):
     """
     Split the transformed data into train and test sets.
@@ -145,20 +888,14 @@ def split_data(df):
         logger.error(error_message)
         raise CustomException(error_message, error_detail=sys.exc_info())
 
-def save_split_data(train_df, test_df):
+def save_split_data(train_df, test_df, fmt=ARTIFACT_FORMAT):
     """
     Save train and test data to artifacts folder.
     """
     try:
-        # Create artifacts directory if it doesn't exist
-        if not os.path.exists(ARTIFACTS_DIR):
-            os.makedirs(ARTIFACTS_DIR)
-
         # Save train and test data
-        train_file_path = os.path.join(ARTIFACTS_DIR, 'train_data.csv')
-        test_file_path = os.path.join(ARTIFACTS_DIR, 'test_data.csv')
-        train_df.to_csv(train_file_path, index=False)
-        test_df.to_csv(test_file_path, index=False)
+        train_file_path = save_artifact(train_df, 'train_data', fmt)
+        test_file_path = save_artifact(test_df, 'test_data', fmt)
         logger.info("Train data saved successfully to %s", train_file_path)
         logger.info("Test data saved successfully to %s", test_file_path)
     except Exception as e:
@@ -183,10 +920,33 @@ def save_model(model, model_name):
         model_dir = os.path.join(ARTIFACTS_DIR, "models")
         os.makedirs(model_dir, exist_ok=True)
         model_file = os.path.join(model_dir, model_name)
-        with open(model_file, 'wb') as f:
+        # Write under a temporary name so a reader never unpickles a partial file
+        with open(model_file + '.tmp', 'wb') as f:
             pickle.dump(model, f)
+        os.replace(model_file + '.tmp', model_file)
         logger.info("Model saved successfully to %s", model_file)
     except Exception as e:
         error_message = f"Error saving model: {str(e)}"
         logger.error(error_message)
         raise CustomException(error_message, error_detail=sys.exc_info())
+
+
+def save_report(report, file_name, report_dir=None):
+    """
+    Save a JSON report to the reports folder of the artifacts directory, or to `report_dir`, and
+    return its path. The report is written under a temporary name and renamed into place, so a
+    crash never leaves a truncated report behind.
+    """
+    try:
+        report_dir = report_dir or os.path.join(ARTIFACTS_DIR, "reports")
+        os.makedirs(report_dir, exist_ok=True)
+        report_file = os.path.join(report_dir, file_name)
+        with open(report_file + '.tmp', 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        os.replace(report_file + '.tmp', report_file)
+        logger.info("Report saved successfully to %s", report_file)
+        return report_file
+    except Exception as e:
+        error_message = f"Error saving report: {str(e)}"
+        logger.error(error_message)
+        raise CustomException(error_message, error_detail=sys.exc_info())